@@ -1,27 +1,80 @@
 """ controlls accessories, either motor or light control """
 
-from machine import Pin
+from machine import Pin, PWM, Timer
+import uasyncio as asyncio
 import utime
 
 class Accessory:
-    def __init__(self, accessory_pin:int):
+    def __init__(self, accessory_pin:int, pwm_freq:int = 0, bus=None, topic:int = 0, planter:int = -1):
+        """ with pwm_freq the accessory is driven by PWM and can be dimmed with set_level. With bus every switch
+        on or off is published as topic for planter """
         self.pin = Pin(accessory_pin, Pin.OUT)
-        
-    def turn_on(self, duration:int = 0):
-        """ turns on motor for "duration" number of seconds. if unspecified then leaves it on """
-        self.pin.value(1)
-        
+        self.pwm = None
+        if pwm_freq:
+            self.pwm = PWM(self.pin)
+            self.pwm.freq(pwm_freq)
+            self.pwm.duty_u16(0)
+
+        self.duty = 0xFFFF # PWM duty used while on
+        self.on = False
+        self.bus = bus
+        self.topic = topic
+        self.planter = planter
+
+        # one-shot timer ends timed runs, callback is bound once so the timer does not allocate
+        self.timer = Timer()
+        self._timer_off = self._on_timer
+
+    def _output(self, on:bool):
+        changed = on != self.on
+        self.on = on
+        if self.pwm is not None:
+            self.pwm.duty_u16(self.duty if on else 0)
+        else:
+            self.pin.value(1 if on else 0)
+
+        if changed and self.bus is not None:
+            self.bus.publish(self.topic, self.planter, 1 if on else 0)
+
+    def turn_on(self, duration:float = 0):
+        """ turns on motor for "duration" number of seconds. if unspecified then leaves it on.
+        returns right away, a one-shot timer turns it off """
+        self.timer.deinit()
+        self._output(True)
+
         if duration: # if duration is left blank, this part will not execute and accessory will stay on
-            utime.sleep_ms(duration * 1000)
-            self.turn_off()
-        
+            self.timer.init(mode=Timer.ONE_SHOT, period=int(duration * 1000), callback=self._timer_off)
+
+    def _on_timer(self, timer):
+        self._output(False)
+
     def turn_off(self):
         """ turns off motor """
-        self.pin.value(0)
-        
+        self.timer.deinit()
+        self._output(False)
+
+    def is_on(self):
+        """ returns True if accessory is currently on """
+        return self.on
+
+    def set_level(self, percent:int):
+        """ sets brightness or speed for PWM driven accessory, applied right away if it is on """
+        self.duty = max(0, min(100, percent)) * 0xFFFF // 100
+        if self.on:
+            self._output(True)
+
+    async def pulse(self, seconds:float):
+        """ awaitable version of turn_on(duration), other tasks keep running while accessory is on """
+        self.turn_on(seconds)
+        try:
+            await asyncio.sleep_ms(int(seconds * 1000))
+        finally:
+            self.turn_off()
+
 
 if __name__ == '__main__':
     motor = Accessory(3)
-    
+
     motor.turn_on(1)
-    
+    utime.sleep(2)
+
@@ -0,0 +1,51 @@
+""" Measures startup: time and heap used by every import and constructor that goes through load and construct.
+Kept tiny with no imports beyond gc and utime, so it can be the first thing main.py loads """
+
+import gc
+import utime
+
+steps = [] # (label, us, heap bytes)
+started = utime.ticks_us()
+
+
+def _record(label:str, start_us:int, start_heap:int):
+    steps.append((label, utime.ticks_diff(utime.ticks_us(), start_us), gc.mem_alloc() - start_heap))
+
+
+def load(name:str):
+    """ Imports module by name and records what it cost, modules already imported cost nothing """
+    start_us, start_heap = utime.ticks_us(), gc.mem_alloc()
+    module = __import__(name)
+    compiled = getattr(module, '__file__', '').endswith('.mpy')
+    _record('import ' + name + (' (mpy)' if compiled else ''), start_us, start_heap)
+    return module
+
+
+def construct(label:str, cls, *args, **kwargs):
+    """ Calls cls(*args, **kwargs) and records what it cost """
+    start_us, start_heap = utime.ticks_us(), gc.mem_alloc()
+    instance = cls(*args, **kwargs)
+    _record(label, start_us, start_heap)
+    return instance
+
+
+def mark(label:str):
+    """ Records a point in time, e.g. first screen shown """
+    steps.append((label, utime.ticks_diff(utime.ticks_us(), started), None))
+
+
+def report():
+    """ Returns list of text lines, one per step """
+    profiled_ms = utime.ticks_diff(utime.ticks_us(), started) // 1000
+    lines = [f"{utime.ticks_ms()} ms since power on, {profiled_ms} ms since profiling started"]
+    for label, us, heap in steps:
+        if heap is None:
+            lines.append(f"{label:<24} at {us / 1000:8.1f} ms")
+        else:
+            lines.append(f"{label:<24} {us / 1000:8.1f} ms {heap:7} B")
+    return lines
+
+
+def print_report():
+    for line in report():
+        print(line)
@@ -0,0 +1,61 @@
+""" Publish/subscribe between the modules held by Manager. Publishers only publish when a value really changed, so
+subscribers such as the display and the log do nothing at all while the planter sits idle. Subscriber lists are
+allocated up front and publishing allocates nothing """
+
+from array import array
+
+# topics, published as (topic, planter, value)
+MOISTURE = 0 # moisture % moved by report_delta since it was last published
+PUMP = 1 # pump switched, value 1 on, 0 off
+LIGHT = 2 # grow light switched, planter is ALL
+CONFIG = 3 # a setting of the planter changed
+DAY = 4 # a new day started, value is days since epoch, planter is ALL
+FORECAST = 5 # hours until the planter needs water changed, -1 without forecast
+TOPICS = 6
+
+ALL = -1 # planter of events that concern every planter
+UNSET = -0x40000000 # nothing published yet, still a small int
+
+
+class Bus:
+    SLOTS = 4 # subscribers per topic
+
+    def __init__(self):
+        self.handlers = [[None] * self.SLOTS for _ in range(TOPICS)]
+        self.counts = bytearray(TOPICS)
+        self.published = 0
+
+    def subscribe(self, topic:int, handler):
+        """ handler(topic, planter, value) is called for every event of topic. It runs in the publisher's context,
+        which can be a timer callback or core 1, so it should only note the change and wake its own task """
+        count = self.counts[topic]
+        if count == self.SLOTS:
+            raise ValueError('no subscriber slot left')
+        self.handlers[topic][count] = handler
+        self.counts[topic] = count + 1
+
+    def publish(self, topic:int, planter:int = ALL, value:int = 0):
+        handlers = self.handlers[topic]
+        for i in range(self.counts[topic]):
+            handlers[i](topic, planter, value)
+        self.published += 1
+
+
+class Reporter:
+    """ Publishes a value per planter whenever it moved by at least delta since it was last published, so noise
+    around a value does not turn into a stream of events """
+
+    def __init__(self, bus:Bus, topic:int, planters:int, delta:int = 1):
+        self.bus = bus
+        self.topic = topic
+        self.delta = delta
+        self.last = array('i', [UNSET] * planters)
+
+    def update(self, planter:int, value:int):
+        """ Returns True if value was published """
+        last = self.last[planter]
+        if last != UNSET and -self.delta < value - last < self.delta:
+            return False
+        self.last[planter] = value
+        self.bus.publish(self.topic, planter, value)
+        return True
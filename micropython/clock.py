@@ -0,0 +1,125 @@
+""" Wall clock anchored to ticks_ms. The RTC is read once and time is derived from ticks afterwards, the date and
+day number are cached and only recomputed at midnight. NTP corrections are slewed in instead of jumping """
+
+import uasyncio as asyncio
+import utime
+from machine import RTC
+
+from bus import ALL, DAY as NEW_DAY
+
+DAY = 24 * 60 * 60 # seconds
+
+
+class Clock:
+    VALID_YEAR = 2024 # RTC starts in 2021 after power up, anything earlier than this was never set
+    SLEW_RATE = 2_000 # ms of running time per ms of correction, i.e. clock runs at most 0.05% fast or slow
+    STEP_LIMIT = 60_000 # ms, larger corrections are applied at once
+    ANCHOR_PERIOD = 60 * 60_000 # ms between re-anchoring, well inside the ticks_ms wrap around of ~6 days
+
+    def __init__(self, bus=None):
+        """ With bus the start of every new day is published as a DAY event """
+        self.bus = bus
+        self.corrections = 0
+        self.steps = 0
+        self.day_number = None
+        self.sync_from_rtc()
+
+    def sync_from_rtc(self):
+        """ Anchors clock to the RTC """
+        self._anchor(utime.time() * 1000)
+
+    def _anchor(self, epoch_ms:int, slew_ms:int = 0):
+        self.anchor_ms = epoch_ms
+        self.anchor_ticks = utime.ticks_ms()
+        self.slew_ms = slew_ms # correction still to be applied
+        self._new_day()
+
+    def _applied(self, elapsed:int):
+        """ Part of slew_ms applied after elapsed ms """
+        slew = self.slew_ms
+        step = elapsed // self.SLEW_RATE
+        if slew >= 0:
+            return slew if step >= slew else step
+        return slew if step >= -slew else -step
+
+    def now_ms(self):
+        """ Milliseconds since epoch """
+        elapsed = utime.ticks_diff(utime.ticks_ms(), self.anchor_ticks)
+        return self.anchor_ms + elapsed + (self._applied(elapsed) if self.slew_ms else 0)
+
+    def time(self):
+        """ Seconds since epoch, same as utime.time() """
+        return self.now_ms() // 1000
+
+    def localtime(self):
+        return utime.localtime(self.time())
+
+    def _new_day(self):
+        now = self.time()
+        day, self.day_number = self.day_number, now // DAY
+        self.today = utime.localtime(now)[:3]
+        self.next_midnight = utime.ticks_add(utime.ticks_ms(), (DAY - now % DAY) * 1000)
+        if self.bus is not None and day is not None and day != self.day_number:
+            self.bus.publish(NEW_DAY, ALL, self.day_number)
+
+    def _check_day(self):
+        if utime.ticks_diff(utime.ticks_ms(), self.next_midnight) >= 0:
+            self._new_day()
+
+    def day(self):
+        """ Days since epoch, cached until midnight """
+        self._check_day()
+        return self.day_number
+
+    def date(self):
+        """ (year, month, day), cached until midnight """
+        self._check_day()
+        return self.today
+
+    def hour(self, offset_min:int = 0):
+        """ Hour of the day in UTC, which NTP sets, or in the time zone offset_min minutes ahead of UTC """
+        return (self.time() + offset_min * 60) % DAY // 3600
+
+    def is_valid(self):
+        """ True if clock holds a real date """
+        return self.date()[0] >= self.VALID_YEAR
+
+    def days_since(self, seconds:int):
+        """ Whole days from the day seconds falls on until today """
+        return self.day() - seconds // DAY
+
+    def set(self, seconds:int):
+        """ Jumps to seconds since epoch and sets the RTC, so the time survives soft resets """
+        year, month, day, hour, minute, second, weekday, yearday = utime.localtime(seconds)
+        RTC().datetime((year, month, day, weekday, hour, minute, second, 0))
+        self._anchor(seconds * 1000)
+        self.steps += 1
+
+    def correct(self, seconds:int):
+        """ Moves towards seconds since epoch, e.g. from NTP. Small differences are slewed in at SLEW_RATE, large
+        ones and the first valid time are set at once """
+        offset = seconds * 1000 - self.now_ms()
+        self.corrections += 1
+        if not self.is_valid() or abs(offset) > self.STEP_LIMIT:
+            self.set(seconds)
+        else:
+            self._anchor(self.now_ms(), offset)
+
+    def reanchor(self):
+        """ Moves anchor to now so ticks_diff never wraps, and brings the RTC in line with the slewed time """
+        elapsed = utime.ticks_diff(utime.ticks_ms(), self.anchor_ticks)
+        applied = self._applied(elapsed) if self.slew_ms else 0
+        remaining = self.slew_ms - applied
+        self.anchor_ms += elapsed + applied
+        self.anchor_ticks = utime.ticks_add(self.anchor_ticks, elapsed)
+        self.slew_ms = remaining
+
+        if self.is_valid():
+            year, month, day, hour, minute, second, weekday, yearday = utime.localtime(self.anchor_ms // 1000)
+            RTC().datetime((year, month, day, weekday, hour, minute, second, 0))
+
+    async def run(self):
+        """ Task that re-anchors every ANCHOR_PERIOD """
+        while True:
+            await asyncio.sleep_ms(self.ANCHOR_PERIOD)
+            self.reanchor()
@@ -1,58 +1,196 @@
+import os
+import uasyncio as asyncio
 import ujson
 import utime
-from machine import RTC
+
+from bus import CONFIG
+
+# shared settings added since the first settings files, older files get them with these values on load
+DEFAULTS = {
+    'light_duration': 14, 'light_on_hour': 7, 'utc_offset_min': 0, 'light_pin': 2, 'light_level': 100, 'light_pwm_freq': 1000,
+    'sample_period_ms': 100, 'sample_window': 32, 'adaptive_sampling': True, 'mux_pins': [], 'mux_adc_pin': 26,
+    'pump_pulse_s': 3, 'soak_s': 60, 'hysteresis': 5, 'min_off_s': 1800, 'water_budget_s': 60,
+    'report_delta': 2, 'log_budget_bytes': 65536, 'dual_core': False, 'low_power': False,
+    'stats': [], 'stats_period_s': 60,
+    'telemetry_port': 80, 'telemetry_url': '', 'telemetry_push_s': 900, 'telemetry_buffer': 128,
+}
 
 class Config():
+        SETTINGS_FILE = 'settings.json'
+        TEMP_FILE = 'settings.tmp'
+        FLUSH_DELAY = 3_000 # ms to wait for more changes before writing to flash
+
+        # settings every planter has its own value for. Planters may also override shared settings such as
+        # hysteresis or water_budget_s, see planter_item
+        PLANTER_KEYS = ('name', 'start_date', 'adc_pin', 'mux_address', 'moisture_sensor_min', 'moisture_sensor_max',
+                        'threshold_moisture', 'pump_pin')
+
         def __init__(self, manager):
             self.manager = manager
-            with open('settings.json', 'r') as f:
+            self.clock = manager.clock
+            self.bus = manager.bus
+            with open(self.SETTINGS_FILE, 'r') as f:
                 self.items = ujson.load(f)
-        
+
+            self.dirty = False # True when items has changes not yet written to flash
+            self.dirty_since = 0 # ticks_ms of first unsaved change
+            self.flash_writes = 0
+            self.lock = None # set by dualcore while core 1 reads planter settings, see planter_item
+
+            if 'planters' not in self.items:
+                self._migrate()
+            self._add_defaults()
+
+            self.planters = self.items['planters']
+            self.start_times = {} # planter -> start_date in seconds since epoch, see get_start_time
+
+
+        def _migrate(self):
+            """Moves planter settings of single planter settings files into a one entry planters list"""
+
+            planter = {'adc_pin': 27, 'mux_address': None, 'pump_pin': 3}
+            for key in self.PLANTER_KEYS:
+                if key in self.items:
+                    planter[key] = self.items.pop(key)
+
+            self.items['planters'] = [planter]
+            self._mark_dirty()
+            print('Settings migrated to planter list')
+
+        def _add_defaults(self):
+            """Adds shared settings the settings file does not have yet, they are saved with the next flush"""
+
+            missing = [key for key in DEFAULTS if key not in self.items]
+            for key in missing:
+                self.items[key] = DEFAULTS[key]
+
+            if missing:
+                self._mark_dirty()
+                print('Settings added:', ', '.join(missing))
+
         def save_settings(self):
-            """Saves settings back to json file"""
-            
-            with open('settings.json', 'w') as f:
+            """Saves settings back to json file. Written to temporary file first and renamed over settings file,
+            so power loss during the write leaves the old settings intact"""
+
+            with open(self.TEMP_FILE, 'w') as f:
                 ujson.dump(self.items, f)
-                
-        
+
+            try:
+                os.rename(self.TEMP_FILE, self.SETTINGS_FILE)
+            except OSError: # file systems that can not rename over existing file
+                os.remove(self.SETTINGS_FILE)
+                os.rename(self.TEMP_FILE, self.SETTINGS_FILE)
+
+            self.dirty = False
+            self.flash_writes += 1
+            print('Settings saved, flash writes:', self.flash_writes)
+
+
+        def flush(self, force:bool = False):
+            """Saves pending changes once FLUSH_DELAY has passed since the first one, or right away if forced.
+            Returns True if settings were written"""
+
+            if not self.dirty:
+                return False
+
+            if not force and utime.ticks_diff(utime.ticks_ms(), self.dirty_since) < self.FLUSH_DELAY:
+                return False
+
+            self.save_settings()
+            return True
+
+
+        async def run_autosave(self):
+            """Task that writes batched changes to flash"""
+
+            while True:
+                await asyncio.sleep_ms(self.FLUSH_DELAY)
+                self.flush()
+
+
+        def _mark_dirty(self):
+            if not self.dirty:
+                self.dirty = True
+                self.dirty_since = utime.ticks_ms()
+
+
+        def planter_item(self, planter:int, key:str):
+            """Returns setting of a planter, falling back to the shared value if the planter does not override it"""
+
+            if self.lock is not None:
+                with self.lock: # rp2 has no GIL, a dict must not be read while the other core resizes it
+                    return self._planter_item(planter, key)
+            return self._planter_item(planter, key)
+
+
+        def _planter_item(self, planter:int, key:str):
+            items = self.planters[planter]
+            return items[key] if key in items else self.items.get(key)
+
+
+        def set_planter_item(self, planter:int, key:str, value):
+            """Sets value of an item for a single planter, only marks settings for saving if value actually changed"""
+
+            items = self.planters[planter]
+            if key in items and items[key] == value:
+                return False
+
+            self._mark_dirty()
+            if self.lock is not None:
+                with self.lock:
+                    items[key] = value
+            else:
+                items[key] = value
+            self.bus.publish(CONFIG, planter)
+            return True
+
+
         def get_items(self):
             """For ease of listing all items being kept track in settings.json"""
-            
+
             return self.items
-        
-        
-        def set_start_date(self, new_date:tuple):
+
+
+        def set_start_date(self, new_date:tuple, planter:int = 0):
             """Sets new start_date"""
-            
-            self.items['start_date'] = new_date[0:3]
-            self.save_settings()
-            
-        
-        def set_moisture_threshold(self, new_level):
+
+            self.start_times.pop(planter, None)
+            self.set_planter_item(planter, 'start_date', list(new_date[0:3]))
+
+
+        def set_moisture_threshold(self, new_level, planter:int = 0):
             """Sets new moisure_threshold"""
-            
-            self.items['threshold_moisture'] = new_level
-            self.save_settings()
-            
-            
-        def set_moisture_sensor_settings(self, min_value:int, max_value:int):
-            """Set new moisure sensor min and max values, and saves to json file"""
-            
-            self.items['moisture_sensor_min'] = min_value
-            self.items['moisture_sensor_max'] = max_value
-            self.save_settings()
-            
 
-        def get_days_grown(self):        
+            self.set_planter_item(planter, 'threshold_moisture', new_level)
+
+
+        def set_moisture_sensor_settings(self, min_value:int, max_value:int, planter:int = 0, quality:dict = None):
+            """Set new moisure sensor min and max values and how well they were measured, and saves to json file"""
+
+            self.set_planter_item(planter, 'moisture_sensor_min', min_value)
+            self.set_planter_item(planter, 'moisture_sensor_max', max_value)
+            if quality is not None:
+                self.set_planter_item(planter, 'calibration_quality', quality)
+            self.flush(force=True) # calibration is too expensive to lose
+
+
+        def get_start_time(self, planter:int = 0):
+            """Returns midnight of start_date in seconds since epoch, cached until the date changes"""
+
+            start = self.start_times.get(planter)
+            if start is None:
+                year, month, day = self.planters[planter]['start_date'][:3]
+                start = self.start_times[planter] = utime.mktime((year, month, day, 0, 0, 0, 0, 0))
+            return start
+
+
+        def get_days_grown(self, planter:int = 0):
             """Returns number of days since start_date"""
-            
-            time1 = utime.mktime((list(self.items['start_date']) + [1] * 8)[:8])
-            time2 = utime.mktime(RTC().datetime())
-            
-            return (time2 - time1) // (24 * 60 * 60)
-        
-        
-        
+
+            return self.clock.days_since(self.get_start_time(planter))
+
+
+
 if __name__ == '__main__':
     s = Config()
     print(s.items)
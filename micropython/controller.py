@@ -0,0 +1,225 @@
+""" Closed-loop watering and grow light control. Pump pulses are ended by one-shot timers, so nothing here
+blocks and the UI keeps running while the pump is on """
+
+import uasyncio as asyncio
+import utime
+
+from accessory import Accessory
+from bus import LIGHT, MOISTURE, PUMP, Reporter
+
+class Channel:
+    """ Watering state of one planter """
+
+    def __init__(self, planter:int, sensor, pump_pin:int, bus=None):
+        self.planter = planter
+        self.sensor = sensor
+        self.pump = Accessory(pump_pin, bus=bus, topic=PUMP, planter=planter)
+        self.state = Controller.IDLE
+        self.state_since = utime.ticks_ms()
+        self.last_watering = None # ticks_ms when last watering cycle ended, None once min_off_s passed
+        self.pumped_ms_today = 0
+        self.pulses = 0
+        self.paused = False # set while sensor is being calibrated
+
+    def set_state(self, state:int):
+        self.state = state
+        self.state_since = utime.ticks_ms()
+
+
+class Controller:
+    # pump states
+    IDLE = 0 # moisture is fine, or waiting for min_off_s after last watering
+    PUMPING = 1 # pulse running, timer turns pump off
+    SOAKING = 2 # waiting soak_s for water to reach the sensor before deciding on next pulse
+
+    LIGHT_PERIOD = 60_000 # ms between grow light schedule checks
+
+    def __init__(self, manager):
+        self.config = manager.config
+        self.clock = manager.clock
+        self.scanner = manager.scanner
+        items = self.config.items
+
+        self.channels = [Channel(planter, sensor, self.config.planter_item(planter, 'pump_pin'), manager.bus)
+                         for planter, sensor in enumerate(manager.moisture_sensors)]
+        self.light = Accessory(items['light_pin'], pwm_freq=items['light_pwm_freq'], bus=manager.bus, topic=LIGHT)
+        self.period = items['sample_period_ms'] # react within one sampling period
+        self.reports = Reporter(manager.bus, MOISTURE, len(self.channels), items['report_delta'])
+
+        # only one pump runs at a time, planters take turns starting with this one
+        self.next_channel = 0
+        self.day = None # day since epoch pumped_ms_today belongs to
+        self.light_checked = None
+
+    def _elapsed_s(self, ticks):
+        return utime.ticks_diff(utime.ticks_ms(), ticks) // 1000
+
+    def _new_day(self):
+        """ Resets daily water budgets at midnight """
+        day = self.clock.day()
+        if day != self.day:
+            self.day = day
+            for channel in self.channels:
+                channel.pumped_ms_today = 0
+
+    def pumping(self):
+        """ True while any pump is on """
+        for channel in self.channels:
+            if channel.pump.is_on():
+                return True
+        return False
+
+    def pulses(self):
+        return sum(channel.pulses for channel in self.channels)
+
+    def pumped_ms_today(self):
+        return sum(channel.pumped_ms_today for channel in self.channels)
+
+    # state of one planter, Snapshot in dualcore has the same methods for when the controller runs on core 1
+    def moisture_pct(self, planter:int):
+        return self.channels[planter].sensor.get_moisture_pct()
+
+    def raw(self, planter:int):
+        """ Filtered ADC reading, None until the first sample """
+        sampler = self.channels[planter].sensor.sampler
+        return sampler.ema() if sampler.ready() else None
+
+    def pump_on(self, planter:int):
+        return self.channels[planter].pump.is_on()
+
+    def planter_pulses(self, planter:int):
+        return self.channels[planter].pulses
+
+    def planter_pumped_ms(self, planter:int):
+        return self.channels[planter].pumped_ms_today
+
+    def light_on(self):
+        return self.light.is_on()
+
+    def budget_left_ms(self, channel:Channel):
+        return max(0, self.config.planter_item(channel.planter, 'water_budget_s') * 1000 - channel.pumped_ms_today)
+
+    def _end_watering(self, channel:Channel):
+        channel.last_watering = utime.ticks_ms()
+        channel.set_state(self.IDLE)
+
+    def _pulse(self, channel:Channel):
+        """ Starts pump pulse, or ends watering if daily budget is used up. Returns True if pump was started """
+        pulse_ms = min(self.config.planter_item(channel.planter, 'pump_pulse_s') * 1000, self.budget_left_ms(channel))
+        if pulse_ms <= 0:
+            print('Daily water budget used up, planter', channel.planter)
+            self._end_watering(channel)
+            return False
+
+        channel.pump.turn_on(pulse_ms / 1000)
+        channel.pumped_ms_today += pulse_ms
+        channel.pulses += 1
+        channel.set_state(self.PUMPING)
+        return True
+
+    def _wants_pulse(self, channel:Channel):
+        """ Compares filtered moisture against threshold_moisture of the planter, True if it needs a pulse """
+        if channel.paused or channel.state == self.PUMPING:
+            return False
+
+        moisture = channel.sensor.get_moisture_pct()
+        if moisture is None:
+            return False
+
+        planter = channel.planter
+        threshold = self.config.planter_item(planter, 'threshold_moisture')
+
+        if channel.state == self.SOAKING:
+            if self._elapsed_s(channel.state_since) < self.config.planter_item(planter, 'soak_s'):
+                return False
+
+            # keep watering until moisture is above threshold by the hysteresis
+            if moisture >= threshold + self.config.planter_item(planter, 'hysteresis'):
+                self._end_watering(channel)
+                return False
+            return True
+
+        if moisture >= threshold:
+            return False
+
+        if channel.last_watering is not None: # min_off_s not over yet, see _check_rest
+            return False
+
+        return True
+
+    def _check_rest(self, channel:Channel):
+        """ Forgets the last watering once min_off_s passed. Checked on every pass, ticks_ms wraps after ~6 days
+        and a watering that long ago would look recent again """
+        if (channel.last_watering is not None and
+                self._elapsed_s(channel.last_watering) >= self.config.planter_item(channel.planter, 'min_off_s')):
+            channel.last_watering = None
+
+    def update_pump(self):
+        """ Starts pulses for planters that need water, one pump at a time so the supply is never shared """
+        busy = False
+        for channel in self.channels:
+            self._check_rest(channel)
+            if channel.state == self.PUMPING:
+                if channel.pump.is_on():
+                    busy = True
+                else: # pulse timer ran out
+                    channel.set_state(self.SOAKING)
+
+        channels = self.channels
+        count = len(channels)
+        for offset in range(count):
+            index = (self.next_channel + offset) % count
+            channel = channels[index]
+
+            # planters that need water while another pump runs keep their state and get their turn later
+            if self._wants_pulse(channel) and not busy:
+                busy = self._pulse(channel)
+                if busy:
+                    self.next_channel = (index + 1) % count
+
+    def update_light(self):
+        """ Keeps grow light on at light_level for light_duration hours starting at light_on_hour local time """
+        items = self.config.items
+        hours_on = (self.clock.hour(items['utc_offset_min']) - items['light_on_hour']) % 24
+
+        self.light.set_level(items['light_level'])
+        if hours_on < items['light_duration']:
+            if not self.light.is_on():
+                self.light.turn_on()
+        elif self.light.is_on():
+            self.light.turn_off()
+
+    def pause(self, planter:int):
+        """ Stops pump of planter and keeps it off until resume, e.g. during calibration. Its probe is read on every
+        scanner round until then """
+        channel = self.channels[planter]
+        channel.paused = True
+        self.scanner.set_stretch(planter, 1)
+        channel.pump.turn_off()
+        self._end_watering(channel)
+
+    def resume(self, planter:int):
+        self.channels[planter].paused = False
+
+    def report(self):
+        """ Publishes moisture of the planters whose moisture moved by report_delta """
+        for channel in self.channels:
+            moisture = channel.sensor.get_moisture_pct()
+            if moisture is not None:
+                self.reports.update(channel.planter, moisture)
+
+    def step(self):
+        """ One control pass, due once per period """
+        if self.light_checked is None or utime.ticks_diff(utime.ticks_ms(), self.light_checked) >= self.LIGHT_PERIOD:
+            self.light_checked = utime.ticks_ms()
+            self._new_day()
+            self.update_light()
+
+        self.update_pump()
+        self.report()
+
+    async def run(self):
+        """ Task that runs the controller once per sampling period """
+        while True:
+            self.step()
+            await asyncio.sleep_ms(self.period)
@@ -0,0 +1,152 @@
+""" Append-only binary log of sensor readings, kept in rotating segment files within a byte budget """
+
+import os
+import ustruct
+
+def pack_record(buffer, pos:int, timestamp:int, raw:int, moisture_pct:int, state:int = 0, planter:int = 0):
+    """ Packs one reading into buffer at pos in the format of the log files, returns position after it """
+    moisture_pct = max(-128, min(127, moisture_pct))
+    state |= planter << DataLog.PLANTER_SHIFT
+    ustruct.pack_into(DataLog.RECORD_FORMAT, buffer, pos, timestamp, raw, moisture_pct, state)
+    return pos + DataLog.RECORD_SIZE
+
+
+class DataLog:
+    RECORD_FORMAT = '<IHbB' # timestamp, raw ADC value, moisture percent, actuator state
+    RECORD_SIZE = ustruct.calcsize(RECORD_FORMAT)
+    PAGE_SIZE = 256 # records are buffered in RAM and written a page at a time
+    SEGMENTS = 4 # byte budget is split between this many files, oldest is deleted when a new one is started
+
+    # actuator state bits
+    PUMP = 1
+    LIGHT = 2
+    PLANTER_SHIFT = 4 # upper bits of state hold the planter number
+
+    def __init__(self, budget_bytes:int = 65536, prefix:str = 'log'):
+        self.prefix = prefix
+        self.segment_bytes = max(self.PAGE_SIZE, budget_bytes // self.SEGMENTS)
+
+        self.page = bytearray(self.PAGE_SIZE - self.PAGE_SIZE % self.RECORD_SIZE)
+        self.page_mv = memoryview(self.page)
+        self.page_pos = 0
+
+        segments = self._segments()
+        self.segment = segments[-1] if segments else 0
+        try:
+            self.segment_size = os.stat(self._segment_name(self.segment))[6]
+        except OSError:
+            self.segment_size = 0
+
+        self.flash_writes = 0
+
+    def _segment_name(self, number:int):
+        return f"{self.prefix}_{number}.bin"
+
+    def _segments(self):
+        """ Returns numbers of existing segment files, oldest first """
+        numbers = []
+        start = self.prefix + '_'
+
+        for name in os.listdir():
+            if name.startswith(start) and name.endswith('.bin'):
+                try:
+                    numbers.append(int(name[len(start):-4]))
+                except ValueError:
+                    pass
+
+        numbers.sort()
+        return numbers
+
+    def record(self, timestamp:int, raw:int, moisture_pct:int, state:int = 0, planter:int = 0):
+        """ Adds reading to RAM buffer, buffer is written to flash once it holds a full page """
+        self.page_pos = pack_record(self.page, self.page_pos, timestamp, raw, moisture_pct, state, planter)
+
+        if self.page_pos == len(self.page):
+            self.flush()
+
+    def flush(self):
+        """ Writes buffered records to current segment, starting new segment if it would go over its size """
+        if not self.page_pos:
+            return
+
+        if self.segment_size + self.page_pos > self.segment_bytes:
+            self._rotate()
+
+        with open(self._segment_name(self.segment), 'ab') as f:
+            f.write(self.page_mv[:self.page_pos])
+
+        self.segment_size += self.page_pos
+        self.page_pos = 0
+        self.flash_writes += 1
+
+    def _rotate(self):
+        """ Starts new segment and deletes the oldest ones that no longer fit in the budget """
+        self.segment += 1
+        self.segment_size = 0
+
+        segments = self._segments()
+        while len(segments) >= self.SEGMENTS:
+            os.remove(self._segment_name(segments.pop(0)))
+
+    def records(self, planter:int = None):
+        """ Yields (timestamp, raw, moisture_pct, state) for every record of planter, or of all planters if None,
+        oldest first. Files are read one page at a time so memory use does not depend on log size """
+        for record in self._all_records():
+            if planter is None or record[3] >> self.PLANTER_SHIFT == planter:
+                yield record
+
+    def _all_records(self):
+        buffer = bytearray(len(self.page))
+
+        for number in self._segments():
+            with open(self._segment_name(number), 'rb') as f:
+                while True:
+                    length = f.readinto(buffer)
+                    if not length:
+                        break
+
+                    for pos in range(0, length - length % self.RECORD_SIZE, self.RECORD_SIZE):
+                        yield ustruct.unpack_from(self.RECORD_FORMAT, buffer, pos)
+
+        # records not yet flushed
+        for pos in range(0, self.page_pos, self.RECORD_SIZE):
+            yield ustruct.unpack_from(self.RECORD_FORMAT, self.page, pos)
+
+    def summarize(self, period:int, origin:int = 0, planter:int = 0):
+        """ Yields (bucket, count, min, max, mean) of moisture percent for every period seconds that has readings.
+        bucket is the number of periods since origin, e.g. period=86400 and origin=start date gives days grown """
+        bucket = None
+
+        for timestamp, raw, moisture_pct, state in self.records(planter):
+            current = (timestamp - origin) // period
+
+            if current != bucket:
+                if bucket is not None:
+                    yield bucket, count, minimum, maximum, total / count
+
+                bucket = current
+                count = total = 0
+                minimum = maximum = moisture_pct
+
+            count += 1
+            total += moisture_pct
+            if moisture_pct < minimum:
+                minimum = moisture_pct
+            elif moisture_pct > maximum:
+                maximum = moisture_pct
+
+        if bucket is not None:
+            yield bucket, count, minimum, maximum, total / count
+
+    def hourly(self, origin:int = 0, planter:int = 0):
+        return self.summarize(60 * 60, origin, planter)
+
+    def daily(self, origin:int = 0, planter:int = 0):
+        return self.summarize(24 * 60 * 60, origin, planter)
+
+
+if __name__ == '__main__':
+    log = DataLog()
+
+    for day, count, minimum, maximum, mean in log.daily():
+        print(f"day {day}: {count} readings, min {minimum}% max {maximum}% mean {mean:.1f}%")
@@ -1,151 +1,323 @@
 """Manages the LCD display and all that is used to control it"""
 
+import gc
+from machine import Timer
+import uasyncio as asyncio
 import utime
-from machine import RTC
 
-from lcd import LCD
+from bus import ALL, CONFIG, DAY, FORECAST, MOISTURE
+from lcd import LCD, LineBuffer
+from menu import BLANK, CURSOR, Node
 from rotary_select import Rotary
 
 class Display:
-    MENU = ("Show Start Date", "Set Start Date", "Set Moisture", "Calib Moisture")
-    
-    def __init__(self, manager):
+    def __init__(self, manager, lcd=None):
+        """lcd can be passed in when it was already brought up for the splash screen"""
         self.manager = manager
+        self.menu = self.build_menu()
+        
+        self.planter = 0 # planter the screen saver shows and the menu works on
+        self.planter_since = utime.ticks_ms()
+        
+        self.lcd = lcd if lcd is not None else LCD()
+        
+        # screen saver lines are formatted in place, so refreshing them does not allocate
+        self.line_1 = LineBuffer()
+        self.line_2 = LineBuffer()
+        self.line_1_stale = True # name or days grown changed
+        self.stale = True # something the screen saver shows changed
+        self.saver = False # screen saver is on the LCD
+        
+        # the display task sleeps until changed is set, by events on the bus, input, or alarm at the time the screen
+        # saver is due or shows the next planter
+        self.changed = asyncio.ThreadSafeFlag()
+        self.alarm = Timer()
+        self._alarm = self._on_alarm # bound once, so arming the alarm does not allocate
+        on_change = self.on_change
+        for topic in (MOISTURE, FORECAST, CONFIG, DAY):
+            manager.bus.subscribe(topic, on_change)
+        
+        # menu lines are copied from the entries' prerendered labels, values are formatted in place
+        self.menu_lines = (bytearray(BLANK), bytearray(BLANK))
+        self.value_line = LineBuffer()
+        
+        # rotary IRQs only record events and set input_flag, run_input task dispatches them
+        self.input_flag = asyncio.ThreadSafeFlag()
+        self.rotary = Rotary(dt=12, clk=11, sw=13, notify=self.input_flag.set)
+        self.rotary.add_handler(self.handle_rotary_event)
+        
+        self.calibration = None # running calibration task
         
-        self.lcd = LCD()
-        self.rotary = Rotary(dt=12, clk=11, sw=13)
-        self.rotary.add_handler(self.handle_rotary_event)        
+        # set by the power manager when input woke the planter from light sleep, cleared once the input was shown
+        self.woke_at = None # ticks_us
+        self.wake_latency_us = None # wake to redraw for the waking input, of the last wake
         
         self.last_button_press = utime.ticks_ms() - 100_000_000
         
         # set default values
-        self.temp_moisture_setting = self.manager.config.items['threshold_moisture']
+        self.value = 0 # value of the open entry while it is being changed
         self.reset_display_settings() # starts off by displaying menu if selector is used         
     
     
+    def build_menu(self):
+        """Menu entries, Next Planter and Stats are only offered with more than one planter or instrumentation on"""
+        
+        config = self.manager.config
+        menu = [
+            Node("Show Start Date", title="Current Start", prefix="Date: ", value=self.get_start_date),
+            Node("Set Start Date", title="Start Date Set", prefix=" To: ", value=self.get_start_date,
+                 enter=self.set_date),
+            Node("Set Moisture", title="Set Moisture", prefix="    New: ", unit="%", value=self.get_moisture,
+                 step=1, fast_step=5, commit=self.set_moisture),
+            Node("Calib Moisture", enter=self.calibrate_moisture_sentor),
+        ]
+        if len(config.planters) > 1:
+            menu.append(Node("Next Planter", enter=self.next_planter, render=self.show_planter))
+        if config.items['stats']:
+            menu.append(Node("Stats", render=self.show_stats))
+        return menu
+    
+    
     def reset_display_settings(self):
         """Resets display to start next display menu and start at menu choice 1"""
         
         self.position = 0
-        self.selector_function = self.display_menu
+        self.node = None # open menu entry, None while the menu itself is shown
+        
+        
+    def next_planter(self):
+        """Moves screen saver and menu on to the next planter"""
+        
+        self.planter = (self.planter + 1) % len(self.manager.config.planters)
+        self.planter_since = utime.ticks_ms()
+        self.line_1_stale = self.stale = True
+        
         
+    def on_change(self, topic, planter, value):
+        """Bus subscriber, marks the screen saver stale if the event concerns the planter it shows. Runs wherever the
+        event was published, so it only wakes the display task"""
         
-    def display_text(self, line_1:str="", line_2:str=""):
-        """Display test via external facing call"""
+        if planter != self.planter and planter != ALL:
+            return
+        if topic == CONFIG or topic == DAY:
+            self.line_1_stale = True
+        self.stale = True
+        self.changed.set()
         
-        self.lcd.clear()
-        self.lcd.lcd_string(line_1, 0)
-        self.lcd.lcd_string(line_2, 1)
+        
+    def wake_in(self, ms:int):
+        """Wakes the display task after ms even if nothing else happens"""
+        
+        self.alarm.init(mode=Timer.ONE_SHOT, period=max(1, ms), callback=self._alarm)
+        
+        
+    def _on_alarm(self, timer):
+        self.changed.set()
+        
+        
+    def display_text(self, line_1="", line_2=""):
+        """Display test via external facing call, only changed characters are sent to the LCD"""
+        
+        self.lcd.write_frame(line_1, line_2)
     
     
-    def handle_rotary_event(self, event_type):
-        """Handles events after rotary selector input"""
+    async def run_input(self):
+        """Task that handles queued rotary events as soon as they come in"""
         
-        if event_type == self.rotary.ROT_CW:
-            self.position += 1
-        elif event_type == self.rotary.ROT_CCW:
-            self.position -= 1
-        elif event_type == self.rotary.SW_RELEASE:
-             pass
+        while True:
+            await self.input_flag.wait()
+            self.rotary.dispatch()
+    
+    
+    def handle_rotary_event(self, event_type, steps=1):
+        """Handles events after rotary selector input, steps is the number of merged detents"""
+        
+        if not self.lcd.backlight: # switched off by the power manager, the event still counts
+            self.lcd.set_backlight(True)
+        
+        if self.calibration is not None:
+            return # calibration has the screen until it is done
+        
+        if event_type == self.rotary.ROT_CW or event_type == self.rotary.ROT_CCW:
+            if event_type == self.rotary.ROT_CCW:
+                steps = -steps
+            node = self.node
+            if node is None:
+                self.position = max(0, min(len(self.menu) - 1, self.position + steps))
+            elif node.step:
+                step = node.fast_step if self.rotary.spinning_fast() else node.step
+                self.value = max(node.low, min(node.high, self.value + steps * step))
         elif event_type == self.rotary.SW_PRESS:
-            if self.selector_function == self.display_menu:
-                if self.position == 0:
-                    self.selector_function = self.get_date
-                elif self.position == 1:
-                    self.selector_function = self.set_date
-                elif self.position == 2:
-                    self.selector_function = self.set_moisture
-                elif self.position == 3:
-                    self.selector_function = self.calibrate_moisture_sentor
+            if self.node is None:
+                self.open(self.menu[self.position])
             else:
-                self.manager.config.set_moisture_threshold(self.temp_moisture_setting)
-                self.selector_function = self.display_menu
-                
-            self.position = 0
+                if self.node.commit is not None:
+                    self.node.commit(self.value)
+                self.reset_display_settings()
         
         self.last_button_press = utime.ticks_ms()
-        self.selector_function()
+        self.saver = False
+        self.draw()
+        self.changed.set() # display task starts counting towards the screen saver again
         
+        if self.woke_at is not None:
+            self.wake_latency_us = utime.ticks_diff(utime.ticks_us(), self.woke_at)
+            self.woke_at = None
         
-    def display_menu(self):
-        """Displays menu on LCD"""
         
-        self.position = max(0, min(len(self.MENU) - 1, self.position))
+    def open(self, node):
+        """Runs entry's enter action and takes the value to change from its getter"""
         
-        line_1 = f">{self.MENU[self.position]}"
-        try:
-            line_2 = f" {self.MENU[self.position + 1]}"
-        except IndexError:
-            line_2 = ""
+        self.node = node
+        if node.enter is not None:
+            node.enter()
+        if node.step:
+            self.value = node.value()
+    
+    
+    def draw(self):
+        """Shows the menu or the open entry"""
         
-        self.display_text(line_1, line_2)
+        if self.calibration is not None:
+            return # started by the entry, it has the screen now
         
+        node = self.node
+        if node is None:
+            self.display_menu()
+        elif node.render is not None:
+            node.render()
+        elif node.value is not None:
+            value = self.value if node.step else node.value()
+            self.display_text(node.title, node.format(self.value_line, value))
+    
+    
+    def display_menu(self):
+        """Displays the page of LCD_HEIGHT entries holding the cursor. Within a page moving the cursor only changes the
+        two marker cells, nothing else is sent to the LCD"""
         
-    def get_date(self):
-        """Display start_date on LCD screen"""
+        menu, lines = self.menu, self.menu_lines
+        top = self.position - self.position % len(lines)
+        for row in range(len(lines)):
+            line = lines[row]
+            index = top + row
+            if index < len(menu):
+                line[:] = menu[index].menu_line
+                if index == self.position:
+                    line[0] = CURSOR
+            else:
+                line[:] = BLANK
         
-        year, month, day = self.manager.config.items['start_date']
+        self.display_text(lines[0], lines[1])
         
-        line_1 = "Current Start "
-        line_2 = f"Date: {year}.{month}.{day}"
         
-        self.display_text(line_1, line_2)
+    def get_start_date(self):
+        return self.manager.config.planter_item(self.planter, 'start_date')
         
         
     def set_date(self):
         """Sets new start_date that is equal to today"""
         
-        year, month, day, weekday, hour, minute, second, microsecond = RTC().datetime()
-        self.manager.config.set_start_date(RTC().datetime())
+        self.manager.config.set_start_date(self.manager.clock.date(), self.planter)
+
+
+    def get_moisture(self):
+        return self.manager.config.planter_item(self.planter, 'threshold_moisture')
+
+
+    def set_moisture(self, value:int):
+        """Sets new moisure threshold level"""
+        
+        self.manager.config.set_moisture_threshold(value, self.planter)
+
+
+    def show_planter(self):
+        """Shows which planter the menu works on"""
         
-        line_1 = "Start Date Set"
-        line_2 = f" To: {year}.{month}.{day}"
+        line_1 = f"Planter {self.planter + 1} of {len(self.manager.config.planters)}"
+        line_2 = self.manager.config.planter_item(self.planter, 'name')
         
         self.display_text(line_1, line_2)
 
 
-    def set_moisture(self):
-        """Sets new moisure threshold level"""
+    def show_stats(self):
+        """Shows free heap, flash writes, ADC reads per minute and LCD traffic"""
+        
+        import stats # only loaded when instrumentation is switched on
         
-        self.temp_moisture_setting = self.manager.config.items['threshold_moisture'] + self.position
+        def value(name):
+            value = stats.get(name)
+            return '-' if value is None else value
         
-        line_1 = "Set Moisture"
-        line_2 = f"{' ' * 3} New: {self.temp_moisture_setting}%"
+        line_1 = f"Heap{gc.mem_free() // 1024}k Fl{value('config.flash_writes')}"
+        line_2 = f"ADC{value('moisture.adc_reads_per_min')}/m I2C{self.lcd.total_bytes // 1024}k"
         
         self.display_text(line_1, line_2)
 
 
     def calibrate_moisture_sentor(self):
-        """Does new moisture sensor calibration"""
+        """Starts new moisture sensor calibration in the background"""
         
-        self.manager.config.set_moisture_sensor_settings(*self.manager.moisture_sensor.calibrate())
-        self.reset_display_settings()
+        if self.calibration is None:
+            self.calibration = asyncio.create_task(self._calibrate_moisture_sensor())
+            
+            
+    async def _calibrate_moisture_sensor(self):
+        """Does new moisture sensor calibration of the current planter"""
+        
+        planter = self.planter
+        self.manager.control.pause(planter) # probe is taken out of the soil
+        try:
+            sensor = self.manager.moisture_sensors[planter]
+            min_value, max_value = await sensor.calibrate_async()
+            self.manager.config.set_moisture_sensor_settings(min_value, max_value, planter, sensor.calibration_quality)
+        finally:
+            self.manager.control.resume(planter)
+            self.calibration = None
+            self.last_button_press = utime.ticks_ms()
+            self.reset_display_settings()
+            self.saver = False
+            self.changed.set()
         
         
 if __name__ == '__main__':
+    from bus import Bus
+    from clock import Clock
     from config import Config
     from moisture import MoistureSensor
             
     class Manager:
          """Goal is to keep track of all instances of classes and share among each other"""
-         def __init__(self):
+         def __init__(self, lcd):
+             self.bus = Bus()
+             self.clock = Clock(self.bus)
              self.config = Config(self)
-             self.display = Display(self)
-             self.moisture_sensor = MoistureSensor(adc_pin=27, min_value=self.config.items['moisture_sensor_min'],
-                                            max_value=self.config.items['moisture_sensor_max'], manager=self)
-    
+             self.display = Display(self, lcd)
+             self.moisture_sensors = [MoistureSensor(adc_pin=27, manager=self,
+                                                     min_value=self.config.planter_item(0, 'moisture_sensor_min'),
+                                                     max_value=self.config.planter_item(0, 'moisture_sensor_max'))]
     
-    manager = Manager()
     
-    while True:
-        if utime.ticks_diff(utime.ticks_ms(), manager.display.last_button_press) >= 2_000:
-            # screen saver
-            line_1 = f"Screen saver"
-            line_2 = f"Display"
-            manager.display.display_text(line_1, line_2)
-            manager.display.reset_display_settings()
-
-        
-        # Add a small delay to avoid busy-waiting
-        utime.sleep(1)
+    async def screen_saver(manager):
+        while True:
+            if (utime.ticks_diff(utime.ticks_ms(), manager.display.last_button_press) >= 2_000
+                    and manager.display.calibration is None):
+                # screen saver
+                line_1 = f"Screen saver"
+                line_2 = f"Display"
+                manager.display.display_text(line_1, line_2)
+                manager.display.reset_display_settings()
 
+            await asyncio.sleep(1)
+            
+            
+    async def run(manager):
+        asyncio.create_task(manager.display.run_input())
+        await screen_saver(manager)
+    
+    
+    # splash screen first, the rest is constructed after
+    lcd = LCD()
+    lcd.write_frame("Display test", "starting...")
+    manager = Manager(lcd)
+    
+    asyncio.run(run(manager))
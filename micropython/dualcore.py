@@ -0,0 +1,209 @@
+""" Runs sampling and pump and light control on the second core of the RP2040 with _thread, so LCD redraws,
+calibration and network on core 0 no longer delay sensing, and the other way round. rp2 runs both cores without a
+GIL, the cores only share the lock protected queue and snapshot in here, the Config lock and the bus, whose
+subscribers only note events and wake their tasks on core 0. Flash and network stay on core 0. Switched on with the
+dual_core setting """
+
+from array import array
+import _thread
+import utime
+
+NONE = -0x40000000 # stands for None in the int slots below, moisture can be -1 with a dry probe
+WIDTH = 5 # ints per queue message
+
+
+class Queue:
+    """ Ring of messages of WIDTH ints, preallocated so put and get never allocate. One core puts, the other gets """
+
+    def __init__(self, slots:int):
+        self.slots = slots
+        self.buffer = array('i', bytes(4 * WIDTH * slots))
+        self.head = 0 # slot get reads next
+        self.count = 0
+        self.dropped = 0
+        self.lock = _thread.allocate_lock()
+
+    def put(self, a:int, b:int = 0, c:int = 0, d:int = 0, e:int = 0):
+        """ Appends message, returns False and counts it as dropped if the queue is full """
+        with self.lock:
+            if self.count == self.slots:
+                self.dropped += 1
+                return False
+
+            slot = self.head + self.count
+            if slot >= self.slots:
+                slot -= self.slots
+            i = slot * WIDTH
+            buffer = self.buffer
+            buffer[i] = a
+            buffer[i + 1] = b
+            buffer[i + 2] = c
+            buffer[i + 3] = d
+            buffer[i + 4] = e
+            self.count += 1
+            return True
+
+    def get(self, out):
+        """ Moves oldest message into out, an array of WIDTH ints. Returns False if the queue is empty """
+        with self.lock:
+            if not self.count:
+                return False
+
+            i = self.head * WIDTH
+            buffer = self.buffer
+            for n in range(WIDTH):
+                out[n] = buffer[i + n]
+            self.head = self.head + 1 if self.head + 1 < self.slots else 0
+            self.count -= 1
+            return True
+
+
+class Snapshot:
+    """ Latest state of all planters as published by core 1. Read only for core 0, the reading methods match those
+    of Controller so core 0 code works the same whichever core runs the controller """
+
+    def __init__(self, planters:int):
+        self.lock = _thread.allocate_lock()
+        self.moisture = array('i', [NONE] * planters)
+        self.raws = array('i', [NONE] * planters)
+        self.pumps = bytearray(planters)
+        self.pulse_counts = array('i', bytes(4 * planters))
+        self.pumped = array('i', bytes(4 * planters)) # ms pumped today
+        self.light = False
+        self.published = 0
+
+    def publish(self, controller):
+        """ Copies state of controller, called by core 1 """
+        with self.lock:
+            for planter in range(len(self.pumps)):
+                moisture, raw = controller.moisture_pct(planter), controller.raw(planter)
+                self.moisture[planter] = NONE if moisture is None else moisture
+                self.raws[planter] = NONE if raw is None else raw
+                self.pumps[planter] = controller.pump_on(planter)
+                self.pulse_counts[planter] = controller.planter_pulses(planter)
+                self.pumped[planter] = controller.planter_pumped_ms(planter)
+            self.light = controller.light_on()
+            self.published += 1
+
+    def moisture_pct(self, planter:int):
+        with self.lock:
+            value = self.moisture[planter]
+        return None if value == NONE else value
+
+    def raw(self, planter:int):
+        with self.lock:
+            value = self.raws[planter]
+        return None if value == NONE else value
+
+    def pump_on(self, planter:int):
+        with self.lock:
+            return self.pumps[planter] == 1
+
+    def planter_pulses(self, planter:int):
+        with self.lock:
+            return self.pulse_counts[planter]
+
+    def planter_pumped_ms(self, planter:int):
+        with self.lock:
+            return self.pumped[planter]
+
+    def light_on(self):
+        return self.light
+
+    def pumping(self):
+        with self.lock:
+            return 1 in self.pumps
+
+    def pulses(self):
+        with self.lock:
+            return sum(self.pulse_counts)
+
+    def pumped_ms_today(self):
+        with self.lock:
+            return sum(self.pumped)
+
+
+class Core1(Snapshot):
+    """ Loop on core 1 reading one sensor every scanner tick and running the controller once per period. Core 0
+    sees it like the Controller: state comes from the snapshot, pause and resume go to core 1 as commands. Events
+    the controller publishes are published on core 1 """
+
+    PAUSE = 1
+    RESUME = 2
+    COMMAND_SLOTS = 8
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.controller = manager.controller
+        self.scanner = manager.scanner
+        super().__init__(len(self.controller.channels))
+
+        self.commands = Queue(self.COMMAND_SLOTS) # (command, planter)
+        self.running = False
+        self.passes = 0
+        self.late_max_us = 0 # most a scanner tick started after it was due
+        self.resyncs = 0 # times the loop fell a whole scan period behind and restarted its schedule
+        self._command = array('i', bytes(4 * WIDTH)) # message buffer of core 1
+
+    def start(self):
+        """ Takes sampling over from the scanner's timer and starts the loop on core 1 """
+        self.scanner.stop()
+        if not self.scanner.prepare():
+            return
+
+        for sensor in self.manager.moisture_sensors:
+            sensor.scanned_only = True # the ADC belongs to core 1 from now on
+        self.manager.config.lock = _thread.allocate_lock()
+        self.publish(self.controller)
+
+        self.running = True
+        _thread.start_new_thread(self._loop, ())
+
+    def stop(self):
+        """ Ends the loop after its current pass """
+        self.running = False
+
+    # core 0 side
+    def pause(self, planter:int):
+        self.commands.put(self.PAUSE, planter)
+
+    def resume(self, planter:int):
+        self.commands.put(self.RESUME, planter)
+
+    # core 1 side
+    def _apply_commands(self):
+        command = self._command
+        while self.commands.get(command):
+            if command[0] == self.PAUSE:
+                self.controller.pause(command[1])
+            elif command[0] == self.RESUME:
+                self.controller.resume(command[1])
+
+    def _loop(self):
+        scanner, controller = self.scanner, self.controller
+        tick_us = scanner.tick_ms * 1000
+        next_tick = utime.ticks_us()
+        next_control = utime.ticks_ms()
+
+        while self.running:
+            late = utime.ticks_diff(utime.ticks_us(), next_tick)
+            if late > scanner.period_ms * 1000: # e.g. flash writes on core 0 halt core 1
+                self.resyncs += 1
+                next_tick = utime.ticks_us()
+            elif late > self.late_max_us:
+                self.late_max_us = late
+
+            scanner.tick()
+            next_tick = utime.ticks_add(next_tick, tick_us)
+
+            now = utime.ticks_ms()
+            if utime.ticks_diff(now, next_control) >= 0:
+                next_control = utime.ticks_add(now, controller.period)
+                self._apply_commands()
+                controller.step()
+                self.publish(controller)
+
+            self.passes += 1
+            wait = utime.ticks_diff(next_tick, utime.ticks_us())
+            if wait > 0:
+                utime.sleep_us(wait)
@@ -0,0 +1,140 @@
+""" Forecast of when a planter needs water, from a straight line fit of its moisture over time that is updated with
+every reading. The forecast also sets how often the scanner reads the probe: rarely while watering is far off,
+on every round once it gets close """
+
+from array import array
+import uasyncio as asyncio
+import utime
+
+from bus import FORECAST
+
+N, T, Y, TT, TY = range(5) # slots of DryingModel.sums: weight, sum of t, y, t*t and t*y
+
+
+class DryingModel:
+    """ Exponentially weighted least squares fit of moisture % against time in hours, five floats of state. Times
+    are relative to the newest reading, so the sums stay small enough for single precision floats """
+
+    MEMORY = 0.97 # weight older readings keep with every new one, the last ~30 readings make up the fit
+    MIN_READINGS = 5 # readings since last reset before there is a slope
+    JUMP = 3 # % rise that means the planter was watered, the fit starts over
+    MIN_RATE = 0.05 # %/h, slower drying counts as not drying
+
+    def __init__(self):
+        self.sums = array('f', [0.0] * 5)
+        self.reset()
+
+    def reset(self):
+        sums = self.sums
+        for i in range(5):
+            sums[i] = 0.0
+        self.readings = 0
+        self.last = None # ticks_ms of newest reading
+        self.latest = 0
+
+    def add(self, moisture_pct:float, now:int = None):
+        """ Adds reading taken at ticks_ms now """
+        if now is None:
+            now = utime.ticks_ms()
+
+        if self.readings and moisture_pct - self.latest > self.JUMP:
+            self.reset()
+
+        sums = self.sums
+        if self.last is not None:
+            # move time origin to now, older readings lie further in the past, then let them fade
+            hours = utime.ticks_diff(now, self.last) / 3_600_000
+            sums[TT] += sums[N] * hours * hours - 2 * hours * sums[T]
+            sums[TY] -= hours * sums[Y]
+            sums[T] -= sums[N] * hours
+            for i in range(5):
+                sums[i] *= self.MEMORY
+
+        # the new reading sits at t = 0, so it only adds to the weight and the sum of y
+        sums[N] += 1
+        sums[Y] += moisture_pct
+        self.readings += 1
+        self.last = now
+        self.latest = moisture_pct
+
+    def slope(self):
+        """ Change in %/h, negative while drying. None until there are enough readings """
+        n, t, y, tt, ty = self.sums
+        spread = n * tt - t * t
+        if self.readings < self.MIN_READINGS or spread <= 1e-9:
+            return None
+        return (n * ty - t * y) / spread
+
+    def level(self):
+        """ Fitted moisture % at the newest reading, less noisy than the reading itself """
+        n, t, y, tt, ty = self.sums
+        slope = self.slope()
+        if slope is None:
+            return self.latest
+        return (y - slope * t) / n
+
+    def hours_until(self, threshold:int):
+        """ Hours until moisture drops to threshold, 0 if it already did, None if the soil is not drying """
+        slope = self.slope()
+        if slope is None or slope > -self.MIN_RATE:
+            return None
+
+        level = self.level()
+        if level <= threshold:
+            return 0
+        return (threshold - level) / slope
+
+
+class Forecaster:
+    PERIOD = 60_000 # ms between readings fed to the models
+    CLOSE = 2 # hours, from this close to watering the probe is read on every scanner round
+    MAX_STRETCH = 16 # read at most this many rounds apart
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.models = [DryingModel() for _ in manager.config.planters]
+        # whole hours per planter, ints so the screen saver reads them without allocating floats
+        self.hours = [None] * len(self.models)
+
+    def hours_until_water(self, planter:int):
+        """ Whole hours until the planter is expected to need water, None without a forecast """
+        return self.hours[planter]
+
+    def stretch(self, planter:int, moisture_pct:float):
+        """ Scanner rounds between two reads of the planter's probe """
+        model = self.models[planter]
+        if moisture_pct <= self.manager.config.planter_item(planter, 'threshold_moisture'):
+            return 1 # watering, the controller needs every reading
+        if model.slope() is None:
+            return 1 # just started or just watered, not known yet how fast it dries
+        hours = self.hours[planter]
+        if hours is None:
+            return self.MAX_STRETCH # not drying
+        return max(1, min(self.MAX_STRETCH, int(hours / self.CLOSE)))
+
+    def update(self):
+        """ Feeds current moisture of every planter to its model and adjusts how often it is read """
+        manager = self.manager
+        control, config, scanner = manager.control, manager.config, manager.scanner
+        channels = manager.controller.channels
+        for planter, model in enumerate(self.models):
+            # while calibrating the probe is not in the soil and is read on every round, see Controller.pause
+            raw = control.raw(planter)
+            if raw is None or channels[planter].paused:
+                continue
+
+            # whole percent steps are too coarse for soil that dries by a percent or two per hour
+            moisture = manager.moisture_sensors[planter].to_pct(raw, 10_000) / 100
+            model.add(moisture)
+            hours = model.hours_until(config.planter_item(planter, 'threshold_moisture'))
+            hours = None if hours is None else int(hours + 0.5)
+            if hours != self.hours[planter]:
+                self.hours[planter] = hours
+                manager.bus.publish(FORECAST, planter, -1 if hours is None else hours)
+            scanner.set_stretch(planter, self.stretch(planter, moisture))
+
+    async def run(self):
+        """ Task that updates the forecast every PERIOD """
+        while True:
+            await asyncio.sleep_ms(self.PERIOD)
+            self.update()
@@ -0,0 +1,60 @@
+""" Garbage collection in idle time and heap tracking of the main loop. The steady state loop is meant to run without
+allocating, passes that did allocate are counted so fragmentation on long runs can be followed """
+
+import gc
+import utime
+
+COLLECT_PERIOD = 10_000 # ms between collections in idle time
+THRESHOLD_SHARE = 4 # automatic collection only once this share of the free heap got allocated
+
+passes = 0 # main loop passes measured
+allocating_passes = 0 # passes during which the heap grew
+last_alloc = 0 # bytes allocated by the last allocating pass
+collections = 0
+collect_max_us = 0
+free_after_collect = None # lowest free heap right after a collection, drops if the heap fragments or leaks
+_collected = utime.ticks_ms()
+_pass_heap = 0
+
+
+def setup():
+    """ Collects once and moves automatic collection far out, so it rarely lands in the middle of the loop """
+    gc.collect()
+    gc.threshold(gc.mem_free() // THRESHOLD_SHARE)
+
+
+def pass_start():
+    global _pass_heap
+    _pass_heap = gc.mem_alloc()
+
+
+def pass_end():
+    """ Counts the pass as allocating if the heap grew since pass_start """
+    global passes, allocating_passes, last_alloc
+    passes += 1
+    grown = gc.mem_alloc() - _pass_heap
+    if grown > 0:
+        allocating_passes += 1
+        last_alloc = grown
+
+
+def collect_if_due(busy:bool = False):
+    """ Collects garbage if COLLECT_PERIOD passed, call it when nothing timing critical is going on.
+    Returns True if it collected """
+    global collections, collect_max_us, free_after_collect, _collected
+
+    if busy or utime.ticks_diff(utime.ticks_ms(), _collected) < COLLECT_PERIOD:
+        return False
+
+    start = utime.ticks_us()
+    gc.collect()
+    duration = utime.ticks_diff(utime.ticks_us(), start)
+
+    _collected = utime.ticks_ms()
+    collections += 1
+    if duration > collect_max_us:
+        collect_max_us = duration
+    free = gc.mem_free()
+    if free_after_collect is None or free < free_after_collect:
+        free_after_collect = free
+    return True
@@ -3,10 +3,11 @@
 from machine import I2C, Pin
 import utime
 
-class LCD:    
+class LCD:
     # LCD Address
     I2C_ADDR = 0x27
     LCD_WIDTH = 16 # number of characters per line
+    LCD_HEIGHT = 2 # number of lines
 
     # LCD Commands
     LCD_CHR = 1  # Mode - Sending data
@@ -18,9 +19,14 @@ class LCD:
     LCD_BACKLIGHT = 0x08  # On
     ENABLE = 0b00000100  # Enable bit, used to toggle the enable pin
 
-    # Timing constants - pulse and delay times for toggling the enable pin
-    E_PULSE = 0.001 
-    E_DELAY = 0.0005
+    # Timing constants in microseconds. At 400 kHz every I2C byte already takes ~22 us, which is longer than
+    # the enable pulse and the 37 us execution time of a character write needs, so data is sent back to back
+    # and only the slow commands wait
+    MERGE_BYTES = 6 * 4 # a frame whose first line changed by at most this many I2C bytes goes out as one transaction
+    CMD_DELAY_US = 50  # most commands take 37 us
+    CLEAR_DELAY_US = 2000  # clear and home take 1.52 ms
+    INIT_DELAY_US = 4500  # first 8-bit mode command needs 4.1 ms
+    RESET_DELAY_US = 150  # second one needs 100 us
 
     I2C_ID = 0
     SDA_PIN = 8
@@ -29,54 +35,201 @@ class LCD:
     def __init__(self):
         # Initialize I2C
         self.i2c = I2C(id=self.I2C_ID, scl=Pin(self.SCL_PIN), sda=Pin(self.SDA_PIN), freq=400000)
+
+        # shadow copy of what is currently shown on the LCD, one byte per character cell
+        self.shadow = bytearray(b' ' * (self.LCD_WIDTH * self.LCD_HEIGHT))
+
+        # transmit buffer holds a cursor command plus a full line for every line, 6 I2C bytes per LCD byte
+        self._tx = bytearray(6 * (self.LCD_WIDTH + 1) * self.LCD_HEIGHT)
+        self._tx_mv = memoryview(self._tx)
+
+        self.backlight = self.LCD_BACKLIGHT # backlight bit sent with every byte, 0 while it is off
+
+        # I2C traffic counters, frame_* are reset by every write_frame call
+        self.frame_bytes = 0
+        self.frame_transactions = 0
+        self.total_bytes = 0
+        self.total_transactions = 0
+
         self._lcd_init()
 
-    def _lcd_byte(self, bits, mode):
-        """ Send byte to data pins """
-        bits_high = mode | (bits & 0xF0) | self.LCD_BACKLIGHT
-        bits_low = mode | ((bits << 4) & 0xF0) | self.LCD_BACKLIGHT
+    def _write(self, length):
+        """ Writes the first length bytes of the transmit buffer to the I2C backpack in one transaction """
+        self.i2c.writeto(self.I2C_ADDR, self._tx_mv[:length])
+
+        self.frame_bytes += length
+        self.frame_transactions += 1
+        self.total_bytes += length
+        self.total_transactions += 1
+
+    def _pack(self, bits, mode, pos):
+        """ Packs one LCD byte into the transmit buffer at pos as two nibbles, each as data, enable high, enable low.
+        Returns position after the packed bytes """
+        tx = self._tx
 
-        self.i2c.writeto(self.I2C_ADDR, bytearray([bits_high]))
-        self._lcd_toggle_enable(bits_high)
+        nibble = mode | (bits & 0xF0) | self.backlight
+        tx[pos] = nibble
+        tx[pos + 1] = nibble | self.ENABLE
+        tx[pos + 2] = nibble
 
-        self.i2c.writeto(self.I2C_ADDR, bytearray([bits_low]))
-        self._lcd_toggle_enable(bits_low)
+        nibble = mode | ((bits << 4) & 0xF0) | self.backlight
+        tx[pos + 3] = nibble
+        tx[pos + 4] = nibble | self.ENABLE
+        tx[pos + 5] = nibble
 
-    def _lcd_toggle_enable(self, bits):
-        """ Toggle enable pin on LCD """
-        utime.sleep(self.E_DELAY)
-        self.i2c.writeto(self.I2C_ADDR, bytearray([bits | self.ENABLE]))
-        utime.sleep(self.E_PULSE)
-        self.i2c.writeto(self.I2C_ADDR, bytearray([bits & ~self.ENABLE]))
-        utime.sleep(self.E_DELAY)
+        return pos + 6
+
+    def _lcd_byte(self, bits, mode, delay_us=CMD_DELAY_US):
+        """ Send byte to data pins """
+        self._write(self._pack(bits, mode, 0))
+        utime.sleep_us(delay_us)
+
+    def _lcd_nibble(self, bits, delay_us):
+        """ Sends only the upper nibble of bits. Until the LCD is in 4-bit mode it takes every nibble as a command,
+        so the reset commands go out one per transaction with their own delay """
+        nibble = self.LCD_CMD | (bits & 0xF0) | self.backlight
+        tx = self._tx
+        tx[0] = nibble
+        tx[1] = nibble | self.ENABLE
+        tx[2] = nibble
+        self._write(3)
+        utime.sleep_us(delay_us)
 
     def _lcd_init(self):
         """ Initialize display """
-        self._lcd_byte(0x33, self.LCD_CMD) # command to initialize LCD in 8-bit mode
-        self._lcd_byte(0x32, self.LCD_CMD) # command to switch LCD from 8-bit to 4-bit mode
+        self._lcd_nibble(0x30, self.INIT_DELAY_US) # command to initialize LCD in 8-bit mode
+        self._lcd_nibble(0x30, self.RESET_DELAY_US) # repeated, the LCD might have been in 4-bit mode
+        self._lcd_byte(0x32, self.LCD_CMD) # third 8-bit command, then switch LCD from 8-bit to 4-bit mode
         self._lcd_byte(0x06, self.LCD_CMD) # command to set entry mode. It sets the cursor to move to the right and ensures the display is not shifted
         self._lcd_byte(0x0C, self.LCD_CMD) # command to turn on the display and turn off the cursor. Ensures display is visible without blinking cursor
         self._lcd_byte(0x28, self.LCD_CMD) # command that sets the LCD to 4-bit mode, 2-line display, and 5x8 dot format
-        self._lcd_byte(0x01, self.LCD_CMD) # command that clears any existing text on the LCD and moves the cursor to the home position 
-        utime.sleep(self.E_DELAY)
+        self._lcd_byte(0x01, self.LCD_CMD, self.CLEAR_DELAY_US) # command that clears any existing text on the LCD and moves the cursor to the home position
+
+    def set_backlight(self, on:bool):
+        """ Switches backlight, the text stays. Costs a single I2C byte """
+        self.backlight = self.LCD_BACKLIGHT if on else 0
+        self._tx[0] = self.backlight
+        self._write(1)
 
     def clear(self):
-        self._lcd_byte(0x01, self.LCD_CMD) # command that clears any existing text on the LCD and moves the cursor to the home position
-
-    def lcd_string(self, message:str, line:int):
-        """ Send string to display """
-        message = message + " " * self.LCD_WIDTH
-        message = message[0:self.LCD_WIDTH]
-        
-        if line % 2 == 0:
+        self._lcd_byte(0x01, self.LCD_CMD, self.CLEAR_DELAY_US) # command that clears any existing text on the LCD and moves the cursor to the home position
+
+        for i in range(len(self.shadow)):
+            self.shadow[i] = 0x20
+
+    def lcd_string(self, message, line:int):
+        """ Send string to display, only the characters that differ from what is already shown are transmitted.
+        All changed runs of the line are packed into one I2C burst. message can also be a bytes-like line, e.g.
+        from LineBuffer, which is read without allocating """
+        pos = self._pack_line(message, line, 0)
+        if pos:
+            self._write(pos)
+
+    def _pack_line(self, message, line:int, pos:int):
+        """ Packs the changes of line into the transmit buffer from pos on, returns position after them """
+        line = line % self.LCD_HEIGHT
+        text = isinstance(message, str)
+
+        if line == 0:
             line_adress = self.LCD_LINE_1
         else:
             line_adress = self.LCD_LINE_2
 
-        self._lcd_byte(line_adress, self.LCD_CMD)
+        offset = line * self.LCD_WIDTH
+        shadow = self.shadow
+        length = len(message)
+
+        col = 0
+        while col < self.LCD_WIDTH:
+            char = (ord(message[col]) & 0xFF if text else message[col]) if col < length else 0x20
+            if shadow[offset + col] == char:
+                col += 1
+                continue
+
+            # start of a changed run, jump cursor there and keep writing until the run ends.
+            # a gap of one unchanged cell costs the same as a cursor jump, so it is written through
+            pos = self._pack(line_adress + col, self.LCD_CMD, pos)
+
+            while col < self.LCD_WIDTH:
+                char = (ord(message[col]) & 0xFF if text else message[col]) if col < length else 0x20
+                if shadow[offset + col] == char:
+                    next_col = col + 1
+                    if next_col >= self.LCD_WIDTH:
+                        break
+                    next_char = 0x20
+                    if next_col < length:
+                        next_char = ord(message[next_col]) & 0xFF if text else message[next_col]
+                    if shadow[offset + next_col] == next_char:
+                        break
+
+                pos = self._pack(char, self.LCD_CHR, pos)
+                shadow[offset + col] = char
+                col += 1
+
+        return pos
+
+    def write_frame(self, line_1="", line_2=""):
+        """ Updates both lines without clearing the screen, frame_bytes and frame_transactions hold the cost afterwards.
+        Small changes such as a moved cursor go out in one transaction, larger ones line by line, so no single burst
+        holds the bus and timer callbacks off for long """
+        self.frame_bytes = 0
+        self.frame_transactions = 0
+
+        pos = self._pack_line(line_1, 0, 0)
+        if pos > self.MERGE_BYTES:
+            self._write(pos)
+            pos = 0
+        pos = self._pack_line(line_2, 1, pos)
+        if pos:
+            self._write(pos)
+
+        return self.frame_bytes, self.frame_transactions
+
+
+class LineBuffer:
+    """ One LCD line that is formatted in place into a fixed bytearray, so refreshing a screen does not allocate """
+
+    def __init__(self, width:int = LCD.LCD_WIDTH):
+        self.buffer = bytearray(b' ' * width)
+        self.width = width
+        self.length = 0
+
+    def clear(self):
+        self.length = 0
+        return self
+
+    def _put(self, char:int):
+        if self.length < self.width:
+            self.buffer[self.length] = char
+            self.length += 1
+
+    def text(self, text):
+        """ Appends str or bytes, bytes constants avoid even the per character lookups """
+        for char in text:
+            self._put(char if isinstance(char, int) else ord(char) & 0xFF)
+        return self
+
+    def number(self, value:int):
+        """ Appends integer in decimal """
+        if value < 0:
+            self._put(0x2D) # -
+            value = -value
+
+        divisor = 1
+        while divisor * 10 <= value:
+            divisor *= 10
+
+        while divisor:
+            self._put(0x30 + value // divisor % 10)
+            divisor //= 10
+        return self
+
+    def line(self):
+        """ Pads with spaces and returns the buffer, ready for LCD.write_frame """
+        for i in range(self.length, self.width):
+            self.buffer[i] = 0x20
+        return self.buffer
 
-        for i in range(self.LCD_WIDTH):
-            self._lcd_byte(ord(message[i]), self.LCD_CHR)
 
 if __name__ == '__main__':
     # Initialize the LCD
@@ -85,3 +238,10 @@ if __name__ == '__main__':
     # # Display message
     lcd.lcd_string("Hello World!", 0)
     lcd.lcd_string("Boom", 1)
+
+    # only the changed characters are sent
+    print('I2C bytes, transactions:', lcd.write_frame("Hello Planter!", "Boom"))
+
+    # same without allocating
+    line = LineBuffer()
+    print('I2C bytes, transactions:', lcd.write_frame(line.clear().text(b'Count ').number(42).line()))
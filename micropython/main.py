@@ -1,60 +1,399 @@
-import machine
-import ntptime
+# only what the splash screen needs is imported up front, everything else is loaded by start() through
+# bootprofile so the cost of every import and constructor can be reported
+import bootprofile
 import utime
 
-from config import Config
-from display import Display
-from moisture import MoistureSensor
-        
+asyncio = None # uasyncio, loaded after the splash screen
+heap = None
+stats = None # only loaded if some instrumentation is switched on
+
+# Establish constants
+REST_TIME = 5_000 # ms without input before screen saver is shown
+PAGE_TIME = 4_000 # ms each planter is shown on the screen saver
+LOG_PERIOD = 60 * 60_000 # ms, every planter is logged at least this often so hourly summaries have every hour
+FIRST_SCREEN_BUDGET = 500 # ms from power on until splash screen is shown, warns if over
+
+
 class Manager:
      """Goal is to keep track of all instances of classes and share among each other"""
-     def __init__(self):
-         self.config = Config(self)
-         self.display = Display(self)
-         self.moisture_sensor = MoistureSensor(adc_pin=27, min_value=self.config.items['moisture_sensor_min'],
-                                        max_value=self.config.items['moisture_sensor_max'], manager=self)
-         
+     def __init__(self, lcd=None):
+         load, construct = bootprofile.load, bootprofile.construct
 
-def main():
-     # first, synchronize RTC on startup
-    try:
-        ntptime.settime()
-        print('Time synchronized')
-    except Exception as e:
-        print('Failed to syncronize time: ', e)
-
-    # create manger and distribute different classes 
-    manager = Manager()
-    
-    manager.display.display_text("Startup Sequence", "in progress...")
-    
-    # Establish constants
-    REST_TIME = 5_000
-    NAME = manager.config.items['name']
-    MIN_VALUE = manager.config.items['moisture_sensor_min']
-    MAX_VALUE = manager.config.items['moisture_sensor_max'] 
-    
-    print(manager.config.items)
+         # modules publish changes on the bus, display and log only wake up for them
+         self.bus = construct('Bus', load('bus').Bus)
+         self.clock = construct('Clock', load('clock').Clock, self.bus)
+         self.config = construct('Config', load('config').Config, self)
+         self.display = construct('Display', load('display').Display, self, lcd)
+
+         # one timer reads all planters in turn, planters with a mux_address share the ADC behind the mux
+         items = self.config.items
+         self.mux = construct('Mux', load('mux').Mux, items['mux_pins']) if items.get('mux_pins') else None
+         self.scanner = construct('Scanner', load('sampler').Scanner, items['sample_period_ms'])
+         load('moisture')
+         self.moisture_sensors = [construct('MoistureSensor', self.make_sensor, planter)
+                                  for planter in range(len(self.config.planters))]
+         self.scanner.start()
+
+         self.controller = construct('Controller', load('controller').Controller, self)
+         # what core 0 reads state from and sends pause and resume to, the controller itself or its core 1 loop
+         self.control, self.core1 = self.controller, None
+         if items.get('dual_core'):
+             self.control = self.core1 = construct('Core1', load('dualcore').Core1, self)
+
+         # light sleep needs core 1 to be idle, so low power mode only works with everything on core 0
+         self.power = None
+         if items.get('low_power') and self.core1 is None:
+             self.power = construct('PowerManager', load('power').PowerManager, self)
+         # how often each probe is read follows the forecast of when its planter needs water next
+         self.forecaster = None
+         if items.get('adaptive_sampling'):
+             self.forecaster = construct('Forecaster', load('forecast').Forecaster, self)
+         self.datalog = construct('DataLog', load('datalog').DataLog, budget_bytes=items['log_budget_bytes'])
+         self.wifi = construct('WiFi', load('wifi').WiFi)
+         self.time_sync = construct('TimeSync', load('timesync').TimeSync, self.wifi, self.clock)
+
+         # telemetry is optional, its module is only loaded when the endpoint or uploads are switched on. Low power
+         # planters keep the radio off, so they have none
+         self.status_server = self.uploader = None
+         if self.power is None and (items['telemetry_port'] or items['telemetry_url']):
+             telemetry = load('telemetry')
+             self.status_server = construct('StatusServer', telemetry.StatusServer, self)
+             self.uploader = construct('Uploader', telemetry.Uploader, self)
+
+         self.first_display_ms = None
+         if items['stats']:
+             instrument(self)
+
+     def make_sensor(self, planter:int):
+         from moisture import MoistureSensor # already loaded through bootprofile
+
+         config = self.config
+         mux_address = config.planter_item(planter, 'mux_address')
+         if mux_address is None:
+             adc_pin, mux, mux_address = config.planter_item(planter, 'adc_pin'), None, 0
+         else:
+             adc_pin, mux = config.items['mux_adc_pin'], self.mux
+
+         return MoistureSensor(manager=self, adc_pin=adc_pin, mux=mux, mux_address=mux_address, scanner=self.scanner,
+                               min_value=config.planter_item(planter, 'moisture_sensor_min'),
+                               max_value=config.planter_item(planter, 'moisture_sensor_max'),
+                               sample_period_ms=config.items['sample_period_ms'],
+                               sample_window=config.items['sample_window'])
+
+
+def instrument(manager):
+    """Adds timing and counters to the subsystems listed in the stats setting"""
+
+    global stats
+    stats = bootprofile.load('stats')
+    stats.enable(*manager.config.items['stats'])
+
+    lcd = manager.display.lcd
+    stats.timed('lcd', lcd, 'write_frame', 'lcd_string')
+    stats.gauge('lcd', 'i2c_bytes', lambda: lcd.total_bytes)
+    stats.gauge('lcd', 'i2c_transactions', lambda: lcd.total_transactions)
+
+    sensors = manager.moisture_sensors
+    for sensor in sensors:
+        stats.timed('moisture', sensor, 'get_moisture_pct')
+        stats.timed('moisture', sensor.sampler, 'sample') # one ADC read, from the scanner or the sensor's own timer
+    stats.timed('moisture', manager.scanner, 'tick')
+    stats.gauge('moisture', 'adc_reads_per_min',
+                lambda: sum(sensor.sampler.samples for sensor in sensors) * 60_000 // max(1, stats.uptime_ms()))
+
+    config = manager.config
+    stats.timed('config', config, 'save_settings')
+    stats.gauge('config', 'flash_writes', lambda: config.flash_writes)
+
+    rotary = manager.display.rotary
+    stats.timed('rotary', rotary, 'dispatch') # includes the display handlers
+    stats.gauge('rotary', 'dropped', lambda: rotary.dropped)
+
+    controller = manager.controller
+    for channel in controller.channels:
+        stats.timed('accessory', channel.pump, 'turn_on', 'turn_off')
+    stats.timed('accessory', controller.light, 'turn_on', 'turn_off')
+    stats.gauge('accessory', 'light_on', controller.light.is_on)
+    stats.gauge('accessory', 'pump_pulses', controller.pulses)
+    stats.gauge('accessory', 'pumped_s_today', lambda: controller.pumped_ms_today() // 1000)
 
-    # If no min and max values for sensor in settings file, then initiate calibration 
-    if MIN_VALUE is None or MAX_VALUE is None:
-        manager.moisture_sensor.set_moisture_sensor_settings(*sensor.calibrate())
+    status_server, uploader = manager.status_server, manager.uploader
+    if status_server is not None:
+        stats.timed('telemetry', status_server, 'snapshot')
+        stats.timed('telemetry', uploader, 'push')
+        stats.gauge('telemetry', 'requests', lambda: status_server.requests)
+        stats.gauge('telemetry', 'snapshot_rebuilds', lambda: status_server.rebuilds)
+        stats.gauge('telemetry', 'uploads', lambda: uploader.uploads)
+        stats.gauge('telemetry', 'upload_failures', lambda: uploader.failures)
+        stats.gauge('telemetry', 'dropped', uploader.dropped)
+
+    core1 = manager.core1
+    if core1 is not None:
+        stats.gauge('core1', 'passes', lambda: core1.passes)
+        stats.gauge('core1', 'late_max_us', lambda: core1.late_max_us)
+        stats.gauge('core1', 'resyncs', lambda: core1.resyncs)
+        stats.gauge('core1', 'commands_dropped', lambda: core1.commands.dropped)
+
+    power = manager.power
+    if power is not None:
+        stats.gauge('power', 'duty_cycle_pct', power.duty_cycle_pct)
+        stats.gauge('power', 'sleeps', lambda: power.sleeps)
+        stats.gauge('power', 'wakes', lambda: power.wakes)
+        stats.gauge('power', 'wake_latency_us', power.wake_latency_us)
+        stats.gauge('power', 'wake_latency_max_us', lambda: power.wake_latency_max_us)
+
+    stats.gauge('bus', 'events', lambda: manager.bus.published)
+
+    stats.gauge('heap', 'loop_passes', lambda: heap.passes)
+    stats.gauge('heap', 'allocating_passes', lambda: heap.allocating_passes)
+    stats.gauge('heap', 'last_alloc_bytes', lambda: heap.last_alloc)
+    stats.gauge('heap', 'collections', lambda: heap.collections)
+    stats.gauge('heap', 'collect_max_us', lambda: heap.collect_max_us)
+    stats.gauge('heap', 'free_after_collect_min', lambda: heap.free_after_collect)
+
+    stats.gauge('boot', 'first_display_ms', lambda: manager.first_display_ms)
+    stats.gauge('boot', 'wifi_attempts', lambda: manager.wifi.attempts)
+    stats.gauge('boot', 'ntp_syncs', lambda: manager.time_sync.syncs)
+    stats.gauge('boot', 'ntp_failures', lambda: manager.time_sync.failures)
+
+
+def show_screen_saver(manager):
+    """Shows plant name, days grown and current moisture, paging through the planters every PAGE_TIME. Once there is
+    a forecast the moisture line also shows when the planter needs water next"""
+
+    display = manager.display
+    if (len(manager.config.planters) > 1
+            and utime.ticks_diff(utime.ticks_ms(), display.planter_since) >= PAGE_TIME):
+        display.next_planter()
+
+    # lines are formatted into the display's line buffers, nothing is allocated on a normal refresh
+    planter = display.planter
+    if display.line_1_stale:
+        display.line_1_stale = False
+        line = display.line_1.clear()
+        line.text(manager.config.planter_item(planter, 'name'))
+        line.text(b': Day ')
+        line.number(manager.config.get_days_grown(planter))
+
+    moisture_pct = manager.control.moisture_pct(planter)
+    hours = None if manager.forecaster is None else manager.forecaster.hours_until_water(planter)
+    line = display.line_2.clear()
+    if moisture_pct is not None and hours is not None:
+        line.number(moisture_pct)
+        line.text(b'% water in ~' if hours < 10 else b'% water ~')
+        line.number(min(hours, 999))
+        line.text(b'h')
     else:
-        print('No moisure sensor calibration needed')
-        
-    
+        line.text(b'Moisure: ')
+        if moisture_pct is None:
+            line.text(b'--')
+        else:
+            line.number(moisture_pct)
+        line.text(b'%')
+
+    display.display_text(display.line_1.line(), display.line_2.line())
+    display.reset_display_settings()
+
+
+def refresh_screen(manager):
+    """Shows screen saver once rotary selector has not been used for REST_TIME, and afterwards only redraws it when
+    something it shows changed or the next planter is due. Returns ms until the screen needs another look even if
+    no event comes, None if only events can change it"""
+
+    display = manager.display
+    if display.calibration is not None:
+        return None # calibration wakes the display task when it is done
+
+    # once up, the screen saver stays until input clears saver, last_button_press is not compared again because
+    # ticks_diff wraps after ~6 days without input
+    now = utime.ticks_ms()
+    if not display.saver:
+        idle = utime.ticks_diff(now, display.last_button_press)
+        if idle < REST_TIME:
+            return REST_TIME - idle
+
+        display.saver = True
+        display.stale = display.line_1_stale = True
+        display.planter_since = now
+
+    wait = None
+    if len(manager.config.planters) > 1:
+        wait = PAGE_TIME - utime.ticks_diff(now, display.planter_since)
+        if wait <= 0:
+            display.stale = True # show_screen_saver moves on to the next planter
+            wait = PAGE_TIME
+
+    if display.stale:
+        display.stale = False # cleared first, an event arriving while drawing marks it again
+        show_screen_saver(manager)
+    return wait
+
+
+async def display_task(manager):
+    """Keeps the screen saver up to date, sleeping until an event, input or a due screen saver page wakes it.
+    Garbage is collected right after the LCD was updated, while no pump is running"""
+
+    display = manager.display
+    check_heap = stats is not None and stats.is_enabled('heap')
+
+    while True:
+        heap.pass_start()
+        wait = refresh_screen(manager)
+        heap.pass_end()
+
+        heap.collect_if_due(busy=manager.control.pumping())
+        if check_heap:
+            stats.check_heap()
+
+        if wait is not None:
+            display.wake_in(wait)
+        await display.changed.wait()
+
+
+async def log_task(manager):
+    """Records moisture reading and actuator state of a planter whenever its moisture moved by report_delta or its
+    pump or the light switched, and at least every LOG_PERIOD. Records are buffered a page at a time, so steady
+    soil only costs a flash write every page full of hours"""
+
+    from bus import ALL, LIGHT, MOISTURE, PUMP # already loaded through bootprofile
+
+    control, clock = manager.control, manager.clock
+    datalog, uploader = manager.datalog, manager.uploader
+    planters = len(manager.config.planters)
+    pending = bytearray(planters) # planters with changes not yet recorded
+    due = [utime.ticks_add(utime.ticks_ms(), LOG_PERIOD)] * planters # ticks_ms each planter is logged anyway
+    changed = asyncio.ThreadSafeFlag()
+
+    def on_change(topic, planter, value):
+        # runs wherever the event was published, on core 1 or in a timer callback, the task does the writing
+        if planter == ALL:
+            for i in range(planters):
+                pending[i] = 1
+        else:
+            pending[planter] = 1
+        changed.set()
+
+    for topic in (MOISTURE, PUMP, LIGHT):
+        manager.bus.subscribe(topic, on_change)
+
     while True:
-        if utime.ticks_diff(utime.ticks_ms(), manager.display.last_button_press) >= REST_TIME:
-            # screen saver
-            line_1 = f"{NAME}: Day {manager.config.get_days_grown()}"
-            line_2 = f"Moisure: {manager.moisture_sensor.get_moisture_pct()}%"
-            manager.display.display_text(line_1, line_2)
-            manager.display.reset_display_settings()
-
-        
-        # Add a small delay to avoid busy-waiting
-        utime.sleep_ms(int(REST_TIME/2))
-
-    
+        now, wait, overdue = utime.ticks_ms(), LOG_PERIOD, False
+        for planter in range(planters):
+            left = utime.ticks_diff(due[planter], now)
+            if left <= 0:
+                pending[planter] = 1
+                overdue = True
+            elif left < wait:
+                wait = left
+
+        if not overdue:
+            try:
+                await asyncio.wait_for_ms(changed.wait(), wait)
+            except asyncio.TimeoutError:
+                continue
+
+        light = datalog.LIGHT if control.light_on() else 0
+        for planter in range(planters):
+            if not pending[planter]:
+                continue
+            pending[planter] = 0
+            due[planter] = utime.ticks_add(utime.ticks_ms(), LOG_PERIOD)
+
+            raw = control.raw(planter)
+            if raw is not None:
+                state = light | (datalog.PUMP if control.pump_on(planter) else 0)
+                now, moisture_pct = clock.time(), control.moisture_pct(planter)
+                datalog.record(now, raw, moisture_pct, state, planter)
+                if uploader is not None:
+                    uploader.record(now, raw, moisture_pct, state, planter)
+
+
+async def run(manager):
+    # network comes up in the background, nothing waits for it. In low power mode the radio stays off
+    if manager.power is None:
+        asyncio.create_task(manager.wifi.run())
+        asyncio.create_task(manager.time_sync.run())
+    asyncio.create_task(manager.clock.run())
+
+    # If no min and max values for sensor in settings file, then initiate calibration
+    for planter, sensor in enumerate(manager.moisture_sensors):
+        if sensor.calibrated_min is None or sensor.calibrated_max is None:
+            min_value, max_value = await sensor.calibrate_async()
+            manager.config.set_moisture_sensor_settings(min_value, max_value, planter, sensor.calibration_quality)
+        else:
+            print('No moisure sensor calibration needed for planter', planter)
+
+    # state is served once every planter reports moisture
+    if manager.status_server is not None:
+        asyncio.create_task(manager.status_server.run())
+        asyncio.create_task(manager.uploader.run())
+
+    asyncio.create_task(manager.config.run_autosave())
+    asyncio.create_task(manager.display.run_input())
+    asyncio.create_task(log_task(manager))
+    if manager.core1 is not None:
+        manager.core1.start() # after calibration, from here on core 1 owns the ADC
+    else:
+        asyncio.create_task(manager.controller.run())
+    if manager.forecaster is not None:
+        asyncio.create_task(manager.forecaster.run())
+    if manager.power is not None:
+        asyncio.create_task(manager.power.run()) # samples from now on, the scanner's timer stops
+    if stats is not None:
+        asyncio.create_task(stats.run_reporter(manager.config.items['stats_period_s'] * 1000))
+
+    await display_task(manager)
+
+
+def start():
+    """Shows splash screen as soon as the LCD is up, then loads and brings up everything else, all before anything
+    that could wait on the network"""
+
+    global asyncio, heap
+
+    lcd = bootprofile.construct('LCD', bootprofile.load('lcd').LCD)
+    lcd.write_frame("Startup Sequence", "in progress...")
+
+    # ticks_ms counts from power on
+    first_display_ms = utime.ticks_ms()
+    bootprofile.mark('first screen')
+    print('Time to first display:', first_display_ms, 'ms')
+    if first_display_ms > FIRST_SCREEN_BUDGET:
+        print('Time to first display is over budget of', FIRST_SCREEN_BUDGET, 'ms')
+
+    asyncio = bootprofile.load('uasyncio')
+
+    # create manger and distribute different classes
+    manager = Manager(lcd)
+    manager.first_display_ms = first_display_ms
+
+    # only starts connecting, run() keeps the connection up in the background. The radio would keep a low power
+    # planter from sleeping, so there it is switched off
+    if manager.power is None:
+        manager.wifi.start()
+    else:
+        manager.wifi.stop()
+
+    # without NTP the last saved time keeps days grown counting
+    manager.time_sync.restore()
+
+    # startup garbage is collected before the loop starts, later collections happen in idle time
+    heap = bootprofile.load('heap')
+    heap.setup()
+
+    bootprofile.mark('ready')
+    bootprofile.print_report()
+
+    return manager
+
+
+def main():
+    manager = start()
+
+    print(manager.config.items)
+
+    asyncio.run(run(manager))
+
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,54 @@
+""" Menu entries for the LCD. The menu is a list of Nodes that the rotary position indexes directly, every entry
+declares what it shows and what pressing and turning do. Labels and titles are rendered into fixed width buffers
+once, so moving the cursor or changing a value only changes a few character cells, and the LCD's shadow copy
+sends nothing else """
+
+from lcd import LCD
+
+CURSOR = 0x3E # >
+BLANK = bytes(b' ' * LCD.LCD_WIDTH)
+
+
+def pad(text:str):
+    """ Returns text as a full LCD line, cut or padded with spaces """
+    line = bytearray(BLANK)
+    data = text.encode()[:LCD.LCD_WIDTH]
+    line[:len(data)] = data
+    return line
+
+
+class Node:
+    """ Pressing the entry runs enter, then shows title on line 1 and prefix, value and unit on line 2. With a step
+    the value changes by step per detent within low and high, by fast_step while the encoder spins fast, pressing
+    again hands it to commit. Screens that do not fit this pattern are drawn by render instead """
+
+    def __init__(self, label:str, title:str = '', prefix:str = '', value=None, unit:str = '', step:int = 0,
+                 fast_step:int = 0, low:int = 0, high:int = 100, commit=None, enter=None, render=None):
+        self.label = label
+        self.menu_line = pad(' ' + label) # first cell is left for the cursor
+        self.title = pad(title)
+        self.prefix = prefix.encode()
+        self.unit = unit.encode()
+        self.value = value # getter, returns int, str or a sequence of ints shown with dots in between
+        self.step = step
+        self.fast_step = fast_step or step
+        self.low = low
+        self.high = high
+        self.commit = commit
+        self.enter = enter
+        self.render = render
+
+    def format(self, line, value):
+        """ Formats line 2 into LineBuffer line """
+        line.clear().text(self.prefix)
+        if isinstance(value, int):
+            line.number(value)
+        elif isinstance(value, str):
+            line.text(value)
+        elif value is not None:
+            for i, part in enumerate(value):
+                if i:
+                    line.text(b'.')
+                line.number(part)
+        line.text(self.unit)
+        return line.line()
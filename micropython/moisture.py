@@ -1,109 +1,229 @@
+from array import array
 from machine import ADC, Pin
+import uasyncio as asyncio
 import utime
 
+from sampler import RunningStats, Sampler, trimmed_mean
+
 class MoistureSensor:
-    def __init__(self, manager, adc_pin:int, min_value=None, max_value=None):
+    CALIBRATION_COUNTDOWN = 3 # s to take the probe out of the soil
+    CALIBRATION_INTERVAL = 5 # ms between calibration readings, or between checks for a new scanned one
+    CALIBRATION_MIN_SAMPLES = 32
+    CALIBRATION_MAX_SAMPLES = 400
+    CALIBRATION_TOLERANCE = 32 # raw counts, sampling stops once the mean is known this well
+    OUTLIER_SIGMA = 4 # readings further than this many standard deviations from the mean are rejected
+    WET_CHANGE = 4 # probe counts as in water once reading moved by dry reading / WET_CHANGE
+    WET_TIMEOUT = 120_000 # ms to wait for the probe to go into water before measuring anyway
+    SETTLE_TIME = 1_000 # ms for the reading to settle after the probe went into water
+    
+    def __init__(self, manager, adc_pin:int, min_value=None, max_value=None,
+                 sample_period_ms:int = 100, sample_window:int = 32, ema_shift:int = 3,
+                 mux=None, mux_address:int = 0, scanner=None):
+        """With mux the sensor sits on channel mux_address of an analog multiplexer in front of adc_pin.
+        With scanner sampling is shared with other sensors, otherwise the sensor gets its own timer"""
         self.misture_sensor = ADC(Pin(adc_pin))
         self.display = manager.display
         self.calibrated_min = min_value
         self.calibrated_max = max_value
+        self.calibration_quality = None # 95% confidence interval and sample counts of last calibration
+        self.mux = mux
+        self.scanned_only = mux is not None # ADC must only be read by the scanner, set when it runs on core 1
+        
+        # background sampling keeps filtered reading ready, so get_moisture_pct never waits for the ADC
+        self.sampler = Sampler(self.misture_sensor, sample_period_ms, sample_window, ema_shift)
+        if scanner is not None:
+            scanner.add(self.sampler, mux, mux_address)
+        else:
+            self.sampler.start()
             
 
-    def get_average_reading(self, observations:int):
-        """Get average moisture reading"""
-        readings = []
+    def read_raw(self):
+        """Raw ADC reading. Behind a mux only the scanner switches channels, and on core 1 it owns the ADC, so the
+        latest scanned reading is used"""
+        if self.scanned_only:
+            return self.sampler.latest()
+        
+        return self.misture_sensor.read_u16()
+
+
+    async def read_average(self, observations:int, interval_ms:int = 100):
+        """Average of observations raw readings interval_ms apart, other tasks keep running between samples"""
+        total = 0
 
         for _ in range(observations):
-            reading = self.misture_sensor.read_u16()
-            readings.append(reading)
-            utime.sleep_ms(100)
+            total += self.read_raw()
+            await asyncio.sleep_ms(interval_ms)
 
-        return sum(readings) / len(readings)
+        return total / observations
 
 
     def calibrate(self):
-        """Calibration reads the ADC value from the sensor 100 times and returns an average"""
+        """Blocking calibration, see calibrate_async"""
         
-        iterations = 100
+        return asyncio.run(self.calibrate_async())
 
-        print('Calibrate sensor for the minimum moisture: air.')
-        print('Calibration will start in 10 seconds.')
-        for sec in range(10,-1,-1):
-            self.display.display_text("Dry Calibration", f"start in {sec} sec")
-            utime.sleep(1)
 
-        self.display.display_text(line_1="Keep Dry")
+    def _screen(self, readings, count:int):
+        """Drops readings far from the median, using the median absolute deviation as spread.
+        Kept readings are moved to the front. Returns (RunningStats of kept readings, number kept)"""
+        
+        ordered = sorted(readings[:count])
+        median = ordered[count // 2]
+        mad = sorted(abs(reading - median) for reading in ordered)[count // 2]
+        limit = max(self.OUTLIER_SIGMA * 1.4826 * mad, self.CALIBRATION_TOLERANCE) # 1.4826 * MAD estimates sigma
         
-        print('Starting minimum calibration')
+        running = RunningStats()
+        kept = 0
+        for i in range(count):
+            reading = readings[i]
+            if abs(reading - median) <= limit:
+                running.add(reading)
+                readings[kept] = reading
+                kept += 1
+        
+        return running, kept
 
-        min_value = self.get_average_reading(iterations)
 
-        print('Minimum calibration complete')
-        self.display.display_text("Dry Calibration", "Done!")
-        utime.sleep(2)
+    async def _next_reading(self):
+        """Waits until read_raw returns a new ADC reading. A scanned sensor only gets one when the scanner reads
+        it, counting its latest reading again would shrink the confidence interval without measuring anything"""
         
-        print('Calibrate sensor for the maximum moisture: water')
-        print('Calibration will start in 10 seconds.')
+        if not self.scanned_only:
+            await asyncio.sleep_ms(self.CALIBRATION_INTERVAL)
+            return
         
-        for sec in range(10,-1,-1):
-            self.display.display_text("Wet Calibration", f"start in {sec} sec")
-            utime.sleep(1)
+        samples = self.sampler.samples
+        while self.sampler.samples == samples:
+            await asyncio.sleep_ms(self.CALIBRATION_INTERVAL)
 
-        self.display.display_text(line_1="Keep Wet")
+
+    async def measure_converged(self):
+        """Samples quickly until the 95% confidence interval of the mean is within CALIBRATION_TOLERANCE.
+        Readings far from the running mean are rejected, and the result is a trimmed mean.
+        Returns (value, quality)"""
         
-        print('Starting maximum calibration')
+        running = RunningStats()
+        readings = array('H', bytes(2 * self.CALIBRATION_MAX_SAMPLES))
+        kept = rejected = 0
+        screened = False
+        
+        for _ in range(self.CALIBRATION_MAX_SAMPLES):
+            reading = self.read_raw()
+            limit = max(self.OUTLIER_SIGMA * running.stdev(), self.CALIBRATION_TOLERANCE)
+            if screened and abs(reading - running.mean) > limit:
+                rejected += 1
+            else:
+                running.add(reading)
+                readings[kept] = reading
+                kept += 1
+                
+                if not screened and kept == self.CALIBRATION_MIN_SAMPLES:
+                    # spikes among the first readings would inflate the variance for good, so they are dropped
+                    # against the median before rejecting against the running mean
+                    running, kept = self._screen(readings, kept)
+                    rejected += self.CALIBRATION_MIN_SAMPLES - kept
+                    screened = True
+                
+                if kept >= self.CALIBRATION_MIN_SAMPLES and running.ci95() <= self.CALIBRATION_TOLERANCE:
+                    break
+            
+            await self._next_reading()
+        
+        value = int(round(trimmed_mean(readings[:kept])))
+        return value, {'ci': round(running.ci95(), 1), 'samples': kept, 'rejected': rejected}
+
 
-        max_value = self.get_average_reading(iterations)
+    async def calibrate_async(self):
+        """Measures the probe in air and then in water. Each measurement stops as soon as it has converged, and
+        wet calibration starts once the probe is in water. Returns (min_value, max_value)"""
+        
+        print('Calibrate sensor for the minimum moisture: air.')
+        for sec in range(self.CALIBRATION_COUNTDOWN, -1, -1):
+            self.display.display_text("Dry Calibration", f"start in {sec} sec")
+            await asyncio.sleep(1)
 
-        print('Maximum calibration complete')
-        self.display.display_text("Wet Calibration", "Done!")
-        utime.sleep(2)
+        self.display.display_text(line_1="Keep Dry")
+        min_value, dry_quality = await self.measure_converged()
+        print('Minimum calibration complete', min_value, dry_quality)
+        
+        print('Calibrate sensor for the maximum moisture: water')
+        self.display.display_text("Wet Calibration", "Put in water")
+        
+        # wait until the reading moved far enough from the dry one, then let it settle
+        waited = 0
+        while abs(self.read_raw() - min_value) < min_value // self.WET_CHANGE and waited < self.WET_TIMEOUT:
+            await asyncio.sleep_ms(100)
+            waited += 100
+        
+        self.display.display_text(line_1="Keep Wet")
+        await asyncio.sleep_ms(self.SETTLE_TIME)
+        max_value, wet_quality = await self.measure_converged()
+        print('Maximum calibration complete', max_value, wet_quality)
         
         print('Calibration complete!')
+        self.display.display_text(f"min = {min_value}", f"max = {max_value}")
+        
+        self.calibrated_min = min_value
+        self.calibrated_max = max_value
+        self.calibration_quality = {'dry': dry_quality, 'wet': wet_quality}
+        
+        return self.calibrated_min, self.calibrated_max
         
-        print('min_value = ', round(min_value))
-        print('max_value = ', round(max_value))
-        self.display.display_text(f"min = {int(round(min_value, -2))}", f"max = {int(round(max_value, -2))}")
+    def to_pct(self, reading, scale:int = 100):
+        """Converts raw ADC reading to moisture percent using calibration values, with scale 10_000 in hundredths
+        of a percent. Integer math only, floats would be allocated on every call"""
+        span = self.calibrated_max - self.calibrated_min
+        if not span:
+            return 0
         
-        return int(round(min_value, -2)), int(round(max_value, -2))
+        # truncates toward zero like int() of the float result did
+        percent = abs(reading - self.calibrated_min) * scale // abs(span)
+        return percent if (reading - self.calibrated_min < 0) == (span < 0) else -percent
         
     def get_moisture_pct(self):
-        """Get moisture percent based on average reading"""
-        try:
-            percent = ((self.get_average_reading(25) - self.calibrated_min) /
-                       (self.calibrated_max - self.calibrated_min)) * 100
-        except ZeroDivisionError:
-            percent = 0
+        """Get moisture percent based on filtered background reading, None until the sensor is calibrated and the
+        first sample is taken"""
+        if self.calibrated_min is None or self.calibrated_max is None or not self.sampler.ready():
+            return None
         
-        return int(percent)
+        return self.to_pct(self.sampler.ema())
 
 if __name__ == '__main__':
+    from bus import Bus
+    from clock import Clock
     from config import Config
     from display import Display
-    from moisture import MoistureSensor
+    from lcd import LCD
             
     class Manager:
          """Goal is to keep track of all instances of classes and share among each other"""
-         def __init__(self):
+         def __init__(self, lcd):
+             self.bus = Bus()
+             self.clock = Clock(self.bus)
              self.config = Config(self)
-             self.display = Display(self)
-             self.moisture_sensor = MoistureSensor(adc_pin=27, min_value=self.config.items['moisture_sensor_min'],
-                                            max_value=self.config.items['moisture_sensor_max'], manager=self)
+             self.display = Display(self, lcd)
+             self.moisture_sensor = MoistureSensor(adc_pin=27, min_value=self.config.planter_item(0, 'moisture_sensor_min'),
+                                            max_value=self.config.planter_item(0, 'moisture_sensor_max'), manager=self)
 
     
-    manager = Manager()
+    # splash screen first, the rest is constructed after
+    lcd = LCD()
+    lcd.write_frame("Moisture test", "starting...")
+    manager = Manager(lcd)
     
     print(manager.config.items)
     
-    MIN_VALUE=manager.config.items['moisture_sensor_min']
-    MAX_VALUE=manager.config.items['moisture_sensor_max'] 
+    MIN_VALUE=manager.config.planter_item(0, 'moisture_sensor_min')
+    MAX_VALUE=manager.config.planter_item(0, 'moisture_sensor_max') 
     
     
     if MIN_VALUE is None or MAX_VALUE is None:
-       manager.config.set_moisture_sensor_settings(*manager.moisture_sensor.calibrate())
+       manager.config.set_moisture_sensor_settings(*manager.moisture_sensor.calibrate(), 0,
+                                                   manager.moisture_sensor.calibration_quality)
     else:
         print('No calibration needed')
         
     while True:
         print(f"Moisture {manager.moisture_sensor.get_moisture_pct()}%")
+        utime.sleep(1)
         
\ No newline at end of file
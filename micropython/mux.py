@@ -0,0 +1,35 @@
+""" Analog multiplexer (CD4051/CD74HC4067 style) that connects one of several sensors to a single ADC pin """
+
+from machine import Pin
+
+class Mux:
+    def __init__(self, select_pins:list):
+        """ select_pins are the address lines, least significant bit first """
+        self.pins = [Pin(pin, Pin.OUT, value=0) for pin in select_pins]
+        self.address = 0
+
+    def channels(self):
+        return 1 << len(self.pins)
+
+    def select(self, address:int):
+        """ Connects channel address to the common output, pins are only touched if the address changes """
+        if address == self.address:
+            return
+
+        for bit, pin in enumerate(self.pins):
+            pin.value((address >> bit) & 1)
+        self.address = address
+
+
+if __name__ == '__main__':
+    from machine import ADC
+    import utime
+
+    mux = Mux([5, 6, 7])
+    adc = ADC(Pin(26))
+
+    while True:
+        for address in range(mux.channels()):
+            mux.select(address)
+            print(address, adc.read_u16())
+        utime.sleep(1)
@@ -0,0 +1,83 @@
+""" Low power mode for battery and solar powered planters. Once the screen saver is up the LCD backlight goes
+off and the CPU spends the time between two sampler ticks in machine.lightsleep. On the rp2 every enabled GPIO IRQ
+ends light sleep, so turning or pressing the rotary encoder wakes it up, and its IRQs record the event as usual.
+Switched on with the low_power setting """
+
+import machine
+import uasyncio as asyncio
+import utime
+
+
+class PowerManager:
+    def __init__(self, manager):
+        self.manager = manager
+        self.display = manager.display
+        self.scanner = manager.scanner
+
+        self.started = utime.ticks_ms()
+        self.asleep_ms = 0
+        self.sleeps = 0
+        self.wakes = 0 # light sleeps ended early by input
+        self.wake_latency_max_us = 0
+
+    def resting(self):
+        """ True while the screen saver is up and no calibration runs. The display latches the screen saver once
+        the UI rested, comparing with the last input here would wrap after ~6 days without any """
+        display = self.display
+        return display.saver and display.calibration is None
+
+    def may_sleep(self):
+        """ Light sleep stops the soft timers that end pump pulses, so it waits while a pump runs """
+        return self.resting() and not self.manager.control.pumping() and not self.display.rotary.pending()
+
+    def duty_cycle_pct(self):
+        """ Share of time spent awake since start """
+        elapsed = utime.ticks_diff(utime.ticks_ms(), self.started)
+        return 100 - self.asleep_ms * 100 // elapsed if elapsed else 100
+
+    def wake_latency_us(self):
+        """ Time from being woken by input until the LCD was redrawn, of the last wake """
+        return self.display.wake_latency_us
+
+    def _sleep(self, ms:int):
+        start = utime.ticks_ms()
+        machine.lightsleep(ms)
+        self.asleep_ms += utime.ticks_diff(utime.ticks_ms(), start)
+        self.sleeps += 1
+
+        if self.display.rotary.pending():
+            self.wakes += 1
+            self.display.woke_at = utime.ticks_us()
+
+    async def run(self):
+        """ Task that takes sampling over from the scanner's timer, which does not run in light sleep. Reads one
+        sensor per tick, lets the other tasks run and sleeps until the next tick """
+        scanner, display = self.scanner, self.display
+        scanner.stop()
+        if not scanner.prepare():
+            return
+
+        tick = scanner.tick_ms
+        next_tick = utime.ticks_ms()
+        while True:
+            scanner.tick()
+            next_tick = utime.ticks_add(next_tick, tick)
+
+            # input wakes us early, the rest of the tick is then spent awake so it gets handled right away
+            wait = utime.ticks_diff(next_tick, utime.ticks_ms())
+            while wait > 0:
+                if self.may_sleep():
+                    if display.lcd.backlight:
+                        display.lcd.set_backlight(False)
+                    self._sleep(wait)
+                else:
+                    await asyncio.sleep_ms(wait)
+                wait = utime.ticks_diff(next_tick, utime.ticks_ms())
+
+            latency = display.wake_latency_us
+            if latency is not None and latency > self.wake_latency_max_us:
+                self.wake_latency_max_us = latency
+
+            if -wait > scanner.period_ms: # fell a whole period behind
+                next_tick = utime.ticks_ms()
+            await asyncio.sleep_ms(0) # when there was no time left to wait
@@ -1,4 +1,6 @@
+from array import array
 import machine
+import micropython
 import utime
 
 class Rotary:
@@ -7,56 +9,178 @@ class Rotary:
     SW_PRESS = 4
     SW_RELEASE = 8
 
-    def __init__(self, dt, clk, sw):
+    QUEUE_SIZE = 16 # switch events that can wait for dispatch
+
+    # Quarter steps for every (previous state << 2 | new state), state is dt << 1 | clk. Turning clockwise goes
+    # 3, 2, 0, 1 and back to 3. Transitions that skip a state count nothing, a contact that bounces between two
+    # states adds and takes away the same quarter step, so neither causes extra or missed detents
+    TRANSITIONS = array('b', (0, 1, -1, 0, -1, 0, 0, 1, 1, 0, 0, -1, 0, -1, 1, 0))
+    REST = 0b11 # state at a detent
+    DEBOUNCE_US = 200 # edges this soon after the last one are counted as bounce
+    SLOW_US = 200_000 # detents further apart start a new spin at slow speed
+    FAST_US = 60_000 # mean time between detents below which spinning counts as fast
+
+    def __init__(self, dt, clk, sw, notify=None):
+        """ IRQs only record events, handlers are called later from dispatch().
+        If notify is given it is called from the IRQ so the owner can run dispatch() (e.g. ThreadSafeFlag.set),
+        otherwise dispatch() is run through micropython.schedule """
         self.dt_pin = machine.Pin(dt, machine.Pin.IN, machine.Pin.PULL_DOWN)
         self.clk_pin = machine.Pin(clk, machine.Pin.IN, machine.Pin.PULL_DOWN)
         self.sw_pin = machine.Pin(sw, machine.Pin.IN, machine.Pin.PULL_DOWN)
         self.last_status = (self.dt_pin.value() << 1) | self.clk_pin.value()
+        self.quarters = 0 # quarter steps since the last detent
+        self.last_edge_us = utime.ticks_us()
+        self.bounces = 0 # edges that came within DEBOUNCE_US of the one before
+
+        # speed of the current spin, smoothed time between detents in the same direction
+        self.last_detent_us = self.last_edge_us
+        self.interval_us = self.SLOW_US
+        self.direction = 0
+
+        self.handlers = []
+        self.last_button_status = self.sw_pin.value()
+        self.notify = notify
+
+        # Rotation is only counted, dispatch() hands the net number of steps since last dispatch to the handlers.
+        # position is written by the IRQ only and dispatched_position by dispatch only, so no locking is needed
+        self.position = 0
+        self.dispatched_position = 0
+
+        # Ring buffer of switch events together with rotation position at the time, so order is kept.
+        # head is written by the IRQ only and tail by dispatch only
+        self.events = bytearray(self.QUEUE_SIZE)
+        self.event_positions = array('i', bytes(4 * self.QUEUE_SIZE))
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0 # switch events lost because queue was full
+
+        self.scheduled = False
+        self._dispatch_ref = self._scheduled_dispatch # bound method allocated once, not in the IRQ
 
         # Set up interrupts for rotary movement and switch press
         self.dt_pin.irq(handler=self.rotary_change, trigger=machine.Pin.IRQ_FALLING | machine.Pin.IRQ_RISING)
         self.clk_pin.irq(handler=self.rotary_change, trigger=machine.Pin.IRQ_FALLING | machine.Pin.IRQ_RISING)
         self.sw_pin.irq(handler=self.switch_detect, trigger=machine.Pin.IRQ_FALLING | machine.Pin.IRQ_RISING)
 
-        self.handlers = []
-        self.last_button_status = self.sw_pin.value()
-
     def rotary_change(self, pin):
+        # every edge is read, even a bounce. Skipping one could leave last_status behind the pins, the next edge
+        # would then look like a skipped state and its quarter step would be lost. Bounces cancel out in the table
+        now = utime.ticks_us()
+        if utime.ticks_diff(now, self.last_edge_us) < self.DEBOUNCE_US:
+            self.bounces += 1
+        self.last_edge_us = now
+
         new_status = (self.dt_pin.value() << 1) | self.clk_pin.value()
         if new_status == self.last_status:
             return
 
-        transition = (self.last_status << 2) | new_status
-        if transition == 0b1110:
-            self.call_handlers(Rotary.ROT_CW)
-        elif transition == 0b1101:
-            self.call_handlers(Rotary.ROT_CCW)
-
+        self.quarters += self.TRANSITIONS[(self.last_status << 2) | new_status]
         self.last_status = new_status
 
+        # a detent counts once the encoder is back at rest, one lost quarter step on the way is tolerated
+        if new_status == self.REST:
+            if self.quarters > 2:
+                self._detent(1, now)
+            elif self.quarters < -2:
+                self._detent(-1, now)
+            self.quarters = 0
+
+    def _detent(self, direction, now):
+        """ Counts a detent and tracks the speed of the spin, runs in IRQ """
+        interval = utime.ticks_diff(now, self.last_detent_us)
+        self.last_detent_us = now
+        if direction != self.direction or interval > self.SLOW_US:
+            self.interval_us = self.SLOW_US
+        else:
+            self.interval_us = (self.interval_us + interval) >> 1
+        self.direction = direction
+
+        self.position += direction
+        self._wake()
+
+    def spinning_fast(self):
+        """ True while the encoder is turned quickly, handlers use it to apply larger steps """
+        return self.interval_us < self.FAST_US
+
     def switch_detect(self, pin):
         if self.last_button_status == self.sw_pin.value():
             return
 
         self.last_button_status = self.sw_pin.value()
+        self.interval_us = self.SLOW_US # a press ends the spin, the next turn starts slow again
         if self.sw_pin.value():
-            self.call_handlers(Rotary.SW_RELEASE)
+            self._queue(Rotary.SW_RELEASE)
         else:
-            self.call_handlers(Rotary.SW_PRESS)
+            self._queue(Rotary.SW_PRESS)
+
+    def _queue(self, event_type):
+        """ Adds switch event to ring buffer, runs in IRQ """
+        head = self.head
+        next_head = head + 1 if head + 1 < self.QUEUE_SIZE else 0
+        if next_head == self.tail:
+            self.dropped += 1
+            return
+
+        self.events[head] = event_type
+        self.event_positions[head] = self.position
+        self.head = next_head
+        self._wake()
+
+    def _wake(self):
+        """ Makes sure dispatch will run, runs in IRQ """
+        if self.notify is not None:
+            self.notify()
+        elif not self.scheduled:
+            self.scheduled = True
+            try:
+                micropython.schedule(self._dispatch_ref, None)
+            except RuntimeError: # schedule queue is full, next event tries again
+                self.scheduled = False
+
+    def _scheduled_dispatch(self, _):
+        self.scheduled = False
+        self.dispatch()
+
+    def _dispatch_rotation(self, position):
+        """ Calls handlers once with the net rotation up to position """
+        steps = position - self.dispatched_position
+        self.dispatched_position = position
+
+        if steps > 0:
+            self.call_handlers(Rotary.ROT_CW, steps)
+        elif steps < 0:
+            self.call_handlers(Rotary.ROT_CCW, -steps)
+
+    def dispatch(self):
+        """ Calls handlers for all events recorded since last dispatch. Consecutive detents are merged into one
+        call with the net number of steps """
+        while self.tail != self.head:
+            tail = self.tail
+            self._dispatch_rotation(self.event_positions[tail])
+            event_type = self.events[tail]
+            self.tail = tail + 1 if tail + 1 < self.QUEUE_SIZE else 0
+            self.call_handlers(event_type, 1)
+
+        self._dispatch_rotation(self.position)
+
+    def pending(self):
+        """ True if events were recorded that dispatch has not handled yet """
+        return self.tail != self.head or self.position != self.dispatched_position
 
     def add_handler(self, handler):
+        """ handler is called as handler(event_type, steps) """
         self.handlers.append(handler)
 
-    def call_handlers(self, event_type):
+    def call_handlers(self, event_type, steps=1):
         for handler in self.handlers:
-            handler(event_type)
+            handler(event_type, steps)
 
 # Example usage:
-def handle_rotary_event(event_type):
+def handle_rotary_event(event_type, steps):
     if event_type == Rotary.ROT_CW:
-        print("Rotary clockwise")
+        print("Rotary clockwise", steps)
     elif event_type == Rotary.ROT_CCW:
-        print("Rotary counterclockwise")
+        print("Rotary counterclockwise", steps)
     elif event_type == Rotary.SW_PRESS:
         print("Switch pressed")
     elif event_type == Rotary.SW_RELEASE:
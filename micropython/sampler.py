@@ -0,0 +1,221 @@
+""" Samples an ADC in the background with machine.Timer and keeps filtered statistics of the readings """
+
+from array import array
+from machine import Timer
+
+class Sampler:
+    EMA_SCALE = 8 # ema is kept as fixed point value, shifted by this many bits
+
+    def __init__(self, adc, period_ms:int = 100, window:int = 32, ema_shift:int = 3):
+        """ adc needs read_u16(). Exponential moving average uses alpha = 1 / 2**ema_shift """
+        self.adc = adc
+        self.period_ms = period_ms
+        self.window = window
+        self.ema_shift = ema_shift
+
+        self.buffer = array('H', bytes(2 * window)) # ring buffer of raw readings
+        self.timer = Timer()
+        self.reset()
+
+    def reset(self):
+        """ Forgets all readings """
+        self.index = 0 # where next reading goes
+        self.count = 0 # number of valid readings in buffer
+        self.total = 0 # sum of valid readings in buffer
+        self.ema_fixed = 0
+        self.minimum = 0
+        self.maximum = 0
+        self.samples = 0 # readings taken since start, for rate statistics
+
+    def start(self):
+        """ Starts periodic sampling """
+        self.timer.init(period=self.period_ms, mode=Timer.PERIODIC, callback=self._on_timer)
+
+    def stop(self):
+        """ Stops periodic sampling """
+        self.timer.deinit()
+
+    def _on_timer(self, timer):
+        self.sample()
+
+    def sample(self):
+        """ Takes one reading from the ADC """
+        self.add(self.adc.read_u16())
+
+    def add(self, value:int):
+        """ Adds reading to ring buffer and updates statistics, only integer math so nothing is allocated """
+        buffer = self.buffer
+        index = self.index
+
+        if self.count == self.window:
+            evicted = buffer[index]
+            self.total -= evicted
+        else:
+            evicted = -1
+            self.count += 1
+
+        buffer[index] = value
+        self.total += value
+        self.index = index + 1 if index + 1 < self.window else 0
+        self.samples += 1
+
+        if self.count == 1:
+            self.ema_fixed = value << self.EMA_SCALE
+            self.minimum = value
+            self.maximum = value
+            return
+
+        self.ema_fixed += ((value << self.EMA_SCALE) - self.ema_fixed) >> self.ema_shift
+
+        if value <= self.minimum:
+            self.minimum = value
+        elif evicted == self.minimum:
+            self._rescan()
+
+        if value >= self.maximum:
+            self.maximum = value
+        elif evicted == self.maximum:
+            self._rescan()
+
+    def _rescan(self):
+        """ Recomputes min and max after current extreme left the window """
+        buffer = self.buffer
+        minimum = maximum = buffer[0]
+
+        for i in range(1, self.count):
+            value = buffer[i]
+            if value < minimum:
+                minimum = value
+            elif value > maximum:
+                maximum = value
+
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def latest(self):
+        """ Most recent reading """
+        return self.buffer[self.index - 1] if self.count else 0
+
+    def ready(self):
+        """ True once at least one reading was taken """
+        return self.count > 0
+
+    def mean(self):
+        """ Mean of readings in the window """
+        return self.total // self.count if self.count else 0
+
+    def ema(self):
+        """ Exponential moving average of readings """
+        return self.ema_fixed >> self.EMA_SCALE
+
+
+class RunningStats:
+    """ Mean and variance of a stream of values with Welford's method, numerically stable and O(1) per value """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0 # sum of squared differences from the mean
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def stdev(self):
+        return self.variance() ** 0.5
+
+    def ci95(self):
+        """ Half width of the 95% confidence interval of the mean """
+        return 1.96 * self.stdev() / self.count ** 0.5 if self.count else 0.0
+
+
+def trimmed_mean(values, trim:float = 0.1):
+    """ Mean of values without the lowest and highest trim fraction, so single spikes do not move it """
+    ordered = sorted(values)
+    cut = int(len(ordered) * trim)
+    kept = ordered[cut:len(ordered) - cut] or ordered
+    return sum(kept) / len(kept)
+
+
+class Scanner:
+    """ Samples several Samplers from a single timer, one ADC read per tick in turn. Every channel is still read
+    once per period_ms, so more channels mean more short ticks rather than longer blocking ones. A channel with a
+    stretch above 1 is only read every stretch-th round, its other turns pass without an ADC read """
+
+    def __init__(self, period_ms:int = 100):
+        self.period_ms = period_ms
+        self.channels = [] # (sampler, mux, mux address)
+        self.stretches = bytearray() # rounds between two reads, per channel
+        self.waits = bytearray() # rounds left until next read, per channel
+        self.index = 0 # channel read on next tick
+        self.tick_ms = period_ms
+        self.timer = Timer()
+
+    def add(self, sampler, mux=None, address:int = 0):
+        """ Adds sampler, with mux its ADC is only connected to the sensor while mux is set to address """
+        self.channels.append((sampler, mux, address))
+        self.stretches.append(1)
+        self.waits.append(0)
+
+    def set_stretch(self, index:int, rounds:int):
+        """ Reads channel only every rounds-th round, a shorter stretch applies from the next round on """
+        rounds = max(1, min(255, rounds))
+        self.stretches[index] = rounds
+        if self.waits[index] >= rounds:
+            self.waits[index] = rounds - 1
+
+    def prepare(self):
+        """ Selects first channel and works out tick_ms, time between two reads. Returns False without channels """
+        if not self.channels:
+            return False
+
+        self.tick_ms = max(1, self.period_ms // len(self.channels))
+        self.index = 0
+        self._select(0)
+        return True
+
+    def start(self):
+        """ Starts sampling, channels added later are picked up on next start """
+        if self.prepare():
+            self.timer.init(period=self.tick_ms, mode=Timer.PERIODIC, callback=self._on_timer)
+
+    def stop(self):
+        self.timer.deinit()
+
+    def _select(self, index:int):
+        sampler, mux, address = self.channels[index]
+        if mux is not None:
+            mux.select(address)
+
+    def _on_timer(self, timer):
+        self.tick()
+
+    def tick(self):
+        """ Reads current channel and moves on to the next, called every tick_ms by the timer or a loop """
+        index = self.index
+        if self.waits[index]:
+            self.waits[index] -= 1
+        else:
+            self.channels[index][0].sample()
+            self.waits[index] = self.stretches[index] - 1
+
+        self.index = index + 1 if index + 1 < len(self.channels) else 0
+        # next channel is selected right away so the mux output has a whole tick to settle
+        self._select(self.index)
+
+
+if __name__ == '__main__':
+    from machine import ADC, Pin
+    import utime
+
+    sampler = Sampler(ADC(Pin(27)))
+    sampler.start()
+
+    while True:
+        utime.sleep(1)
+        print(f"ema {sampler.ema()} mean {sampler.mean()} min {sampler.minimum} max {sampler.maximum}")
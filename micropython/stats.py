@@ -0,0 +1,135 @@
+""" Counters and timing histograms for the hot code paths. Instrumentation is added per subsystem by wrapping
+methods of the running objects, so subsystems that are not enabled run their original code at no extra cost """
+
+from array import array
+import gc
+import uasyncio as asyncio
+import utime
+
+BUCKETS = 16 # histogram bucket n holds durations below 2**n us, last bucket holds everything longer
+
+enabled = set() # subsystems being instrumented
+histograms = {} # 'subsystem.method' -> Histogram
+gauges = {} # name -> function returning current value
+heap_min = None # lowest free heap seen by check_heap
+started = utime.ticks_ms()
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = array('L', [0] * BUCKETS)
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def add(self, duration_us:int):
+        bucket = 0
+        value = duration_us
+        while value and bucket < BUCKETS - 1:
+            value >>= 1
+            bucket += 1
+
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total_us += duration_us
+        if duration_us > self.max_us:
+            self.max_us = duration_us
+
+    def mean_us(self):
+        return self.total_us // self.count if self.count else 0
+
+    def percentile_us(self, fraction:float):
+        """ Upper bound of the bucket the given fraction of durations falls under """
+        if not self.count:
+            return 0
+
+        limit = self.count * fraction
+        seen = 0
+        for bucket in range(BUCKETS):
+            seen += self.buckets[bucket]
+            if seen >= limit:
+                return 1 << bucket
+        return self.max_us
+
+
+def enable(*subsystems):
+    enabled.update(subsystems)
+
+
+def is_enabled(subsystem:str):
+    return subsystem in enabled
+
+
+def timed(subsystem:str, obj, *names):
+    """ Replaces methods of obj with versions that record their duration, only if subsystem is enabled """
+    if subsystem not in enabled:
+        return
+
+    for name in names:
+        method = getattr(obj, name)
+        histogram = histograms.setdefault(f"{subsystem}.{name}", Histogram())
+        setattr(obj, name, _wrap(method, histogram))
+
+
+def _wrap(method, histogram):
+    def wrapper(*args, **kwargs):
+        start = utime.ticks_us()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            histogram.add(utime.ticks_diff(utime.ticks_us(), start))
+    return wrapper
+
+
+def gauge(subsystem:str, name:str, function):
+    """ Registers function whose value is shown in summary, it is only called when the summary is made """
+    if subsystem in enabled:
+        gauges[f"{subsystem}.{name}"] = function
+
+
+def get(name:str):
+    """ Current value of a gauge, or call count of a timed method. None if not instrumented """
+    if name in gauges:
+        return gauges[name]()
+    if name in histograms:
+        return histograms[name].count
+    return None
+
+
+def check_heap():
+    """ Records free heap, called once per main loop pass when 'heap' is enabled """
+    global heap_min
+    free = gc.mem_free()
+    if heap_min is None or free < heap_min:
+        heap_min = free
+
+
+def uptime_ms():
+    return utime.ticks_diff(utime.ticks_ms(), started)
+
+
+def summary():
+    """ Returns list of text lines describing everything that is instrumented """
+    lines = [f"uptime {uptime_ms() // 1000} s, heap free {gc.mem_free()} B (lowest {heap_min}), used {gc.mem_alloc()} B"]
+
+    for name in sorted(histograms):
+        histogram = histograms[name]
+        lines.append(f"{name}: n={histogram.count} mean={histogram.mean_us()}us "
+                     f"p90<{histogram.percentile_us(0.9)}us max={histogram.max_us}us")
+
+    for name in sorted(gauges):
+        lines.append(f"{name}: {gauges[name]()}")
+
+    return lines
+
+
+def print_summary():
+    for line in summary():
+        print(line)
+
+
+async def run_reporter(period_ms:int):
+    """ Task that prints summary over serial every period_ms """
+    while True:
+        await asyncio.sleep_ms(period_ms)
+        print_summary()
@@ -0,0 +1,219 @@
+""" Telemetry over Wi-Fi: a small HTTP endpoint serving current state as JSON, and an uploader that sends
+buffered readings to a collector in one HTTP request per interval. Both only use uasyncio streams, so sensing and
+the display keep running while they wait on the network """
+
+import uasyncio as asyncio
+import ujson
+import ustruct
+
+from bus import CONFIG, DAY
+from datalog import DataLog, pack_record
+
+TIMEOUT = 5_000 # ms to wait for the other side of a connection
+
+
+def parse_url(url:str):
+    """ Splits http://host:port/path into (host, port, path) """
+    if url.startswith('http://'):
+        url = url[7:]
+
+    host, _, path = url.partition('/')
+    host, _, port = host.partition(':')
+    return host, int(port) if port else 80, '/' + path
+
+
+class StatusServer:
+    """ Answers GET / with current state. The JSON is kept serialized and is only rebuilt when a value in it
+    changed since the last request, or after a setting changed or a new day started """
+
+    HOST = '0.0.0.0'
+    NOT_FOUND = b'HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n'
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.port = manager.config.items['telemetry_port']
+        self.server = None
+        self.values = None # values the cached response was built from
+        self.response = b''
+        self.requests = 0
+        self.rebuilds = 0
+        # names, thresholds and days grown are not compared on every request, their events drop the cached response
+        manager.bus.subscribe(CONFIG, self._invalidate)
+        manager.bus.subscribe(DAY, self._invalidate)
+
+    def _invalidate(self, topic:int, planter:int, value:int):
+        self.values = None
+
+    def _values(self):
+        control = self.manager.control
+        values = [control.light_on()]
+        for planter in range(len(self.manager.config.planters)):
+            values.append(control.moisture_pct(planter))
+            values.append(control.pump_on(planter))
+            values.append(control.planter_pulses(planter))
+            values.append(control.planter_pumped_ms(planter))
+        return values
+
+    def snapshot(self):
+        """ Returns full HTTP response for the current state """
+        values = self._values()
+        if values == self.values:
+            return self.response
+
+        config = self.manager.config
+        planters = []
+        for planter in range(len(config.planters)):
+            moisture, pumping, pulses, pumped_ms = values[1 + 4 * planter:5 + 4 * planter]
+            planters.append({
+                'name': config.planter_item(planter, 'name'),
+                'days_grown': config.get_days_grown(planter),
+                'moisture': moisture,
+                'threshold': config.planter_item(planter, 'threshold_moisture'),
+                'pumping': pumping,
+                'pulses': pulses,
+                'pumped_s_today': pumped_ms // 1000,
+            })
+
+        body = ujson.dumps({'light': values[0], 'planters': planters}).encode()
+        header = f"HTTP/1.0 200 OK\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+        self.response = header.encode() + body
+        self.values = values
+        self.rebuilds += 1
+        return self.response
+
+    async def _serve(self, reader, writer):
+        try:
+            request = await asyncio.wait_for_ms(reader.readline(), TIMEOUT)
+            while True: # headers are not needed
+                line = await asyncio.wait_for_ms(reader.readline(), TIMEOUT)
+                if not line or line == b'\r\n':
+                    break
+
+            self.requests += 1
+            if request.startswith(b'GET / ') or request.startswith(b'GET /state '):
+                writer.write(self.snapshot())
+            else:
+                writer.write(self.NOT_FOUND)
+            await writer.drain()
+        except (OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    async def run(self):
+        """ Task that serves requests until cancelled, telemetry_port 0 switches the endpoint off """
+        if not self.port:
+            return
+
+        self.server = await asyncio.start_server(self._serve, self.HOST, self.port)
+        try:
+            await self.server.wait_closed()
+        finally:
+            self.server.close()
+
+
+class Uploader:
+    """ Keeps readings in a RAM ring buffer and posts everything not yet sent to telemetry_url every
+    telemetry_push_s, backing off exponentially while the collector does not answer """
+
+    MAX_BACKOFF = 60 * 60_000 # ms
+
+    def __init__(self, manager):
+        items = manager.config.items
+        self.wifi = manager.wifi
+        self.url = items['telemetry_url']
+        self.period = items['telemetry_push_s'] * 1000
+        self.backoff = self.period
+
+        self.capacity = items['telemetry_buffer']
+        self.buffer = bytearray(self.capacity * DataLog.RECORD_SIZE)
+        self.written = 0 # readings recorded since start, reading n is kept at n % capacity
+        self.acked = 0 # readings before this one were accepted by the collector
+
+        self.uploads = 0
+        self.failures = 0
+        self.bytes_sent = 0
+
+    def record(self, timestamp:int, raw:int, moisture_pct:int, state:int = 0, planter:int = 0):
+        """ Same arguments as DataLog.record, oldest unsent reading is overwritten once the buffer is full """
+        if not self.url:
+            return
+
+        pack_record(self.buffer, self.written % self.capacity * DataLog.RECORD_SIZE, timestamp, raw, moisture_pct,
+                    state, planter)
+        self.written += 1
+
+    def pending(self):
+        return self.written - max(self.acked, self.written - self.capacity)
+
+    def dropped(self):
+        """ Readings overwritten before they could be sent """
+        return max(0, self.written - self.capacity - self.acked)
+
+    def _body(self, start:int, end:int):
+        readings = []
+        for number in range(start, end):
+            timestamp, raw, moisture_pct, state = ustruct.unpack_from(
+                DataLog.RECORD_FORMAT, self.buffer, number % self.capacity * DataLog.RECORD_SIZE)
+            readings.append((timestamp, state >> DataLog.PLANTER_SHIFT, raw, moisture_pct,
+                             state & ((1 << DataLog.PLANTER_SHIFT) - 1)))
+
+        return ujson.dumps({'fields': ('time', 'planter', 'raw', 'moisture', 'state'), 'readings': readings}).encode()
+
+    async def push(self):
+        """ Posts all pending readings in one request, returns True if the collector accepted them """
+        end = self.written
+        start = max(self.acked, end - self.capacity)
+        if start == end:
+            return True
+
+        body = self._body(start, end)
+        host, port, path = parse_url(self.url)
+        header = (f"POST {path} HTTP/1.0\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                  f"Content-Length: {len(body)}\r\n\r\n")
+
+        reader, writer = await asyncio.wait_for_ms(asyncio.open_connection(host, port), TIMEOUT)
+        try:
+            writer.write(header.encode())
+            writer.write(body)
+            await writer.drain()
+            status = await asyncio.wait_for_ms(reader.readline(), TIMEOUT)
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+        parts = status.split()
+        if len(parts) < 2 or not parts[1].startswith(b'2'):
+            return False
+
+        self.acked = end
+        self.uploads += 1
+        self.bytes_sent += len(header) + len(body)
+        return True
+
+    async def run(self):
+        """ Task that uploads every telemetry_push_s while Wi-Fi is up, telemetry_url '' switches uploads off """
+        if not self.url:
+            return
+
+        delay = self.period
+        while True:
+            await asyncio.sleep_ms(delay)
+            delay = self.period
+
+            if not self.wifi.isconnected() or not self.pending():
+                continue
+
+            try:
+                ok = await self.push()
+            except (OSError, asyncio.TimeoutError) as e:
+                print('Telemetry upload failed: ', e)
+                ok = False
+
+            if ok:
+                self.backoff = self.period
+            else:
+                self.failures += 1
+                delay = self.backoff
+                self.backoff = min(self.backoff * 2, self.MAX_BACKOFF)
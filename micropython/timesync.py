@@ -0,0 +1,87 @@
+""" Corrects the clock from NTP whenever Wi-Fi is up and remembers the last known time, so the date survives restarts
+without network """
+
+import ntptime
+import uasyncio as asyncio
+import utime
+
+class TimeSync:
+    TIME_FILE = 'clock.txt'
+    RESYNC_PERIOD = 12 * 60 * 60_000 # ms between NTP syncs once synced
+    MIN_RETRY = 30_000 # ms to wait after first failed sync, doubles with every failure
+    MAX_RETRY = 30 * 60_000
+    SAVE_PERIOD = 6 * 60 * 60_000 # ms between saving current time to flash
+    CHECK_PERIOD = 5_000 # ms between checks for Wi-Fi
+
+    def __init__(self, wifi, clock):
+        self.wifi = wifi
+        self.clock = clock
+        self.synced_at = None # ticks_ms of last successful sync
+        self.saved_at = None
+        self.retry = self.MIN_RETRY
+        self.syncs = 0
+        self.failures = 0
+        self.flash_writes = 0
+
+    def is_valid(self):
+        """ True if clock holds a real date """
+        return self.clock.is_valid()
+
+    def restore(self):
+        """ Sets clock to the last saved time if it was never set. Returns True if time was restored """
+        if self.is_valid():
+            return False
+
+        try:
+            with open(self.TIME_FILE, 'r') as f:
+                seconds = int(f.read())
+        except (OSError, ValueError):
+            return False
+
+        self.clock.set(seconds)
+        print('Restored last known time')
+        return True
+
+    def save(self):
+        """ Saves current time so it can be restored after a restart """
+        if not self.is_valid():
+            return
+
+        with open(self.TIME_FILE, 'w') as f:
+            f.write(str(self.clock.time()))
+        self.saved_at = utime.ticks_ms()
+        self.flash_writes += 1
+
+    def sync(self):
+        """ Corrects clock from NTP, small offsets are slewed in. Returns True on success """
+        try:
+            self.clock.correct(ntptime.time())
+        except Exception as e:
+            self.failures += 1
+            print('Failed to syncronize time: ', e)
+            return False
+
+        self.syncs += 1
+        self.synced_at = utime.ticks_ms()
+        print('Time synchronized')
+        return True
+
+    def _due(self, ticks, period):
+        return ticks is None or utime.ticks_diff(utime.ticks_ms(), ticks) >= period
+
+    async def run(self):
+        """ Task that syncs as soon as Wi-Fi is up, retrying with exponential backoff, and saves time now and then """
+        while True:
+            if self.wifi.isconnected() and self._due(self.synced_at, self.RESYNC_PERIOD):
+                if self.sync():
+                    self.retry = self.MIN_RETRY
+                    self.save()
+                else:
+                    await asyncio.sleep_ms(self.retry)
+                    self.retry = min(self.retry * 2, self.MAX_RETRY)
+                    continue
+
+            if self._due(self.saved_at, self.SAVE_PERIOD):
+                self.save()
+
+            await asyncio.sleep_ms(self.CHECK_PERIOD)
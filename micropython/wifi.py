@@ -0,0 +1,73 @@
+""" Keeps Wi-Fi connected in the background, with a timeout per attempt and exponential backoff between them """
+
+import network
+import uasyncio as asyncio
+import utime
+
+from secrets import WIFI_SSID, WIFI_PASS
+
+class WiFi:
+    CONNECT_TIMEOUT = 15_000 # ms to wait for one connection attempt
+    MIN_BACKOFF = 5_000 # ms to wait after first failed attempt, doubles with every failure
+    MAX_BACKOFF = 300_000
+    CHECK_PERIOD = 10_000 # ms between connection checks once connected
+    POLL_PERIOD = 100 # ms between status checks while connecting
+
+    def __init__(self, ssid:str = WIFI_SSID, password:str = WIFI_PASS):
+        self.ssid = ssid
+        self.password = password
+        self.wlan = network.WLAN(network.STA_IF)
+        self.backoff = self.MIN_BACKOFF
+        self.attempts = 0
+        self.connected_at = None # ticks_ms when connection was made
+
+    def start(self):
+        """ Starts connecting without waiting for the result """
+        self.wlan.active(True)
+        if not self.wlan.isconnected() and self.wlan.status() != network.STAT_CONNECTING:
+            self.wlan.connect(self.ssid, self.password)
+
+    def stop(self):
+        """ Switches the radio off, e.g. for light sleep """
+        self.wlan.disconnect()
+        self.wlan.active(False)
+
+    def isconnected(self):
+        return self.wlan.isconnected()
+
+    async def connect(self):
+        """ Waits up to CONNECT_TIMEOUT for a connection, an attempt already in progress is reused.
+        Returns True if connected """
+        self.attempts += 1
+        self.start()
+
+        started = utime.ticks_ms()
+        while utime.ticks_diff(utime.ticks_ms(), started) < self.CONNECT_TIMEOUT:
+            if self.wlan.isconnected():
+                self.connected_at = utime.ticks_ms()
+                print("Conected to Wi-Fi")
+                print("Network config:", self.wlan.ifconfig())
+                return True
+            await asyncio.sleep_ms(self.POLL_PERIOD)
+
+        self.wlan.disconnect() # next attempt starts from scratch
+        print('Wi-Fi connection timed out, attempt', self.attempts)
+        return False
+
+    async def run(self):
+        """ Task that keeps connection up, reconnecting with exponential backoff """
+        while True:
+            if self.wlan.isconnected():
+                await asyncio.sleep_ms(self.CHECK_PERIOD)
+                continue
+
+            if await self.connect():
+                self.backoff = self.MIN_BACKOFF
+            else:
+                await asyncio.sleep_ms(self.backoff)
+                self.backoff = min(self.backoff * 2, self.MAX_BACKOFF)
+
+
+if __name__ == '__main__':
+    wifi = WiFi()
+    print('connected' if asyncio.run(wifi.connect()) else 'not connected')
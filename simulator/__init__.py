@@ -0,0 +1,45 @@
+""" Runs the micropython firmware on CPython. install() puts the fake MicroPython modules (machine, utime,
+network, ...) and the firmware folder on sys.path, after that firmware modules import as on the Pico """
+
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FAKES = os.path.join(ROOT, 'fakes')
+FIRMWARE = os.path.join(os.path.dirname(ROOT), 'micropython')
+
+
+HEAP_SIZE = 192 * 1024 # roughly what MicroPython gets on a Pico W
+
+
+def install():
+    for path in (FIRMWARE, FAKES):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    # MicroPython's gc has heap statistics and a collection threshold, CPython's does not
+    import gc
+    import tracemalloc
+
+    def mem_alloc():
+        return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+    def threshold(amount=None):
+        if amount is None:
+            return gc._threshold
+        gc._threshold = amount
+
+    gc._threshold = -1
+    gc.mem_alloc = mem_alloc
+    gc.mem_free = lambda: HEAP_SIZE - mem_alloc()
+    gc.threshold = threshold
+
+    # _thread is built into CPython, so putting the fake on sys.path is not enough. threading imported the real
+    # one before the swap and keeps using it, the fake hands everything it does not fake on to the real one
+    import threading
+    if getattr(sys.modules['_thread'], '__file__', None) is None:
+        spec = importlib.util.spec_from_file_location('_thread', os.path.join(FAKES, '_thread.py'))
+        fake = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(fake)
+        sys.modules['_thread'] = fake
@@ -0,0 +1,824 @@
+""" Benchmark scenarios for the firmware running in the simulator.
+
+Every scenario builds a fresh main.Manager on simulated hardware and reports I2C traffic, virtual time spent
+blocked in sleeps and bus transfers, total virtual time and peak Python heap allocated while it ran. Numbers are
+compared against budgets.json and the run fails if any of them got worse.
+
+    python -m simulator.bench            run and compare against budgets
+    python -m simulator.bench --update   store current numbers as new budgets
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import tracemalloc
+
+if __package__ in (None, ''):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import simulator
+
+simulator.install()
+
+import machine
+import network
+import ntptime
+import uasyncio as asyncio
+import vclock
+from simulator import devices
+from simulator.collector import Collector, fetch
+
+BUDGETS = os.path.join(simulator.ROOT, 'budgets.json')
+METRICS = ('i2c_bytes', 'i2c_transactions', 'blocked_ms', 'elapsed_ms', 'alloc_bytes', 'flash_writes',
+           'sample_jitter_ms', 'duty_cycle_pct', 'wake_latency_ms', 'adc_reads') # the last ones only where measured
+TOLERANCE = {'alloc_bytes': 0.30} # peak CPython heap is noisy (free lists, lazy caches), other numbers are exact
+
+SCENARIOS = {}
+
+
+def scenario(function):
+    SCENARIOS[function.__name__] = function
+    return function
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Sim:
+    """ Simulated planter: peripherals plus a working directory holding a copy of settings.json """
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix='planter_sim_')
+        shutil.copy(os.path.join(simulator.FIRMWARE, 'settings.json'), self.directory)
+        self.previous_directory = os.getcwd()
+        os.chdir(self.directory)
+
+        machine.reset_all()
+        network.access_point_up = True
+        ntptime.reachable = True
+        self.lcd = devices.HD44780()
+        machine.I2C.devices[0x27] = self.lcd
+        self.soil = devices.Soil(moisture_pct=40)
+        self.encoder = devices.Encoder()
+        self.encoder.rest()
+
+        self.manager = None
+        self.edit_settings(telemetry_port=free_port()) # status endpoint runs on a real socket
+
+    def edit_settings(self, **items):
+        """ Changes settings.json before the firmware starts """
+        with open('settings.json') as f:
+            settings = json.load(f)
+        settings.update(items)
+        with open('settings.json', 'w') as f:
+            json.dump(settings, f)
+
+    def build(self):
+        import main
+        self.manager = main.Manager()
+        return self.manager
+
+    def run(self, seconds, *tasks):
+        """ Runs the firmware's main loop for seconds of virtual time, tasks are coroutines such as a simulated user
+        that run next to it and are cancelled at the end """
+        import main
+
+        async def run_for():
+            for task in tasks:
+                asyncio.create_task(task)
+            try:
+                await asyncio.wait_for(main.run(self.manager), seconds)
+            except asyncio.TimeoutError:
+                pass
+
+        asyncio.run(run_for())
+
+    def flash_writes(self):
+        manager = self.manager
+        if manager is None:
+            return 0
+        return manager.config.flash_writes + manager.datalog.flash_writes + manager.time_sync.flash_writes
+
+    def close(self):
+        os.chdir(self.previous_directory)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def measure(sim, function):
+    """ Runs function(sim) and returns its metrics """
+    machine.I2C.reset_traffic()
+    blocked_us = vclock.blocked_us
+    start_us = vclock.now_us
+    flash_writes = sim.flash_writes()
+
+    tracemalloc.start()
+    try:
+        function(sim)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'i2c_bytes': machine.I2C.bytes_written,
+        'i2c_transactions': machine.I2C.transactions,
+        'blocked_ms': round((vclock.blocked_us - blocked_us) / 1000, 1),
+        'elapsed_ms': round((vclock.now_us - start_us) / 1000, 1),
+        'alloc_bytes': peak,
+        'flash_writes': sim.flash_writes() - flash_writes,
+    }
+
+
+def check_lcd(sim, *expected):
+    """ Fails the scenario if the LCD does not start with the expected text """
+    lines = sim.lcd.lines()
+    for line, text in zip(lines, expected):
+        if not line.startswith(text):
+            raise AssertionError(f"LCD shows {lines}, expected {expected}")
+    if sim.lcd.timing_violations:
+        raise AssertionError(f"{sim.lcd.timing_violations} LCD writes while controller was busy")
+
+
+@scenario
+def boot(sim):
+    """ Power on until everything is constructed. The startup message must be shown before anything but the LCD is
+    loaded, boot.py included, and Wi-Fi must have started connecting. Firmware modules are imported up front, what
+    CPython allocates for an import says nothing about the board, so only the constructors are measured while
+    bootprofile still records the order of the steps """
+    # the board runs boot.py before main.py, it must not load anything ahead of the splash screen
+    before = set(sys.modules)
+    import boot
+    loaded = sorted(name for name in set(sys.modules) - before if name != 'boot'
+                    and os.path.dirname(getattr(sys.modules[name], '__file__', None) or '') == simulator.FIRMWARE)
+    if loaded:
+        raise AssertionError(f"boot.py loads {loaded} before the splash screen")
+
+    import bootprofile
+    import main
+    for name in sorted(os.listdir(simulator.FIRMWARE)):
+        module, extension = os.path.splitext(name)
+        if extension == '.py' and module not in ('boot', 'main'):
+            __import__(module)
+
+    def run(sim):
+        sim.manager = main.start()
+
+    result = measure(sim, run)
+    check_lcd(sim, "Startup Sequence", "in progress...")
+
+    labels = [step[0] for step in bootprofile.steps]
+    if labels[:3] != ['import lcd', 'LCD', 'first screen']:
+        raise AssertionError(f"splash screen is not shown first: {labels}")
+    if sim.manager.first_display_ms > main.FIRST_SCREEN_BUDGET:
+        raise AssertionError(f"first screen after {sim.manager.first_display_ms} ms")
+    if not sim.manager.wifi.wlan.connect_calls:
+        raise AssertionError("Wi-Fi did not start connecting")
+    return result
+
+
+@scenario
+def offline(sim):
+    """ Two minutes of normal running with the router down, screen saver must still come up """
+    import main
+    network.access_point_up = False
+    ntptime.reachable = False
+    sim.manager = main.start()
+
+    result = measure(sim, lambda sim: sim.run(120))
+    check_lcd(sim, "Carrots: Day", "Moisure: 4")
+    if sim.manager.wifi.attempts < 2:
+        raise AssertionError("Wi-Fi was not retried")
+    return result
+
+
+@scenario
+def old_settings(sim):
+    """ Two minutes without network from the settings.json of the first firmware. The planter must come up with
+    default values for everything added since and save the upgraded settings """
+    import main
+    network.access_point_up = False
+    ntptime.reachable = False
+    with open('settings.json', 'w') as f:
+        json.dump({"moisture_sensor_max": 26500, "name": "Carrots", "light_duration": 14, "threshold_moisture": 34,
+                   "light_on_hour": 7, "start_date": [2024, 9, 1], "moisture_sensor_min": 56300}, f)
+    sim.manager = main.start()
+
+    result = measure(sim, lambda sim: sim.run(120))
+    check_lcd(sim, "Carrots: Day", "Moisure: 4")
+    with open('settings.json') as f:
+        settings = json.load(f)
+    if settings['planters'][0]['name'] != 'Carrots' or 'report_delta' not in settings:
+        raise AssertionError(f"settings were not upgraded: {settings}")
+    return result
+
+
+@scenario
+def idle(sim):
+    """ Two hours without network on soil that does not change. Once the forecast learned that the soil is not
+    drying, nothing may be sent to the LCD or written to flash, the display and log only act on events. The log must
+    still hold a reading for every hour """
+    import main
+    network.access_point_up = False
+    ntptime.reachable = False
+    sim.soil.noise = 30
+    sim.manager = main.start()
+    settled = {}
+
+    async def settle():
+        await asyncio.sleep(20 * 60)
+        settled['i2c_bytes'] = machine.I2C.bytes_written
+        settled['flash_writes'] = sim.flash_writes()
+
+    result = measure(sim, lambda sim: sim.run(2 * 3600 + 60, settle()))
+    check_lcd(sim, "Carrots: Day", "Moisure: ")
+    if machine.I2C.bytes_written != settled['i2c_bytes'] or sim.flash_writes() != settled['flash_writes']:
+        raise AssertionError(f"{machine.I2C.bytes_written - settled['i2c_bytes']} I2C bytes and "
+                             f"{sim.flash_writes() - settled['flash_writes']} flash writes while idle")
+    hours = [bucket for bucket, count, minimum, maximum, mean in sim.manager.datalog.hourly()]
+    if len(hours) < 3 or hours != list(range(hours[0], hours[0] + len(hours))):
+        raise AssertionError(f"hours without a reading, logged hours {hours}")
+    return result
+
+
+@scenario
+def screen_saver(sim):
+    """ Ten screen saver refreshes while moisture slowly drops """
+    import main
+    sim.build()
+    vclock.advance(5_000_000) # let the sampler fill up
+
+    def run(sim):
+        for i in range(10):
+            sim.soil.moisture_pct = 40 - i * 0.5
+            vclock.advance(250_000)
+            main.show_screen_saver(sim.manager)
+
+    result = measure(sim, run)
+    check_lcd(sim, "Carrots: Day", "Moisure: 3")
+    return result
+
+
+@scenario
+def menu_spin(sim):
+    """ Scrolling the menu back and forth, then changing the moisture threshold by 15 with a quick spin, which takes
+    larger steps, and a few slow detents """
+    sim.build()
+    display = sim.manager.display
+    display.rotary.dispatch() # events from settling the pins at startup
+
+    async def user():
+        await sim.encoder.spin_async(3)
+        await sim.encoder.spin_async(-3)
+        await sim.encoder.spin_async(2)
+        await sim.encoder.press_async()
+        await sim.encoder.spin_async(4) # 1 + 1 while it speeds up, then 5 per detent
+        await sim.encoder.spin_async(3, edge_us=60_000)
+        await sim.encoder.press_async()
+        await asyncio.sleep_ms(sim.manager.config.FLUSH_DELAY)
+        sim.manager.config.flush()
+
+    async def main_task():
+        input_task = asyncio.create_task(display.run_input())
+        await user()
+        input_task.cancel()
+
+    result = measure(sim, lambda sim: asyncio.run(main_task()))
+
+    threshold = sim.manager.config.planter_item(0, 'threshold_moisture')
+    if threshold != 34 + 15:
+        raise AssertionError(f"threshold is {threshold}, expected {34 + 15}")
+    check_lcd(sim, ">Show Start Date")
+    return result
+
+
+@scenario
+def encoder_bounce(sim):
+    """ Fast and slow spins of an encoder whose contacts bounce three times on every edge, then ten detents with one
+    slow bounce per edge that flips back after 250 us, longer than DEBOUNCE_US, and returns 50 us later. Every
+    detent must count exactly once and the menu must end up where the spins took it """
+    sim.build()
+    display, rotary = sim.manager.display, sim.manager.display.rotary
+    rotary.dispatch() # events from settling the pins at startup
+    sim.encoder.bounces = 3
+
+    async def user():
+        await sim.encoder.spin_async(12, edge_us=500)
+        await sim.encoder.spin_async(-9, edge_us=500)
+        await sim.encoder.spin_async(2, edge_us=30_000)
+        await asyncio.sleep_ms(10)
+        sim.encoder.bounces, sim.encoder.back_us, sim.encoder.forth_us = 1, 250, 50
+        await sim.encoder.spin_async(-10, edge_us=30_000)
+        await asyncio.sleep_ms(10)
+
+    async def main_task():
+        input_task = asyncio.create_task(display.run_input())
+        await user()
+        input_task.cancel()
+
+    result = measure(sim, lambda sim: asyncio.run(main_task()))
+
+    if rotary.position != 12 - 9 + 2 - 10:
+        raise AssertionError(f"encoder at {rotary.position}, expected {12 - 9 + 2 - 10}")
+    if not rotary.bounces:
+        raise AssertionError("no bounce was filtered")
+    if display.position != 0: # the menu stops at its ends
+        raise AssertionError(f"menu at {display.position}")
+    return result
+
+
+def calibration_probe(sim):
+    """ Makes the probe a noisy one with occasional spikes that is put into water 3 s after being asked to. Returns
+    a list whose only item counts the ADC reads """
+    sim.soil.noise = 300
+    wet_at = None
+    reads = [0]
+
+    def probe():
+        nonlocal wet_at
+        reads[0] += 1
+        if reads[0] % 50 == 0:
+            return 65535 # spike
+        if wet_at is None and sim.lcd.lines()[1].startswith("Put in water"):
+            wet_at = vclock.now_us + 3_000_000
+        wet = wet_at is not None and vclock.now_us >= wet_at
+        return (sim.soil.wet if wet else sim.soil.dry) + sim.soil._random() * 2 * sim.soil.noise
+
+    machine.ADC.sources[sim.soil.adc_pin] = probe
+    return reads
+
+
+@scenario
+def calibration(sim):
+    """ Full dry/wet calibration of a noisy probe with occasional spikes, put into water 3 s after being asked to.
+    Both values must come out within 100 counts of the truth """
+    sim.build()
+    calibration_probe(sim)
+
+    sensor = sim.manager.moisture_sensors[0]
+    result = measure(sim, lambda sim: asyncio.run(sensor.calibrate_async()))
+
+    values = (sensor.calibrated_min, sensor.calibrated_max)
+    if abs(values[0] - sim.soil.dry) > 100 or abs(values[1] - sim.soil.wet) > 100:
+        raise AssertionError(f"calibration gave {values}")
+    quality = sensor.calibration_quality
+    if quality['dry']['ci'] > sensor.CALIBRATION_TOLERANCE or not quality['dry']['rejected']:
+        raise AssertionError(f"calibration quality {quality}")
+    return result
+
+
+@scenario
+def calibration_dual_core(sim):
+    """ Calibration started from the menu while core 1 owns the ADC. Every kept reading must be a fresh ADC read,
+    so the readings calibration used can not outnumber the reads, and both values must be within 100 counts """
+    import main
+    network.access_point_up = False
+    ntptime.reachable = False
+    sim.edit_settings(dual_core=True)
+    sim.manager = main.start()
+    reads = calibration_probe(sim)
+    sensor = sim.manager.moisture_sensors[0]
+    started = []
+
+    async def user():
+        await asyncio.sleep(2)
+        started.append(reads[0])
+        sim.manager.display.calibrate_moisture_sentor()
+
+    result = measure(sim, lambda sim: sim.run(90, user()))
+
+    quality = sensor.calibration_quality
+    if quality is None:
+        raise AssertionError("calibration did not finish")
+    used = sum(quality[probe]['samples'] + quality[probe]['rejected'] for probe in ('dry', 'wet'))
+    if used > reads[0] - started[0]:
+        raise AssertionError(f"calibration used {used} readings from {reads[0] - started[0]} ADC reads")
+    values = (sensor.calibrated_min, sensor.calibrated_max)
+    if abs(values[0] - sim.soil.dry) > 100 or abs(values[1] - sim.soil.wet) > 100:
+        raise AssertionError(f"calibration gave {values}")
+    return result
+
+
+@scenario
+def calibration_mux(sim):
+    """ Calibration started from the menu of a planter behind a mux whose probe the forecast stretched to every 16th
+    round. Calibration must read it on every round again, so it finishes from fresh reads within 45 s, before the next
+    forecast update """
+    import main
+    network.access_point_up = False
+    ntptime.reachable = False
+    mux_pins, mux_adc_pin = [5, 6, 7], 26
+    sim.edit_settings(mux_pins=mux_pins, mux_adc_pin=mux_adc_pin)
+    with open('settings.json') as f:
+        planters = json.load(f)['planters']
+    planters[0]['mux_address'] = 0
+    sim.edit_settings(planters=planters)
+    reads = calibration_probe(sim)
+    devices.AnalogMux(mux_pins, mux_adc_pin, [machine.ADC.sources[sim.soil.adc_pin]] + [0] * 7)
+    sim.manager = main.start()
+    sensor = sim.manager.moisture_sensors[0]
+    started = []
+
+    async def user():
+        await asyncio.sleep(2)
+        sim.manager.scanner.set_stretch(0, 16) # watering is far off
+        started.append(reads[0])
+        sim.manager.display.calibrate_moisture_sentor()
+
+    result = measure(sim, lambda sim: sim.run(45, user()))
+
+    quality = sensor.calibration_quality
+    if quality is None:
+        raise AssertionError(f"calibration did not finish, {reads[0] - started[0]} ADC reads")
+    used = sum(quality[probe]['samples'] + quality[probe]['rejected'] for probe in ('dry', 'wet'))
+    if used > reads[0] - started[0]:
+        raise AssertionError(f"calibration used {used} readings from {reads[0] - started[0]} ADC reads")
+    values = (sensor.calibrated_min, sensor.calibrated_max)
+    if abs(values[0] - sim.soil.dry) > 100 or abs(values[1] - sim.soil.wet) > 100:
+        raise AssertionError(f"calibration gave {values}")
+    return result
+
+
+@scenario
+def watering(sim):
+    """ 90 minutes of running while soil dries by 12% per hour, pump must keep moisture near the threshold """
+    import main
+    sim.soil.moisture_pct = 36
+    sim.soil.dry_rate = 12
+    sim.soil.pump_pin = 3
+    sim.soil.pump_rate = 1
+    sim.manager = main.start()
+
+    result = measure(sim, lambda sim: sim.run(90 * 60))
+
+    controller = sim.manager.controller
+    threshold = sim.manager.config.planter_item(0, 'threshold_moisture')
+    if not controller.pulses():
+        raise AssertionError("pump never ran")
+    if sim.soil.moisture_pct < threshold - 2:
+        raise AssertionError(f"soil dried out to {sim.soil.moisture_pct:.1f}%")
+    if sim.soil.pump_on_us > sim.manager.config.items['water_budget_s'] * 1_000_000:
+        raise AssertionError("daily water budget exceeded")
+    return result
+
+
+@scenario
+def planters(sim):
+    """ 30 minutes with four planters behind an analog mux, each drying at its own rate. Every probe must be read
+    once per sample period and only one pump may run at a time """
+    import main
+    mux_pins, mux_adc_pin, pump_pins = [5, 6, 7], 26, [3, 14, 15, 16]
+    # fixed sampling rate, so the read counts below show whether the scanner treats all channels alike
+    sim.edit_settings(adaptive_sampling=False, mux_pins=mux_pins, mux_adc_pin=mux_adc_pin, planters=[
+        {'name': f"Pot {n + 1}", 'start_date': [2024, 9, 1], 'mux_address': n, 'pump_pin': pump_pins[n],
+         'moisture_sensor_min': 56300, 'moisture_sensor_max': 26500, 'threshold_moisture': 34}
+        for n in range(4)])
+
+    soils = [devices.Soil(adc_pin=None, moisture_pct=36, dry_rate=rate, pump_pin=pin, pump_rate=1)
+             for rate, pin in zip((4, 12, 20, 12), pump_pins)]
+    devices.AnalogMux(mux_pins, mux_adc_pin, [soil.read for soil in soils] + [0] * 4)
+    sim.manager = main.start()
+
+    overlaps = 0
+
+    async def watch_pumps():
+        nonlocal overlaps
+        while True:
+            if sum(machine.Pin.pins[pin].value() for pin in pump_pins) > 1:
+                overlaps += 1
+            await asyncio.sleep_ms(50)
+
+    result = measure(sim, lambda sim: sim.run(30 * 60, watch_pumps()))
+
+    period = sim.manager.config.items['sample_period_ms']
+    for n, sensor in enumerate(sim.manager.moisture_sensors):
+        expected = 30 * 60_000 // period
+        if abs(sensor.sampler.samples - expected) > 2:
+            raise AssertionError(f"planter {n} sampled {sensor.sampler.samples} times, expected {expected}")
+    if overlaps:
+        raise AssertionError(f"pumps ran at the same time {overlaps} times")
+    channels = sim.manager.controller.channels
+    if not all(channel.pulses for channel in channels[1:]):
+        raise AssertionError(f"pump pulses {[channel.pulses for channel in channels]}, faster drying pots not watered")
+    for n, soil in enumerate(soils):
+        if soil.moisture_pct < 34 - 2:
+            raise AssertionError(f"planter {n} dried out to {soil.moisture_pct:.1f}%")
+    return result
+
+
+@scenario
+def telemetry(sim):
+    """ 20 minutes of soil drying by 2% a minute, so a reading is logged about every minute, with uploads every
+    minute. The collector is down from minute 5 to 11. Every reading must arrive once and in order, and the status
+    endpoint must not re-serialize unchanged state but must show a changed threshold """
+    import main
+    collector = Collector()
+    collector_port = free_port()
+    sim.soil.moisture_pct = 90
+    sim.soil.dry_rate = 120
+    sim.edit_settings(telemetry_push_s=60, telemetry_url=f"http://127.0.0.1:{collector_port}/readings")
+    sim.manager = main.start()
+    server = sim.manager.status_server
+    responses = []
+
+    async def outage():
+        await asyncio.sleep(5 * 60)
+        collector.available = False
+        await asyncio.sleep(6 * 60)
+        collector.available = True
+
+    async def client():
+        await asyncio.sleep(30)
+        for _ in range(2): # second request comes right after the first, nothing changed in between
+            responses.append((await fetch('127.0.0.1', server.port), server.rebuilds))
+        sim.manager.config.set_moisture_threshold(50)
+        responses.append((await fetch('127.0.0.1', server.port), server.rebuilds))
+
+    async def serve():
+        await collector.start(port=collector_port)
+        try:
+            await asyncio.sleep(24 * 3600)
+        finally:
+            collector.close()
+
+    result = measure(sim, lambda sim: sim.run(20 * 60, serve(), outage(), client()))
+
+    uploader = sim.manager.uploader
+    readings = collector.readings()
+    times = [reading['time'] for reading in readings]
+    if len(readings) != uploader.acked or times != sorted(set(times)):
+        raise AssertionError(f"collector got {len(readings)} readings, {uploader.acked} were acknowledged")
+    if not uploader.failures or uploader.dropped():
+        raise AssertionError(f"{uploader.failures} failed uploads, {uploader.dropped()} readings dropped")
+    if len(responses) != 3:
+        raise AssertionError("status endpoint did not answer")
+    (status, body), rebuilds = responses[0]
+    if status != 'HTTP/1.0 200 OK' or json.loads(body)['planters'][0]['name'] != 'Carrots':
+        raise AssertionError(f"status endpoint answered {status} {body}")
+    if responses[1][1] != rebuilds or responses[1][0] != responses[0][0]:
+        raise AssertionError("unchanged state was serialized again")
+    if json.loads(responses[2][0][1])['planters'][0]['threshold'] != 50:
+        raise AssertionError(f"status endpoint still answers {responses[2][0][1]} after the threshold changed")
+    return result
+
+
+@scenario
+def clock(sim):
+    """ One hour across midnight with the NTP server 20 s ahead. The offset must be slewed in without stepping the
+    clock, and the cached date and daily water budgets must roll over at midnight. The light is scheduled from 1:00
+    to 3:00 two hours ahead of UTC, so it must be on """
+    import main
+    vclock.rtc_base += 23 * 3600 + 30 * 60 # 23:30
+    sim.edit_settings(utc_offset_min=120, light_on_hour=1, light_duration=2)
+    ntptime.server_time = vclock.seconds() - vclock.now_us // 1_000_000 + 20
+    sim.manager = main.start()
+    clock = sim.manager.clock
+    first_day = clock.day()
+    readings = []
+
+    async def watch():
+        while True:
+            readings.append(clock.now_ms())
+            await asyncio.sleep(60)
+
+    try:
+        result = measure(sim, lambda sim: sim.run(60 * 60, watch()))
+    finally:
+        ntptime.server_time = None
+
+    if clock.steps or not clock.corrections:
+        raise AssertionError(f"{clock.corrections} corrections, {clock.steps} steps")
+    minutes = [b - a for a, b in zip(readings, readings[1:])]
+    if min(minutes) < 60_000 or max(minutes) > 60_000 + 60_000 // clock.SLEW_RATE + 1:
+        raise AssertionError(f"clock jumped, minutes lasted {min(minutes)} to {max(minutes)} ms")
+    ahead_ms = clock.now_ms() - vclock.seconds() * 1000 # RTC of the simulator keeps the uncorrected time
+    if not 1000 < ahead_ms < 20_000:
+        raise AssertionError(f"clock is {ahead_ms} ms ahead, NTP offset was not slewed in")
+    if clock.day() != first_day + 1 or sim.manager.controller.day != first_day + 1:
+        raise AssertionError(f"day {clock.day()}, controller day {sim.manager.controller.day}, started {first_day}")
+    if not sim.manager.controller.light.is_on():
+        raise AssertionError("light is off at 2:30 local time")
+    return result
+
+
+@scenario
+def low_power(sim):
+    """ Ten minutes on battery in low power mode. One detent at minute four must wake the planter from light sleep,
+    switch the backlight on and move the menu, after REST_TIME it goes dark again. The radio must stay off although
+    the router is up. Adds the share of time spent awake and the time from waking to the first redraw """
+    import main
+    sim.edit_settings(low_power=True)
+    sim.manager = main.start()
+    seen = []
+
+    def look(timer):
+        seen.append((sim.lcd.backlight, sim.lcd.lines()[1])) # the cursor moves down to the second entry
+
+    # timers fire during light sleep, asyncio tasks would only run once something else woke the planter
+    user = machine.Timer(mode=machine.Timer.ONE_SHOT, period=4 * 60_000, callback=lambda timer: sim.encoder.spin(1))
+    before = machine.Timer(mode=machine.Timer.ONE_SHOT, period=4 * 60_000 - 1_000, callback=look)
+    after = machine.Timer(mode=machine.Timer.ONE_SHOT, period=4 * 60_000 + 500, callback=look)
+
+    result = measure(sim, lambda sim: sim.run(10 * 60))
+
+    power = sim.manager.power
+    if len(seen) != 2 or seen[0][0] or not seen[1][0] or not seen[1][1].startswith('>Set Start Date'):
+        raise AssertionError(f"backlight and second line around the wake up: {seen}")
+    if power.wakes != 1 or power.wake_latency_us() is None:
+        raise AssertionError(f"{power.wakes} wakes by input")
+    if sim.lcd.backlight:
+        raise AssertionError("backlight stayed on")
+    wlan = sim.manager.wifi.wlan
+    if wlan.active() or wlan.connect_calls:
+        raise AssertionError(f"radio is on, {wlan.connect_calls} connection attempts")
+    result['duty_cycle_pct'] = power.duty_cycle_pct()
+    result['wake_latency_ms'] = round(power.wake_latency_max_us / 1000, 1)
+    return result
+
+
+@scenario
+def forecast(sim):
+    """ Two hours of soil drying by 2% per hour from 60%, threshold is 34%. The forecast must be within an hour of
+    the truth, the screen saver must show it and the probe must be read less often than every sample period. Adds
+    the ADC reads of the probe """
+    import main
+    network.access_point_up = False
+    ntptime.reachable = False
+    sim.soil.moisture_pct = 60
+    sim.soil.dry_rate = 2
+    sim.soil.noise = 30
+    sim.manager = main.start()
+    shown = False
+
+    async def watch_lcd():
+        nonlocal shown
+        while not shown:
+            shown = '% water ' in sim.lcd.lines()[1]
+            await asyncio.sleep_ms(500)
+
+    result = measure(sim, lambda sim: sim.run(2 * 3600, watch_lcd()))
+
+    forecaster, sampler = sim.manager.forecaster, sim.manager.moisture_sensors[0].sampler
+    expected = (sim.soil.moisture_pct - 34) / 2
+    hours = forecaster.models[0].hours_until(34)
+    if hours is None or abs(hours - expected) > 1:
+        raise AssertionError(f"forecast {hours} h, expected {expected:.1f} h")
+    if not shown:
+        raise AssertionError("forecast never shown")
+    if sampler.samples * sim.manager.scanner.period_ms >= 2 * 3600_000:
+        raise AssertionError(f"{sampler.samples} reads, sampling did not slow down")
+    result['adc_reads'] = sampler.samples
+    return result
+
+
+def sampling_under_ui_load(sim, dual_core):
+    """ One minute of running while the user keeps spinning through the menu, every detent redraws the LCD. Adds
+    sample_jitter_ms, the most an interval between two ADC reads differed from the scanner tick """
+    import main
+    sim.edit_settings(dual_core=dual_core)
+    sim.manager = main.start()
+    scanner = sim.manager.scanner
+    read_at = []
+
+    tick = scanner.tick
+    def timed_tick():
+        read_at.append(vclock.now_us)
+        tick()
+    scanner.tick = timed_tick
+
+    async def user():
+        await asyncio.sleep(1)
+        while True:
+            await sim.encoder.spin_async(5)
+            await sim.encoder.spin_async(-5)
+
+    result = measure(sim, lambda sim: sim.run(60, user()))
+
+    # first second is startup, in dual core mode core 1 takes over sampling from the timer in that time
+    start_us = read_at[0] + 1_000_000
+    intervals = [b - a for a, b in zip(read_at, read_at[1:]) if a >= start_us]
+    tick_us = scanner.tick_ms * 1000
+    result['sample_jitter_ms'] = round(max(abs(interval - tick_us) for interval in intervals) / 1000, 1)
+    if len(intervals) < 50 * 1000 // scanner.tick_ms:
+        raise AssertionError(f"only {len(intervals)} samples taken")
+    return result
+
+
+@scenario
+def ui_load(sim):
+    """ Sampling on a timer of core 0 while the UI is busy, see sampling_under_ui_load """
+    return sampling_under_ui_load(sim, dual_core=False)
+
+
+@scenario
+def ui_load_dual_core(sim):
+    """ Same with sampling and control on core 1, LCD traffic on core 0 must not move the samples """
+    result = sampling_under_ui_load(sim, dual_core=True)
+    if result['sample_jitter_ms'] > 0.1:
+        raise AssertionError(f"samples on core 1 moved by {result['sample_jitter_ms']} ms")
+    if not sim.manager.core1.published:
+        raise AssertionError("core 1 did not publish")
+    return result
+
+
+def run_scenarios(names, verbose=False):
+    import main # imported once up front so import cost does not land in the first scenario
+
+    # same for whatever asyncio sets up lazily the first time tasks and timeouts are used
+    async def warm_up():
+        task = asyncio.create_task(asyncio.sleep_ms(10))
+        try:
+            await asyncio.wait_for(asyncio.sleep(1), 0.001)
+        except asyncio.TimeoutError:
+            pass
+        await task
+    asyncio.run(warm_up())
+
+    results = {}
+    for name in names:
+        # firmware modules keep state at module level (stats, boot profile), every scenario starts from a fresh import
+        for module in list(sys.modules.values()):
+            if getattr(module, '__file__', None) and os.path.dirname(module.__file__) == simulator.FIRMWARE:
+                del sys.modules[module.__name__]
+
+        sim = Sim()
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(sys.stdout if verbose else output):
+                results[name] = SCENARIOS[name](sim)
+        except Exception:
+            sys.stdout.write(output.getvalue())
+            raise
+        finally:
+            sim.close()
+    return results
+
+
+def compare(results, budgets):
+    """ Returns list of (scenario, metric, value, budget) that are over budget """
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            budget = budgets.get(name, {}).get(metric)
+            if budget is None:
+                continue
+            if value > budget * (1 + TOLERANCE.get(metric, 0)):
+                regressions.append((name, metric, value, budget))
+    return regressions
+
+
+def report(results, budgets):
+    print(f"{'scenario':<18}" + ''.join(f"{metric:>20}" for metric in METRICS))
+    for name, metrics in results.items():
+        row = f"{name:<18}"
+        for metric in METRICS:
+            budget = budgets.get(name, {}).get(metric)
+            value = metrics.get(metric, '')
+            cell = f"{value}" if budget is None else f"{value}/{budget}"
+            row += f"{cell:>20}"
+        print(row)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='*', help='scenarios to run, default all')
+    parser.add_argument('--update', action='store_true', help='store results as new budgets')
+    parser.add_argument('--verbose', action='store_true', help='show what the firmware prints')
+    args = parser.parse_args(argv)
+
+    names = args.scenarios or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario {', '.join(unknown)}, choose from {', '.join(SCENARIOS)}")
+
+    budgets = {}
+    if os.path.exists(BUDGETS):
+        with open(BUDGETS) as f:
+            budgets = json.load(f)
+
+    results = run_scenarios(names, args.verbose)
+    report(results, budgets)
+
+    if args.update:
+        budgets.update(results)
+        with open(BUDGETS, 'w') as f:
+            json.dump(budgets, f, indent=4, sort_keys=True)
+            f.write('\n')
+        print(f"budgets written to {BUDGETS}")
+        return 0
+
+    regressions = compare(results, budgets)
+    for name, metric, value, budget in regressions:
+        print(f"REGRESSION {name}.{metric}: {value} > {budget}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+""" Stand-in for the telemetry collector. Accepts the readings the planter posts and keeps them, and can be told
+to go down to exercise the uploader's backoff. Runs inside a simulation or on its own for a real planter:
+
+    python -m simulator.collector --port 8080    then set telemetry_url to http://<this host>:8080/readings
+"""
+
+import argparse
+import asyncio
+import json
+
+
+class Collector:
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.available = True # False answers every request with 503
+        self.batches = [] # decoded JSON of every accepted upload
+        self.requests = 0
+        self.server = None
+        self.port = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        """ Starts listening, port 0 picks a free one which is stored in self.port """
+        self.server = await asyncio.start_server(self._handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+    def readings(self):
+        """ All accepted readings as dicts, in the order they arrived """
+        readings = []
+        for batch in self.batches:
+            fields = batch['fields']
+            readings.extend(dict(zip(fields, reading)) for reading in batch['readings'])
+        return readings
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if not line or line == b'\r\n':
+                    break
+                name, _, value = line.decode().partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            body = await reader.readexactly(length) if length else b''
+
+            self.requests += 1
+            if not self.available:
+                status = '503 Service Unavailable'
+            elif request.startswith(b'POST '):
+                batch = json.loads(body)
+                self.batches.append(batch)
+                status = '204 No Content'
+                if self.verbose:
+                    print(f"{len(batch['readings'])} readings")
+                    for reading in batch['readings']:
+                        print('   ', dict(zip(batch['fields'], reading)))
+            else:
+                status = '405 Method Not Allowed'
+
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Length: 0\r\n\r\n".encode())
+            await writer.drain()
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def fetch(host, port, path='/'):
+    """ GET request against the planter's status endpoint, returns (status line, body) """
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET {path} HTTP/1.0\r\nHost: {host}\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    header, _, body = response.partition(b'\r\n\r\n')
+    return header.split(b'\r\n')[0].decode(), body
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args(argv)
+
+    async def serve():
+        collector = Collector(verbose=True)
+        await collector.start(args.host, args.port)
+        print(f"collecting on {args.host}:{collector.port}")
+        await collector.server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
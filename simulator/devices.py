@@ -0,0 +1,228 @@
+""" Models of the hardware around the Pico, driven through the fake machine module """
+
+import machine
+import uasyncio as asyncio
+import vclock
+
+
+class HD44780:
+    """ 16x2 character LCD behind a PCF8574 I2C backpack (P0 = RS, P2 = E, P3 = backlight, P4-P7 = D4-D7).
+    Keeps the characters on screen and counts writes that arrive while the controller is still busy """
+
+    RS = 0x01
+    ENABLE = 0x04
+    BACKLIGHT = 0x08
+
+    CHAR_US = 37 # execution time of most instructions and data writes
+    CLEAR_US = 1520 # clear display and return home
+    RESET_US = (4100, 100) # the first two 8-bit function sets after power on take longer
+
+    def __init__(self, width=16, height=2):
+        self.width = width
+        self.height = height
+        self.ddram = bytearray(b' ' * 0x80)
+        self.address = 0
+        self.four_bit = False
+        self.backlight = False
+        self.upper = None # first nibble of a 4-bit transfer
+        self.last = 0 # last value on the port
+        self.busy_until = 0
+        self.timing_violations = 0
+        self.instructions = 0
+        self.writes = 0
+
+    def write(self, data, start_us, byte_us):
+        for i, value in enumerate(data):
+            self.backlight = bool(value & self.BACKLIGHT)
+
+            # nibble is latched on falling edge of enable
+            if self.last & self.ENABLE and not value & self.ENABLE:
+                self._latch(self.last, start_us + i * byte_us)
+            self.last = value
+
+    def _latch(self, port, at_us):
+        nibble = port >> 4
+        rs = port & self.RS
+
+        if not self.four_bit:
+            # 8-bit interface, lower data lines are not connected so every nibble is an instruction
+            self._execute(nibble << 4, 0, at_us)
+            return
+
+        if self.upper is None:
+            self.upper = nibble
+            return
+
+        value = (self.upper << 4) | nibble
+        self.upper = None
+        self._execute(value, rs, at_us)
+
+    def _execute(self, value, rs, at_us):
+        if at_us < self.busy_until:
+            self.timing_violations += 1
+
+        duration = self.CHAR_US
+
+        if rs:
+            self.ddram[self.address & 0x7F] = value
+            self.address = (self.address + 1) & 0x7F
+            self.writes += 1
+        else:
+            self.instructions += 1
+            if value & 0x80: # set DDRAM address
+                self.address = value & 0x7F
+            elif value & 0x20: # function set
+                if not self.four_bit and self.instructions <= len(self.RESET_US):
+                    duration = self.RESET_US[self.instructions - 1]
+                self.four_bit = not value & 0x10
+            elif value == 0x01: # clear
+                for i in range(len(self.ddram)):
+                    self.ddram[i] = 0x20
+                self.address = 0
+                duration = self.CLEAR_US
+            elif value & 0xFE == 0x02: # return home
+                self.address = 0
+                duration = self.CLEAR_US
+
+        self.busy_until = at_us + duration
+
+    def line(self, row):
+        start = 0x40 * row
+        return self.ddram[start:start + self.width].decode()
+
+    def lines(self):
+        return [self.line(row) for row in range(self.height)]
+
+
+class Encoder:
+    """ Rotary encoder with push switch wired to dt, clk and sw pins """
+
+    # (dt, clk) levels for one detent, starting from and returning to both high
+    CW = ((1, 0), (0, 0), (0, 1), (1, 1))
+    CCW = ((0, 1), (0, 0), (1, 0), (1, 1))
+    BOUNCE_US = 20 # time between two bounces of a contact
+
+    def __init__(self, dt=12, clk=11, sw=13, bounces=0, back_us=BOUNCE_US, forth_us=BOUNCE_US):
+        """ With bounces every edge is followed by that many flips of the contact back and forth, it flips back
+        back_us after the edge and returns forth_us later """
+        self.dt = dt
+        self.clk = clk
+        self.sw = sw
+        self.bounces = bounces
+        self.back_us = back_us
+        self.forth_us = forth_us
+
+    @staticmethod
+    def _pin(id):
+        # pins can be driven before the firmware sets them up, the firmware then reads the current level
+        return machine.Pin.pins.get(id) or machine.Pin(id)
+
+    def _set(self, dt, clk):
+        for id, level in ((self.dt, dt), (self.clk, clk)):
+            pin = self._pin(id)
+            if pin.value() != level:
+                pin.drive(level)
+                for _ in range(self.bounces):
+                    vclock.advance(self.back_us)
+                    pin.drive(1 - level)
+                    vclock.advance(self.forth_us)
+                    pin.drive(level)
+
+    def rest(self):
+        """ Moves encoder to the detent position where both contacts are high and releases the switch """
+        self._set(1, 1)
+        self._pin(self.sw).drive(1)
+
+    def spin(self, steps, edge_us=1_000):
+        """ Turns the encoder by steps detents, negative is counterclockwise. edge_us is the time between edges """
+        sequence = self.CW if steps > 0 else self.CCW
+
+        for _ in range(abs(steps)):
+            for dt, clk in sequence:
+                vclock.advance(edge_us)
+                self._set(dt, clk)
+
+    def press(self, hold_us=100_000):
+        switch = self._pin(self.sw)
+        switch.drive(0)
+        vclock.advance(hold_us)
+        switch.drive(1)
+
+    async def spin_async(self, steps, edge_us=1_000):
+        """ spin() that lets other tasks run between edges """
+        sequence = self.CW if steps > 0 else self.CCW
+
+        for _ in range(abs(steps)):
+            for dt, clk in sequence:
+                await asyncio.sleep(edge_us / 1_000_000)
+                self._set(dt, clk)
+
+    async def press_async(self, hold_us=100_000):
+        """ press() that lets other tasks run while the switch is held """
+        switch = self._pin(self.sw)
+        switch.drive(0)
+        await asyncio.sleep(hold_us / 1_000_000)
+        switch.drive(1)
+
+
+class Soil:
+    """ Capacitive moisture probe, raw reading goes down as soil gets wetter. Soil dries at dry_rate percent per
+    hour and gets wetter at pump_rate percent per second while the pump pin is high """
+
+    def __init__(self, adc_pin=27, dry=56300, wet=26500, moisture_pct=50.0, noise=0,
+                 dry_rate=0.0, pump_pin=None, pump_rate=0.0):
+        self.adc_pin = adc_pin
+        self.dry = dry
+        self.wet = wet
+        self.moisture_pct = moisture_pct
+        self.noise = noise
+        self.dry_rate = dry_rate
+        self.pump_pin = pump_pin
+        self.pump_rate = pump_rate
+        self.pump_on_us = 0 # total time pump ran
+        self._updated_us = vclock.now_us
+        self._seed = 12345
+        if adc_pin is not None: # probes behind a mux are read through AnalogMux
+            machine.ADC.sources[adc_pin] = self.read
+
+    def _random(self):
+        # small LCG so runs are repeatable
+        self._seed = (self._seed * 1103515245 + 12345) & 0x7FFFFFFF
+        return self._seed / 0x7FFFFFFF - 0.5
+
+    def _update(self):
+        elapsed_us = vclock.now_us - self._updated_us
+        self._updated_us = vclock.now_us
+
+        self.moisture_pct -= self.dry_rate * elapsed_us / 3_600_000_000
+        pump = machine.Pin.pins.get(self.pump_pin)
+        if pump is not None and pump.value():
+            self.pump_on_us += elapsed_us
+            self.moisture_pct += self.pump_rate * elapsed_us / 1_000_000
+        self.moisture_pct = max(0.0, min(100.0, self.moisture_pct))
+
+    def read(self):
+        self._update()
+        value = self.dry + (self.wet - self.dry) * self.moisture_pct / 100
+        return value + self._random() * 2 * self.noise
+
+
+class AnalogMux:
+    """ Analog multiplexer in front of one ADC pin, the select pins (least significant bit first) choose which
+    source is read """
+
+    def __init__(self, select_pins, adc_pin, sources):
+        self.select_pins = select_pins
+        self.sources = sources
+        machine.ADC.sources[adc_pin] = self.read
+
+    def address(self):
+        address = 0
+        for bit, pin in enumerate(self.select_pins):
+            if machine.Pin.pins[pin].value():
+                address |= 1 << bit
+        return address
+
+    def read(self):
+        source = self.sources[self.address()]
+        return source() if callable(source) else source
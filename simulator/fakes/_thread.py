@@ -0,0 +1,53 @@
+""" Fake _thread, start_new_thread runs the function as the second core on the virtual clock, see vclock.
+simulator.install() puts it in place of CPython's _thread, anything not faked here comes from the real module """
+
+import threading
+
+import vclock
+
+
+def __getattr__(name):
+    return getattr(threading._thread, name)
+
+
+class LockType:
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def acquire(self, waitflag=1, timeout=-1):
+        # the other core only runs while this one waits on the virtual clock, so spin on virtual time
+        while not self._lock.acquire(False):
+            if not waitflag:
+                return False
+            vclock.advance(1)
+        return True
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def allocate_lock():
+    return LockType()
+
+
+def start_new_thread(function, args, kwargs=None):
+    core = vclock.Core(function, args, kwargs or {})
+    return core.thread.ident
+
+
+def get_ident():
+    return threading.get_ident()
+
+
+def stack_size(size=None):
+    return 4096
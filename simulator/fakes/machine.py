@@ -0,0 +1,271 @@
+""" Fake machine module for running the firmware on CPython. Peripherals keep class level registries so the
+simulator can drive inputs (pins, ADC levels) and inspect outputs (pin levels, I2C traffic) """
+
+import vclock
+
+
+slept_us = 0 # time spent in lightsleep
+sleeps = 0
+
+
+def reset_all():
+    """ Forgets all peripherals, used between simulations """
+    global slept_us, sleeps
+    slept_us = sleeps = 0
+    Pin.pins = {}
+    ADC.sources = {}
+    I2C.devices = {}
+    I2C.reset_traffic()
+    Timer.active = set()
+    vclock.reset()
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+    IRQ_LOW_LEVEL = 1
+    IRQ_HIGH_LEVEL = 2
+
+    pins = {} # id -> last Pin created for it
+    irqs = 0 # IRQ handlers run, lightsleep ends when this changes
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.mode = mode
+        self.pull = pull
+        self._value = 0 if value is None else value
+        self._handler = None
+        self._trigger = 0
+        self._wake = False
+
+        previous = Pin.pins.get(id)
+        if previous is not None and value is None:
+            self._value = previous._value
+        Pin.pins[id] = self
+
+    def init(self, mode=-1, pull=-1, value=None):
+        self.mode = mode
+        self.pull = pull
+        if value is not None:
+            self._value = value
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = 1 if value else 0
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    def toggle(self):
+        self._value ^= 1
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False, wake=None):
+        self._handler = handler
+        self._trigger = trigger
+        self._wake = bool(wake)
+
+    @classmethod
+    def get(cls, id):
+        return cls.pins[id]
+
+    def drive(self, value):
+        """ Simulator side: external circuit sets the level of an input pin, IRQ handler runs on matching edge """
+        value = 1 if value else 0
+        if value == self._value:
+            return
+
+        self._value = value
+        edge = Pin.IRQ_RISING if value else Pin.IRQ_FALLING
+        if self._handler is not None and self._trigger & edge:
+            Pin.irqs += 1
+            self._handler(self)
+
+
+class ADC:
+    CORE_TEMP = 4
+
+    sources = {} # pin id -> int or callable returning raw u16 value
+
+    def __init__(self, pin):
+        self.id = pin.id if isinstance(pin, Pin) else pin
+        self.reads = 0
+
+    def read_u16(self):
+        self.reads += 1
+        vclock.advance(2, blocking=True, hold=True) # conversion time
+        source = ADC.sources.get(self.id, 0)
+        value = source() if callable(source) else source
+        return max(0, min(0xFFFF, int(value)))
+
+
+class I2C:
+    devices = {} # address -> device with write(data, start_us, byte_us)
+
+    # traffic of all buses since reset_traffic
+    bytes_written = 0
+    transactions = 0
+    log = []
+    record = False # keep every transaction in log
+
+    def __init__(self, id=0, scl=None, sda=None, freq=400000):
+        self.id = id
+        self.freq = freq
+
+    @classmethod
+    def reset_traffic(cls):
+        cls.bytes_written = 0
+        cls.transactions = 0
+        cls.log = []
+
+    def scan(self):
+        return sorted(I2C.devices)
+
+    def writeto(self, addr, buf, stop=True):
+        data = bytes(buf)
+        device = I2C.devices.get(addr)
+
+        # address byte plus data, 9 clocks per byte
+        byte_us = 9 * 1_000_000 / self.freq
+        start_us = vclock.now_us + byte_us
+
+        I2C.bytes_written += len(data)
+        I2C.transactions += 1
+        if I2C.record:
+            I2C.log.append((addr, data))
+
+        vclock.advance(byte_us * (len(data) + 1), blocking=True, hold=True)
+
+        if device is None:
+            raise OSError(5) # EIO, no ACK
+        device.write(data, start_us, byte_us)
+        return len(data)
+
+    def readfrom(self, addr, nbytes, stop=True):
+        device = I2C.devices.get(addr)
+        if device is None:
+            raise OSError(5)
+        return device.read(nbytes)
+
+
+class RTC:
+    def datetime(self, value=None):
+        """ (year, month, day, weekday, hours, minutes, seconds, subseconds) """
+        import utime
+
+        if value is None:
+            year, month, mday, hour, minute, second, weekday, yearday = utime.gmtime(vclock.seconds())
+            return (year, month, mday, weekday, hour, minute, second, 0)
+
+        year, month, mday, weekday, hour, minute, second = value[:7]
+        seconds = utime.mktime((year, month, mday, hour, minute, second, 0, 0))
+        vclock.rtc_base = seconds - vclock.now_us // 1_000_000
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    active = set()
+
+    def __init__(self, id=-1, mode=PERIODIC, period=-1, freq=-1, callback=None):
+        self.callback = None
+        self.period_us = 0
+        self.mode = mode
+        self.fired = 0
+        if callback is not None:
+            self.init(mode=mode, period=period, freq=freq, callback=callback)
+
+    def init(self, mode=PERIODIC, period=-1, freq=-1, callback=None):
+        self.deinit()
+        self.mode = mode
+        self.callback = callback
+        self.period_us = int(1_000_000 / freq) if freq > 0 else int(period * 1000)
+        Timer.active.add(self)
+        self.due_us = vclock.now_us + self.period_us
+        vclock.schedule(self, self.due_us)
+
+    def deinit(self):
+        if self in Timer.active:
+            Timer.active.discard(self)
+            vclock.cancel(self)
+
+    def _fire(self):
+        # the hardware alarm keeps its period even when the callback runs late
+        if self.mode == Timer.PERIODIC:
+            self.due_us += self.period_us
+            vclock.schedule(self, self.due_us)
+        else:
+            Timer.active.discard(self)
+
+        self.fired += 1
+        if self.callback is not None:
+            self.callback(self)
+
+
+class PWM:
+    def __init__(self, pin, freq=None, duty_u16=None):
+        self.pin = pin
+        self._freq = freq or 1000
+        self._duty = duty_u16 or 0
+
+    def freq(self, value=None):
+        if value is None:
+            return self._freq
+        self._freq = value
+
+    def duty_u16(self, value=None):
+        if value is None:
+            return self._duty
+        self._duty = value
+
+    def deinit(self):
+        self._duty = 0
+
+
+def freq(value=None):
+    return 125_000_000
+
+
+def unique_id():
+    return b'\xe6\x61\x41\x04\x03\x1f\x2a\x2b'
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state=0):
+    pass
+
+
+def idle():
+    pass
+
+
+def lightsleep(ms=None):
+    """ Time passes until ms are up or a pin IRQ ran, on the rp2 every enabled GPIO IRQ ends light sleep. Only pin
+    changes scheduled on the virtual clock (e.g. from a Timer) can wake it, nothing else runs meanwhile """
+    global slept_us, sleeps
+    irqs = Pin.irqs
+    slept_us += vclock.advance((24 * 3600_000 if ms is None else ms) * 1000, until=lambda: Pin.irqs != irqs)
+    sleeps += 1
+
+
+def deepsleep(ms=None):
+    raise SystemExit('deepsleep')
+
+
+def reset():
+    raise SystemExit('reset')
@@ -0,0 +1,18 @@
+""" Fake micropython module """
+
+
+def const(value):
+    return value
+
+
+def schedule(function, arg):
+    """ Scheduled callbacks run right away, the simulator has no interrupts to return from """
+    function(arg)
+
+
+def mem_info(*args):
+    pass
+
+
+def opt_level(*args):
+    return 0
@@ -0,0 +1,53 @@
+""" Fake network module, the access point answers after connect_delay_ms unless it is down """
+
+import vclock
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_WRONG_PASSWORD = -3
+STAT_NO_AP_FOUND = -2
+STAT_CONNECT_FAIL = -1
+STAT_GOT_IP = 3
+
+access_point_up = True # set False to simulate router being down
+connect_delay_ms = 2_000
+
+
+class WLAN:
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._active = False
+        self._connect_started = None
+        self.connect_calls = 0
+
+    def active(self, value=None):
+        if value is None:
+            return self._active
+        self._active = bool(value)
+
+    def connect(self, ssid=None, key=None):
+        self.connect_calls += 1
+        self._connect_started = vclock.now_us
+
+    def disconnect(self):
+        self._connect_started = None
+
+    def status(self):
+        if self._connect_started is None:
+            return STAT_IDLE
+        if not access_point_up:
+            return STAT_NO_AP_FOUND if vclock.now_us - self._connect_started > connect_delay_ms * 1000 else STAT_CONNECTING
+        if vclock.now_us - self._connect_started < connect_delay_ms * 1000:
+            return STAT_CONNECTING
+        return STAT_GOT_IP
+
+    def isconnected(self):
+        return self._active and self.status() == STAT_GOT_IP
+
+    def ifconfig(self):
+        if self.isconnected():
+            return ('192.168.1.50', '255.255.255.0', '192.168.1.1', '192.168.1.1')
+        return ('0.0.0.0', '0.0.0.0', '0.0.0.0', '0.0.0.0')
@@ -0,0 +1,28 @@
+""" Fake ntptime, settime sets the RTC unless the simulated server is unreachable """
+
+import machine
+import vclock
+
+host = 'pool.ntp.org'
+timeout = 1
+reachable = True # set False to simulate missing network
+server_time = None # MicroPython epoch seconds the server reports, None keeps current RTC time
+requests = 0
+
+
+def time():
+    global requests
+    requests += 1
+    vclock.advance(20_000, blocking=True) # round trip
+
+    if not reachable:
+        raise OSError(110) # ETIMEDOUT
+
+    return vclock.seconds() if server_time is None else server_time + vclock.now_us // 1_000_000
+
+
+def settime():
+    t = time()
+    import utime
+    year, month, mday, hour, minute, second, weekday, yearday = utime.gmtime(t)
+    machine.RTC().datetime((year, month, mday, weekday, hour, minute, second, 0))
@@ -0,0 +1,70 @@
+""" Fake uasyncio on top of asyncio. The event loop runs on the virtual clock, so waiting for a timer moves
+virtual time forward instead of sleeping. Sockets still work, the loop only blocks when nothing is scheduled """
+
+import asyncio
+import math
+import selectors
+from asyncio import (CancelledError, Event, Lock, TimeoutError, create_task, gather, get_event_loop, sleep,
+                     start_server, open_connection, wait_for)
+
+import vclock
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    def select(self, timeout=None):
+        events = super().select(0 if timeout is not None else None)
+        if not events and timeout:
+            vclock.advance(math.ceil(timeout * 1_000_000))
+        return events
+
+
+class VirtualLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        super().__init__(_VirtualSelector())
+
+    def time(self):
+        return vclock.now_us / 1_000_000
+
+
+def new_event_loop():
+    loop = VirtualLoop()
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+def run(coro):
+    loop = new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        # background tasks the coroutine started are cancelled, so simulations can be run one after another
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep(ms / 1000)
+
+
+async def wait_for_ms(awaitable, timeout):
+    return await asyncio.wait_for(awaitable, timeout / 1000)
+
+
+class ThreadSafeFlag:
+    """ Flag that can be set from IRQs, wait() clears it """
+
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
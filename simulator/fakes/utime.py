@@ -0,0 +1,69 @@
+""" Fake utime running on the virtual clock, sleeping returns immediately and moves time forward """
+
+import calendar
+import time as _time
+
+import vclock
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+
+def sleep(seconds):
+    vclock.advance(seconds * 1_000_000, blocking=True)
+
+
+def sleep_ms(ms):
+    vclock.advance(ms * 1000, blocking=True)
+
+
+def sleep_us(us):
+    vclock.advance(us, blocking=True, hold=True) # busy wait, scheduled callbacks do not run meanwhile
+
+
+def ticks_us():
+    return vclock.now_us & TICKS_MAX
+
+
+def ticks_ms():
+    return (vclock.now_us // 1000) & TICKS_MAX
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+
+def time():
+    return vclock.seconds()
+
+
+def time_ns():
+    return (vclock.rtc_base * 1_000_000 + vclock.now_us) * 1000
+
+
+def gmtime(secs=None):
+    """ (year, month, mday, hour, minute, second, weekday, yearday) with weekday 0 = Monday """
+    if secs is None:
+        secs = vclock.seconds()
+    t = _time.gmtime(secs + vclock.EPOCH_OFFSET)
+    return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, t.tm_wday, t.tm_yday)
+
+
+localtime = gmtime
+
+
+def mktime(tuple_8):
+    """ Inverse of localtime, like MicroPython only the first six fields are used """
+    year, month, mday, hour, minute, second = tuple_8[:6]
+    year += (month - 1) // 12
+    month = (month - 1) % 12 + 1
+    return calendar.timegm((year, month, 1, hour, minute, second)) + (mday - 1) * 86400 - vclock.EPOCH_OFFSET
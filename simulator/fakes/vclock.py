@@ -0,0 +1,138 @@
+""" Virtual clock shared by the fake modules. Nothing in the simulator waits for real time, sleeping just moves
+the clock forward and fires whatever timers became due on the way.
+
+A thread started through the fake _thread stands for the second core. It runs in lockstep with the main thread:
+while it runs the main thread waits, and when it sleeps it is put on the timer heap like a timer and the main thread
+carries on. Both cores see the same virtual time and runs are repeatable """
+
+import heapq
+import threading
+
+EPOCH_OFFSET = 946684800 # seconds between 1970-01-01 and MicroPython's 2000-01-01 epoch
+
+now_us = 0 # virtual time since power on
+blocked_us = 0 # virtual time spent in blocking calls (sleeps, bus transfers)
+rtc_base = 757382400 # MicroPython epoch seconds at now_us == 0, 2024-01-01 00:00:00
+
+_timers = [] # heap of (due_us, sequence, timer)
+_sequence = 0
+_cores = {} # thread ident -> Core
+
+
+def reset(rtc_seconds=757382400):
+    """ Starts a new simulation at power on """
+    global now_us, blocked_us, rtc_base, _timers
+    for core in list(_cores.values()):
+        core.stop()
+    now_us = 0
+    blocked_us = 0
+    rtc_base = rtc_seconds
+    _timers = []
+
+
+class _Stopped(BaseException):
+    """ Raised in a core's thread to end it when the simulation is reset """
+
+
+class Core:
+    """ Second core running function(*args, **kwargs) on a thread, see module docstring """
+
+    def __init__(self, function, args=(), kwargs=None):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.resumed = threading.Semaphore(0)
+        self.paused = threading.Semaphore(0)
+        self.stopping = False
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        _cores[self.thread.ident] = self
+        schedule(self, now_us)
+
+    def _run(self):
+        self.resumed.acquire()
+        try:
+            if not self.stopping:
+                self.function(*self.args, **self.kwargs)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            self.error = e
+        finally:
+            _cores.pop(threading.get_ident(), None)
+            self.paused.release()
+
+    def _fire(self):
+        """ Lets the core run until it sleeps again, errors on the core fail the main thread """
+        self.resumed.release()
+        self.paused.acquire()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def sleep(self, us):
+        """ Called on the core's thread, hands over to the main thread until us have passed """
+        schedule(self, now_us + us)
+        self.paused.release()
+        self.resumed.acquire()
+        if self.stopping:
+            raise _Stopped()
+
+    def stop(self):
+        self.stopping = True
+        if self.thread.is_alive():
+            self.resumed.release()
+            self.thread.join()
+
+
+def schedule(timer, due_us):
+    """ Calls timer._fire() once virtual time reaches due_us """
+    global _sequence
+    _sequence += 1
+    heapq.heappush(_timers, (due_us, _sequence, timer))
+
+
+def cancel(timer):
+    global _timers
+    _timers = [entry for entry in _timers if entry[2] is not timer]
+    heapq.heapify(_timers)
+
+
+def advance(us, blocking=False, hold=False, until=None):
+    """ Moves time forward by us microseconds, firing due timers in order. With hold the CPU is busy the whole time
+    (bus transfers, sleep_us), like soft IRQs on the Pico the timers then only run once it is done. The second
+    core keeps running either way. On the second core's thread this is a sleep of that core. If until returns
+    True after a timer fired, time stops there. Returns the time that passed """
+    global now_us, blocked_us
+    core = _cores.get(threading.get_ident())
+    if core is not None:
+        core.sleep(int(us))
+        return int(us)
+
+    target = now_us + int(us)
+    if blocking:
+        blocked_us += int(us)
+
+    start_us = now_us
+    held = []
+    while _timers and _timers[0][0] <= target:
+        due, _, timer = heapq.heappop(_timers)
+        now_us = max(now_us, due)
+        if hold and not isinstance(timer, Core):
+            held.append(timer)
+        else:
+            timer._fire()
+            if until is not None and until():
+                target = now_us
+                break
+
+    now_us = target
+    for timer in held:
+        timer._fire()
+    return now_us - start_us
+
+
+def seconds():
+    """ Wall clock in MicroPython epoch seconds """
+    return rtc_base + now_us // 1_000_000
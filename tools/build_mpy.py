@@ -0,0 +1,62 @@
+""" Precompiles the firmware to .mpy files, which the Pico imports without parsing and compiling the source, so
+startup is faster and uses less heap. Output folder holds everything to copy to the board:
+
+    python tools/build_mpy.py                      needs mpy-cross matching the firmware, pip install mpy-cross
+    python tools/build_mpy.py --mpy-cross ~/micropython/mpy-cross/build/mpy-cross
+
+MicroPython prefers module.py over module.mpy, so delete the .py files of compiled modules from the board.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+FIRMWARE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'micropython')
+
+# run by name by MicroPython, or meant to be edited on the board
+SOURCE_ONLY = ('boot.py', 'main.py', 'secrets.py')
+DATA = ('settings.json',)
+
+
+def build(out, mpy_cross='mpy-cross', march=None):
+    """ Compiles firmware modules into out, copies the rest. Returns list of files written """
+    os.makedirs(out, exist_ok=True)
+    written = []
+
+    for name in sorted(os.listdir(FIRMWARE)):
+        source = os.path.join(FIRMWARE, name)
+        if name in SOURCE_ONLY or name in DATA:
+            shutil.copy(source, out)
+            written.append(name)
+        elif name.endswith('.py'):
+            target = os.path.join(out, name[:-3] + '.mpy')
+            command = [mpy_cross, '-o', target, '-s', name]
+            if march:
+                command.append(f"-march={march}")
+            subprocess.run(command + [source], check=True)
+            written.append(os.path.basename(target))
+
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default='build', help='output folder, default build')
+    parser.add_argument('--mpy-cross', default='mpy-cross', help='mpy-cross executable')
+    parser.add_argument('--march', help='architecture for native code, armv6m for the Pico')
+    args = parser.parse_args(argv)
+
+    if shutil.which(args.mpy_cross) is None:
+        print(f"{args.mpy_cross} not found, install it with 'pip install mpy-cross' using the version that matches "
+              "the MicroPython firmware on the board", file=sys.stderr)
+        return 1
+
+    for name in build(args.out, args.mpy_cross, args.march):
+        print(os.path.join(args.out, name))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())